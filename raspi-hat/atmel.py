@@ -17,15 +17,24 @@ Example usage:
 >>> matrix.set_low_light()  # use low-light gamma correction
 """
 
-from pyb import I2C
 import pyb
 import array
+from micropython import const
+from regmap import RegMap, BF_POS, BF_LEN
 import font8x8vmsb as f
 
+RPISENSE_FB = const(0x00)
+RPISENSE_VER = const(0xF1)
+RPISENSE_KEYS = const(0xF2)
+
+# the Atmel auto increments its register address on every transfer
+LAYOUT = {
+    'VER':      RPISENSE_VER | 0 << BF_POS | 8 << BF_LEN,
+    'KEYS':     RPISENSE_KEYS | 0 << BF_POS | 8 << BF_LEN,
+}
+BLOCKS = ((RPISENSE_FB, 192),)
+
 class SenseAtmel:
-    RPISENSE_FB = const(0x00)
-    RPISENSE_VER = const(0xF1)
-    RPISENSE_KEYS = const(0xF2)
     RPISENSE_ID = 's' 
 
     # joystick values from register RPISENSE_KEYS
@@ -56,9 +65,11 @@ class SenseAtmel:
         self.i2c = i2c
         self.addr = addr
         self.gamma = self.GAMMA_NORMAL
-        # buffer for LED data
-        self.vmem = array.array('B',[0 for  i in range(0,192)])
-        self.vmem_mv = memoryview(self.vmem)
+        # the LED data is the shadow of the framebuffer registers, refresh only
+        # sends the range of bytes changed since the last refresh
+        self.regs = RegMap(i2c, addr, LAYOUT, BLOCKS, autoinc=0)
+        self.vmem, ofs = self.regs.buffer(RPISENSE_FB)
+        self.regs.touch(RPISENSE_FB, 192)
         self.refresh()
         
     def read_key(self):
@@ -66,13 +77,16 @@ class SenseAtmel:
         returns onboard joystick state 
         valid return values are KEY_xxx integer values
         """
-        return int.from_bytes(self.i2c.mem_read(1, self.address, RPISENSE_KEYS))
+        return self.regs.read('KEYS')
         
     def clear(self):
         """ 
         clears LED matrix 
         """
-        self.vmem = array.array('B',[0 for  i in range(0,192)])
+        vmem = self.vmem
+        for i in range(192):
+            vmem[i] = 0
+        self.regs.touch(RPISENSE_FB, 192)
         self.refresh()
         
     def scroll(self, dir = 'up'):
@@ -80,7 +94,8 @@ class SenseAtmel:
         scrolls matrix in the given direction and empties the scrolled line
         takes ca. 1.5msec 
         """
-        vmem = self.vmem_mv
+        vmem = self.vmem
+        self.regs.touch(RPISENSE_FB, 192)
         if dir == 'up':
             for x in range(8):
                 for y in range(0,7):
@@ -174,15 +189,20 @@ class SenseAtmel:
         """
         assert x<8, "x range exceeded (>=8)"
         assert y<8, "y range exceeded (>=8)"
-        self.vmem[24*y+x] = self.gamma[color[0] & 0x1F]
-        self.vmem[24*y+x+8] = self.gamma[color[1] & 0x1F]
-        self.vmem[24*y+x+16] = self.gamma[color[2] & 0x1F]
+        vmem = self.vmem
+        pos = 24*y+x
+        for k in range(3):
+            v = self.gamma[color[k] & 0x1F]
+            if vmem[pos] != v:
+                vmem[pos] = v
+                self.regs.touch(pos)
+            pos += 8
         if refresh: self.refresh()
 
     def refresh(self):
         """ 
-        refresh matrix data
-        takes ca.5msec  
+        refresh matrix data (only the bytes changed since the last refresh)
+        takes ca.5msec for the full matrix, nothing if unchanged
         """
-        self.i2c.writeto_mem(self.addr, 0, self.vmem)
+        self.regs.flush()
             
@@ -0,0 +1,99 @@
+"""
+Attitude outputs derived from the quaternion of a fusion.Fusion instance
+
+Every quantity is computed on first access after a quaternion update and then
+cached until the next update, so reading heading, pitch and roll (or any of
+the vectors) several times per frame costs the trigonometry only once.
+Fusion replaces its q tuple on every update, so a changed identity of
+fusion.q is all that is needed to invalidate the cache. The cached heading is
+the magnetic one, Fusion.declination is added on every read so a changed
+declination shows up without an update.
+
+Available outputs:
+- heading, pitch, roll: degrees (same as Fusion.heading/pitch/roll)
+- rotation_matrix: 3x3 tuple of rows, rotates sensor frame vectors into the
+  earth frame (x north, z up)
+- gravity: direction of gravity in the sensor frame in g (what the
+  accelerometer reads when not accelerating)
+- linear_accel: last accelerometer sample with gravity removed, sensor frame, g
+
+Example usage:
+>>> fuse = Fusion()
+>>> fuse.update(accel, gyro, mag)
+>>> fuse.attitude.heading, fuse.attitude.pitch     # computed once
+>>> fuse.attitude.roll                              # cached
+>>> fuse.attitude.linear_accel
+(0.0012, -0.031, 0.0004)
+"""
+from math import atan2, asin, degrees
+
+class Attitude:
+    def __init__(self, fusion):
+        self.fusion = fusion
+        self._q = None                      # quaternion the cached values belong to
+        self._matrix = None
+        self._euler = None
+        self._linear = None
+
+    def _valid(self):
+        """ drops all cached values if the quaternion changed since they were computed """
+        q = self.fusion.q
+        if q is not self._q:
+            self._q = q
+            self._matrix = self._euler = self._linear = None
+
+    @property
+    def rotation_matrix(self):
+        self._valid()
+        if self._matrix is None:
+            q1, q2, q3, q4 = self._q
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+            q4q4 = q4 * q4
+            q1q2 = q1 * q2
+            q1q3 = q1 * q3
+            q1q4 = q1 * q4
+            q2q3 = q2 * q3
+            q2q4 = q2 * q4
+            q3q4 = q3 * q4
+            self._matrix = (
+                (q1q1 + q2q2 - q3q3 - q4q4, 2.0 * (q2q3 - q1q4), 2.0 * (q2q4 + q1q3)),
+                (2.0 * (q2q3 + q1q4), q1q1 - q2q2 + q3q3 - q4q4, 2.0 * (q3q4 - q1q2)),
+                (2.0 * (q2q4 - q1q3), 2.0 * (q3q4 + q1q2), q1q1 - q2q2 - q3q3 + q4q4))
+        return self._matrix
+
+    def _angles(self):
+        self._valid()
+        if self._euler is None:
+            m = self.rotation_matrix
+            self._euler = (degrees(atan2(m[1][0], m[0][0])),
+                           degrees(-asin(max(-1.0, min(1.0, m[2][0])))),
+                           degrees(atan2(m[2][1], m[2][2])))
+        return self._euler
+
+    @property
+    def heading(self):
+        return self.fusion.declination + self._angles()[0]
+
+    @property
+    def pitch(self):
+        return self._angles()[1]
+
+    @property
+    def roll(self):
+        return self._angles()[2]
+
+    @property
+    def gravity(self):
+        """ gravity direction in the sensor frame: last row of the rotation matrix """
+        return self.rotation_matrix[2]
+
+    @property
+    def linear_accel(self):
+        self._valid()
+        if self._linear is None:
+            a = self.fusion.accel
+            g = self.rotation_matrix[2]
+            self._linear = (a[0] - g[0], a[1] - g[1], a[2] - g[2])
+        return self._linear
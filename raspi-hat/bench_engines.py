@@ -0,0 +1,172 @@
+"""
+Cost and accuracy benchmark of the attitude engines in engines.py
+
+Every engine runs over the same datasets with the 6DOF (update_nomag) and the
+9DOF (update) step. For each run the update cost in us per step is reported
+together with the heading/pitch/roll error:
+- synthetic datasets are generated from a known motion, errors are against
+  the true attitude; 'conv' is the time until the error stays below 2 deg
+- recorded logs (fusion_replay csv format) have no ground truth, errors are
+  against the Madgwick engine on the same data
+
+On the target the cost is measured with profile.timed_function, on the host
+with time.perf_counter.
+
+Host:   python3 bench_engines.py [log.csv ...]
+Target: >>> import bench_engines; bench_engines.main()
+"""
+import sys
+import time
+from math import sin, cos, sqrt, atan2, asin, degrees, radians
+import engines
+
+# the pyb stand-in of host/ may be importable on the host: decide by the implementation
+TARGET = sys.implementation.name == 'micropython'
+if TARGET:
+    import profile
+
+ENGINES = (('madgwick', engines.Madgwick), ('mahony', engines.Mahony), ('complementary', engines.Complementary))
+CONVERGED_DEG = 2
+
+def _qmul(a, b):
+    w1, x1, y1, z1 = a
+    w2, x2, y2, z2 = b
+    return (w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2, w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2, w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2)
+
+def _to_sensor(q, v):
+    """ rotates an earth frame vector into the sensor frame """
+    r = _qmul(_qmul((q[0], -q[1], -q[2], -q[3]), (0, v[0], v[1], v[2])), q)
+    return r[1], r[2], r[3]
+
+def euler(q):
+    """ heading, pitch, roll in degrees (same formulas as fusion.Fusion) """
+    q1, q2, q3, q4 = q
+    return (degrees(atan2(2.0 * (q2 * q3 + q1 * q4), q1 * q1 + q2 * q2 - q3 * q3 - q4 * q4)),
+            degrees(-asin(max(-1.0, min(1.0, 2.0 * (q2 * q4 - q1 * q3))))),
+            degrees(atan2(2.0 * (q1 * q2 + q3 * q4), q1 * q1 - q2 * q2 - q3 * q3 + q4 * q4)))
+
+def synthetic(n=3000, rate=500, amplitude=1.0, q0=(0.8660254, 0.0, 0.0, 0.5)):
+    """
+    returns (samples, truth, deltat): samples are (accel, gyro, mag) tuples in
+    g, deg/s and gauss, truth the heading/pitch/roll of every sample. The
+    motion starts at q0 (60 deg heading) and swings around all axes,
+    amplitude scales the angular rates. Reproducible, no random noise.
+    """
+    dt = 1 / rate
+    q = q0
+    samples = []
+    truth = []
+    for i in range(n):
+        t = i * dt
+        w = (amplitude * 0.8 * sin(1.3 * t), amplitude * 0.6 * cos(0.9 * t), amplitude * 0.5 * sin(0.4 * t))
+        dq = _qmul(q, (0, w[0], w[1], w[2]))
+        q = tuple(a + 0.5 * b * dt for a, b in zip(q, dq))
+        norm = 1 / sqrt(sum(a * a for a in q))
+        q = tuple(a * norm for a in q)
+        # deterministic pseudo noise: vibration on accel, small offsets on the gyro
+        vib = 0.02 * sin(97 * t)
+        a = _to_sensor(q, (0, 0, 1))
+        samples.append(((a[0] + vib, a[1] - vib, a[2]),
+                        tuple(degrees(x) + 0.2 * sin(53 * t + k) for k, x in enumerate(w)),
+                        _to_sensor(q, (0.3, 0, -0.4))))
+        truth.append(euler(q))
+    return samples, truth, dt
+
+def load(path):
+    """ reads a fusion_replay csv log without NumPy, returns (samples, deltat list) """
+    samples = []
+    deltat = []
+    last = None
+    with open(path) as f:
+        for line in f:
+            v = [float(x) for x in line.split(',')]
+            if len(v) < 7:
+                continue
+            deltat.append(0 if last is None else (v[0] - last) / 1000000)
+            last = v[0]
+            samples.append((tuple(v[1:4]), tuple(v[4:7]), tuple(v[7:10]) if len(v) >= 10 else None))
+    return samples, deltat
+
+def run(engine, samples, deltat, use_mag):
+    """ runs an engine over a dataset, returns the list of quaternions """
+    q = (1.0, 0.0, 0.0, 0.0)
+    out = []
+    for i, (a, g, m) in enumerate(samples):
+        dt = deltat[i] if isinstance(deltat, list) else deltat
+        gx, gy, gz = radians(g[0]), radians(g[1]), radians(g[2])
+        if use_mag:
+            r = engine.update(q, a[0], a[1], a[2], gx, gy, gz, m[0], m[1], m[2], dt)
+        else:
+            r = engine.update_nomag(q, a[0], a[1], a[2], gx, gy, gz, dt)
+        if r is not None:
+            q = r
+        out.append(q)
+    return out
+
+def cost(engine, samples, deltat, use_mag, n=200):
+    """ us per update step of an engine """
+    n = min(n, len(samples))
+    part = samples[:n]
+    if TARGET:
+        profile.timed_function(run)(engine, part, deltat, use_mag)
+        return profile.last_us / n
+    t = time.perf_counter()
+    run(engine, part, deltat, use_mag)
+    return (time.perf_counter() - t) * 1000000 / n
+
+def errors(est, ref, deltat, use_mag):
+    """ max / rms error of (heading, pitch, roll) and time to converge in seconds """
+    maxe = [0, 0, 0]
+    sq = [0, 0, 0]
+    conv = 0
+    t = 0
+    for i, (e, r) in enumerate(zip(est, ref)):
+        t += deltat[i] if isinstance(deltat, list) else deltat
+        d = [e[k] - r[k] for k in range(3)]
+        d[0] = (d[0] + 180) % 360 - 180     # heading wraps around
+        if not use_mag:
+            d[0] = 0                        # heading is not observable without mag
+        worst = max(abs(x) for x in d)
+        if worst >= CONVERGED_DEG:
+            conv = t
+        for k in range(3):
+            maxe[k] = max(maxe[k], abs(d[k]))
+            sq[k] += d[k] * d[k]
+    n = max(1, len(est))
+    return maxe, [sqrt(x / n) for x in sq], conv
+
+def compare(datasets):
+    """ prints cost and accuracy for each engine, dataset and update type """
+    print('{:<14}{:<12}{:<6}{:>9}{:>24}{:>24}{:>8}'.format(
+        'engine', 'dataset', 'mode', 'us/step', 'max err h/p/r', 'rms err h/p/r', 'conv'))
+    results = []
+    for dname, samples, truth, deltat in datasets:
+        has_mag = samples[0][2] is not None
+        for use_mag in ((False, True) if has_mag else (False,)):
+            ref = truth
+            if ref is None:
+                ref = [euler(q) for q in run(engines.Madgwick(), samples, deltat, use_mag)]
+            for ename, cls in ENGINES:
+                us = cost(cls(), samples, deltat, use_mag)
+                est = [euler(q) for q in run(cls(), samples, deltat, use_mag)]
+                maxe, rms, conv = errors(est, ref, deltat, use_mag)
+                results.append((ename, dname, use_mag, us, maxe, rms, conv))
+                print('{:<14}{:<12}{:<6}{:>9.1f}{:>24}{:>24}{:>8.2f}'.format(
+                    ename, dname, '9dof' if use_mag else '6dof', us,
+                    '{:.2f}/{:.2f}/{:.2f}'.format(*maxe), '{:.2f}/{:.2f}/{:.2f}'.format(*rms), conv))
+    return results
+
+def main(logs=()):
+    n = 1000 if TARGET else 5000
+    datasets = []
+    for name, amplitude in (('slow', 0.3), ('fast', 2.0)):
+        samples, truth, dt = synthetic(n, amplitude=amplitude)
+        datasets.append((name, samples, truth, dt))
+    for path in logs:
+        samples, deltat = load(path)
+        datasets.append((path.split('/')[-1][:11], samples, None, deltat))
+    return compare(datasets)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
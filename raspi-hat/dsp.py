@@ -0,0 +1,216 @@
+"""
+Streaming integer filters and decimators for multi channel sample bursts
+
+The stages work on frames of `width` int16 values (e.g. gx,gy,gz,ax,ay,az
+raw counts as drained by LSM9DS1.read_fifo into fifo_raw). All arithmetic
+is done on small integers and the state lives in preallocated arrays, so a
+stage doesn't allocate and can process each burst as it comes in:
+
+    m = stage.process(src, n, dst)
+
+reads n frames from src, writes m output frames to dst (array('h') with
+room for n frames) and returns m. A decimating stage keeps its phase across
+calls, so bursts of any size give the same result as one long stream. Outputs
+are rounded to the nearest count (halves up), not truncated, so a stage adds
+no DC bias.
+
+Stages:
+- MovingAverage: boxcar average over `length` samples, optional decimation
+- CIC: cascaded integrator comb decimator (order N, rate R), gain
+  compensated, the cheapest way to decimate by large factors
+- Biquad: second order IIR section with Q12 coefficients (Biquad.lowpass
+  designs a Butterworth type low pass), optional decimation
+- Chain: runs several stages on internal buffers
+
+Example usage (952 Hz to 95.2 Hz):
+>>> from dsp import CIC, Biquad, Chain, iter_frames
+>>> dec = Chain(Biquad.lowpass(120, 952, width=6), CIC(6, rate=10, order=2))
+>>> out = array.array('h', bytes(2 * 6 * 32))
+>>> n = lsm.read_fifo()
+>>> m = dec.process(lsm.fifo_raw, n, out)      # m decimated frames in out
+>>> fuse.update_batch(iter_frames(out, m, (lsm.scale_gyro, lsm.scale_accel)), lsm.odr / dec.rate)
+"""
+import array
+from math import pi, sin, cos
+
+class MovingAverage:
+    def __init__(self, width=6, length=8, decimate=1):
+        self.width = width
+        self.length = length
+        self.rate = decimate
+        self.hist = array.array('h', [0] * (width * length))
+        self.sums = array.array('i', [0] * width)
+        self.pos = 0                        # oldest entry in hist
+        self.phase = 0                      # samples since the last output
+
+    def process(self, src, n, dst):
+        width = self.width
+        length = self.length
+        hist = self.hist
+        sums = self.sums
+        pos = self.pos
+        phase = self.phase
+        half = length >> 1                 # round half up instead of flooring
+        m = 0
+        o = 0
+        i = 0
+        for f in range(n):
+            h = pos * width
+            for c in range(width):
+                v = src[i + c]
+                sums[c] += v - hist[h + c]
+                hist[h + c] = v
+            pos += 1
+            if pos == length:
+                pos = 0
+            i += width
+            phase += 1
+            if phase >= self.rate:
+                phase = 0
+                for c in range(width):
+                    dst[o + c] = (sums[c] + half) // length
+                o += width
+                m += 1
+        self.pos = pos
+        self.phase = phase
+        return m
+
+class CIC:
+    MASK = 0x3fffffff                       # integrators wrap modulo 2^30 (small ints)
+    SIGN = 0x20000000
+
+    def __init__(self, width=6, rate=10, order=2):
+        """ decimates by rate with order integrator and comb stages (gain rate^order removed) """
+        assert rate ** order < 0x4000, "rate^order too large: %d" % rate ** order   # 16 + growth bits <= 30
+        self.width = width
+        self.rate = rate
+        self.order = order
+        self.gain = rate ** order
+        self.integ = array.array('i', [0] * (width * order))
+        self.comb = array.array('i', [0] * (width * order))    # delayed values of the comb stages
+        self.phase = 0
+
+    def process(self, src, n, dst):
+        width = self.width
+        order = self.order
+        integ = self.integ
+        comb = self.comb
+        mask = self.MASK
+        sign = self.SIGN
+        gain = self.gain
+        half = gain >> 1
+        phase = self.phase
+        m = 0
+        o = 0
+        i = 0
+        for f in range(n):
+            for c in range(width):
+                v = src[i + c]
+                k = c * order
+                for s in range(order):
+                    v = (integ[k + s] + v) & mask
+                    integ[k + s] = v
+            i += width
+            phase += 1
+            if phase == self.rate:
+                phase = 0
+                for c in range(width):
+                    k = c * order
+                    v = integ[k + order - 1]
+                    for s in range(order):
+                        d = (v - comb[k + s]) & mask
+                        comb[k + s] = v
+                        v = d
+                    if v & sign:
+                        v -= mask + 1
+                    dst[o + c] = (v + half) // gain
+                o += width
+                m += 1
+        self.phase = phase
+        return m
+
+class Biquad:
+    def __init__(self, b0, b1, b2, a1, a2, width=6, decimate=1):
+        """
+        y = b0 x + b1 x1 + b2 x2 - a1 y1 - a2 y2 with coefficients as Q12 integers
+        (multiply floats by 4096), direct form I. Q12 keeps the products of int16
+        samples within MicroPython's small ints.
+        """
+        self.coef = (b0, b1, b2, a1, a2)
+        self.width = width
+        self.rate = decimate
+        self.state = array.array('i', [0] * (4 * width))   # x1, x2, y1, y2 per channel
+        self.phase = 0
+
+    @classmethod
+    def lowpass(cls, fc, fs, q=0.7071, width=6, decimate=1):
+        """ low pass with cut off fc Hz at sample rate fs Hz (RBJ cookbook) """
+        w = 2 * pi * fc / fs
+        alpha = sin(w) / (2 * q)
+        a0 = 1 + alpha
+        c = cos(w)
+        b0 = (1 - c) / 2 / a0
+        return cls(round(b0 * 4096), round(2 * b0 * 4096), round(b0 * 4096),
+                   round(-2 * c / a0 * 4096), round((1 - alpha) / a0 * 4096), width, decimate)
+
+    def process(self, src, n, dst):
+        width = self.width
+        b0, b1, b2, a1, a2 = self.coef
+        st = self.state
+        phase = self.phase
+        m = 0
+        o = 0
+        i = 0
+        for f in range(n):
+            phase += 1
+            out = phase >= self.rate
+            for c in range(width):
+                k = 4 * c
+                x = src[i + c]
+                x1 = st[k]
+                y1 = st[k + 2]
+                y = (b0 * x + b1 * x1 + b2 * st[k + 1] - a1 * y1 - a2 * st[k + 3] + 2048) >> 12
+                st[k + 1] = x1
+                st[k] = x
+                st[k + 3] = y1
+                st[k + 2] = y
+                if out:
+                    dst[o + c] = 32767 if y > 32767 else -32768 if y < -32768 else y
+            i += width
+            if out:
+                phase = 0
+                o += width
+                m += 1
+        self.phase = phase
+        return m
+
+class Chain:
+    def __init__(self, *stages, depth=32):
+        """ depth: maximum frames per process call (size of the internal buffers) """
+        self.stages = stages
+        self.depth = depth
+        self.rate = 1
+        for s in stages:
+            self.rate *= s.rate
+        width = stages[0].width
+        self.buf = (array.array('h', [0] * (width * depth)), array.array('h', [0] * (width * depth)))
+
+    def process(self, src, n, dst):
+        if n > self.depth:
+            raise ValueError("burst of %d frames exceeds the chain depth %d" % (n, self.depth))
+        last = len(self.stages) - 1
+        for k, s in enumerate(self.stages):
+            out = dst if k == last else self.buf[k & 1]
+            n = s.process(src, n, out)
+            src = out
+        return n
+
+def iter_frames(buf, m, scales=None, width=6):
+    """
+    yields the first m frames of buf as (gyro, accel) tuples, scaled by
+    scales=(gyro, accel) counts per unit (e.g. (lsm.scale_gyro, lsm.scale_accel))
+    """
+    fg, fa = scales if scales is not None else (1, 1)
+    for i in range(0, m * width, width):
+        yield ((buf[i] / fg, buf[i+1] / fg, buf[i+2] / fg),
+               (buf[i+3] / fa, buf[i+4] / fa, buf[i+5] / fa))
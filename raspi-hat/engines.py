@@ -0,0 +1,350 @@
+"""
+Attitude engines for fusion.Fusion
+
+An engine implements one filter step. Fusion takes care of timing, unit
+conversion and magnetometer bias, the engine only advances the quaternion:
+
+    engine.update(q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat) -> new q
+    engine.update_nomag(q, ax, ay, az, gx, gy, gz, deltat) -> new q
+
+q is the current quaternion (w, x, y, z), accel and mag in any unit (they are
+normalised), gyro in rad/s and deltat in seconds. A step returns None if the
+input can't be used (zero length accel or mag vector), Fusion then keeps the
+old quaternion. Engines are plain objects without dependencies on pyb so they
+can run on the host as well.
+
+Available engines, from most to least expensive:
+- Madgwick: gradient descent step (default, see fusion.py)
+- Mahony: PI controller on the cross product error of gravity (and mag)
+- Complementary: gyro integration with a proportional tilt correction and
+  a yaw-only magnetometer correction, no integral term and less square roots
+
+Example usage:
+>>> from fusion import Fusion
+>>> from engines import Mahony
+>>> fuse = Fusion(engine=Mahony(kp=0.5, ki=0.0))
+>>> fuse.update(accel, gyro, mag)
+"""
+from math import sqrt, radians
+
+class Madgwick:
+    """ gradient descent algorithm by S. Madgwick, beta is the filter gain """
+    def __init__(self, beta=None):
+        if beta is None:
+            GyroMeasError = radians(60)     # Original code indicates this leads to a 2 sec response time
+            beta = sqrt(3.0 / 4.0) * GyroMeasError  # compute beta (see README)
+        self.beta = beta
+
+    def update_nomag(self, q, ax, ay, az, gx, gy, gz, deltat):
+        q1, q2, q3, q4 = q                  # short name local variable for readability
+        # Auxiliary variables to avoid repeated arithmetic
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _4q1 = 4 * q1
+        _4q2 = 4 * q2
+        _4q3 = 4 * q3
+        _8q2 = 8 * q2
+        _8q3 = 8 * q3
+        q1q1 = q1 * q1
+        q2q2 = q2 * q2
+        q3q3 = q3 * q3
+        q4q4 = q4 * q4
+
+        # Normalise accelerometer measurement
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if (norm == 0):
+            return None # handle NaN
+        norm = 1 / norm        # use reciprocal for division
+        ax *= norm
+        ay *= norm
+        az *= norm
+
+        # Gradient decent algorithm corrective step
+        s1 = _4q1 * q3q3 + _2q3 * ax + _4q1 * q2q2 - _2q2 * ay
+        s2 = _4q2 * q4q4 - _2q4 * ax + 4 * q1q1 * q2 - _2q1 * ay - _4q2 + _8q2 * q2q2 + _8q2 * q3q3 + _4q2 * az
+        s3 = 4 * q1q1 * q3 + _2q1 * ax + _4q3 * q4q4 - _2q4 * ay - _4q3 + _8q3 * q2q2 + _8q3 * q3q3 + _4q3 * az
+        s4 = 4 * q2q2 * q4 - _2q2 * ax + 4 * q3q3 * q4 - _2q3 * ay
+        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
+        s1 *= norm
+        s2 *= norm
+        s3 *= norm
+        s4 *= norm
+
+        # Compute rate of change of quaternion
+        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz) - self.beta * s1
+        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy) - self.beta * s2
+        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx) - self.beta * s3
+        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx) - self.beta * s4
+
+        # Integrate to yield quaternion
+        q1 += qDot1 * deltat
+        q2 += qDot2 * deltat
+        q3 += qDot3 * deltat
+        q4 += qDot4 * deltat
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
+        return q1 * norm, q2 * norm, q3 * norm, q4 * norm
+
+    def update(self, q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat):
+        q1, q2, q3, q4 = q                  # short name local variable for readability
+        # Auxiliary variables to avoid repeated arithmetic
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _2q1q3 = 2 * q1 * q3
+        _2q3q4 = 2 * q3 * q4
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q1q4 = q1 * q4
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q2q4 = q2 * q4
+        q3q3 = q3 * q3
+        q3q4 = q3 * q4
+        q4q4 = q4 * q4
+
+        # Normalise accelerometer measurement
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if (norm == 0):
+            return None # handle NaN
+        norm = 1 / norm                     # use reciprocal for division
+        ax *= norm
+        ay *= norm
+        az *= norm
+
+        # Normalise magnetometer measurement
+        norm = sqrt(mx * mx + my * my + mz * mz)
+        if (norm == 0):
+            return None                     # handle NaN
+        norm = 1 / norm                     # use reciprocal for division
+        mx *= norm
+        my *= norm
+        mz *= norm
+
+        # Reference direction of Earth's magnetic field
+        _2q1mx = 2 * q1 * mx
+        _2q1my = 2 * q1 * my
+        _2q1mz = 2 * q1 * mz
+        _2q2mx = 2 * q2 * mx
+        hx = mx * q1q1 - _2q1my * q4 + _2q1mz * q3 + mx * q2q2 + _2q2 * my * q3 + _2q2 * mz * q4 - mx * q3q3 - mx * q4q4
+        hy = _2q1mx * q4 + my * q1q1 - _2q1mz * q2 + _2q2mx * q3 - my * q2q2 + my * q3q3 + _2q3 * mz * q4 - my * q4q4
+        _2bx = sqrt(hx * hx + hy * hy)
+        _2bz = -_2q1mx * q3 + _2q1my * q2 + mz * q1q1 + _2q2mx * q4 - mz * q2q2 + _2q3 * my * q4 - mz * q3q3 + mz * q4q4
+        _4bx = 2 * _2bx
+        _4bz = 2 * _2bz
+
+        # Gradient descent algorithm corrective step
+        s1 = (-_2q3 * (2 * q2q4 - _2q1q3 - ax) + _2q2 * (2 * q1q2 + _2q3q4 - ay) - _2bz * q3 * (_2bx * (0.5 - q3q3 - q4q4)
+             + _2bz * (q2q4 - q1q3) - mx) + (-_2bx * q4 + _2bz * q2) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
+             + _2bx * q3 * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
+
+        s2 = (_2q4 * (2 * q2q4 - _2q1q3 - ax) + _2q1 * (2 * q1q2 + _2q3q4 - ay) - 4 * q2 * (1 - 2 * q2q2 - 2 * q3q3 - az)
+             + _2bz * q4 * (_2bx * (0.5 - q3q3 - q4q4) + _2bz * (q2q4 - q1q3) - mx) + (_2bx * q3 + _2bz * q1) * (_2bx * (q2q3 - q1q4)
+             + _2bz * (q1q2 + q3q4) - my) + (_2bx * q4 - _4bz * q2) * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
+
+        s3 = (-_2q1 * (2 * q2q4 - _2q1q3 - ax) + _2q4 * (2 * q1q2 + _2q3q4 - ay) - 4 * q3 * (1 - 2 * q2q2 - 2 * q3q3 - az)
+             + (-_4bx * q3 - _2bz * q1) * (_2bx * (0.5 - q3q3 - q4q4) + _2bz * (q2q4 - q1q3) - mx)
+             + (_2bx * q2 + _2bz * q4) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
+             + (_2bx * q1 - _4bz * q3) * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
+
+        s4 = (_2q2 * (2 * q2q4 - _2q1q3 - ax) + _2q3 * (2 * q1q2 + _2q3q4 - ay) + (-_4bx * q4 + _2bz * q2) * (_2bx * (0.5 - q3q3 - q4q4)
+              + _2bz * (q2q4 - q1q3) - mx) + (-_2bx * q1 + _2bz * q3) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
+              + _2bx * q2 * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
+
+        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
+        s1 *= norm
+        s2 *= norm
+        s3 *= norm
+        s4 *= norm
+
+        # Compute rate of change of quaternion
+        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz) - self.beta * s1
+        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy) - self.beta * s2
+        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx) - self.beta * s3
+        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx) - self.beta * s4
+
+        # Integrate to yield quaternion
+        q1 += qDot1 * deltat
+        q2 += qDot2 * deltat
+        q3 += qDot3 * deltat
+        q4 += qDot4 * deltat
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
+        return q1 * norm, q2 * norm, q3 * norm, q4 * norm
+
+class Mahony:
+    """
+    Mahony's nonlinear complementary filter: the cross product between measured
+    and estimated reference directions drives a PI controller on the gyro rates.
+    kp, ki are the proportional and integral gains (ki=0 disables the gyro bias
+    estimation).
+    """
+    def __init__(self, kp=0.5, ki=0.0):
+        self.kp = kp
+        self.ki = ki
+        self.integral = [0.0, 0.0, 0.0]     # integral error (gyro bias estimate) in rad/s
+
+    def _step(self, q, gx, gy, gz, ex, ey, ez, deltat):
+        """ applies the PI feedback of the (half) error and integrates the rates """
+        q0, q1, q2, q3 = q
+        if self.ki > 0:
+            i = self.integral
+            k = 2 * self.ki * deltat
+            i[0] += k * ex
+            i[1] += k * ey
+            i[2] += k * ez
+            gx += i[0]
+            gy += i[1]
+            gz += i[2]
+        k = 2 * self.kp
+        gx += k * ex
+        gy += k * ey
+        gz += k * ez
+        # Integrate rate of change of quaternion
+        k = 0.5 * deltat
+        gx *= k
+        gy *= k
+        gz *= k
+        qa, qb, qc = q0, q1, q2
+        q0 += -qb * gx - qc * gy - q3 * gz
+        q1 += qa * gx + qc * gz - q3 * gy
+        q2 += qa * gy - qb * gz + q3 * gx
+        q3 += qa * gz + qb * gy - qc * gx
+        norm = 1 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)    # normalise quaternion
+        return q0 * norm, q1 * norm, q2 * norm, q3 * norm
+
+    def update_nomag(self, q, ax, ay, az, gx, gy, gz, deltat):
+        q0, q1, q2, q3 = q
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return None # handle NaN
+        norm = 1 / norm
+        ax *= norm
+        ay *= norm
+        az *= norm
+        # Estimated direction of gravity (half)
+        halfvx = q1 * q3 - q0 * q2
+        halfvy = q0 * q1 + q2 * q3
+        halfvz = q0 * q0 - 0.5 + q3 * q3
+        # Error is cross product between estimated and measured direction of gravity
+        return self._step(q, gx, gy, gz,
+                          ay * halfvz - az * halfvy,
+                          az * halfvx - ax * halfvz,
+                          ax * halfvy - ay * halfvx, deltat)
+
+    def update(self, q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat):
+        q0, q1, q2, q3 = q
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return None # handle NaN
+        norm = 1 / norm
+        ax *= norm
+        ay *= norm
+        az *= norm
+        norm = sqrt(mx * mx + my * my + mz * mz)
+        if norm == 0:
+            return None # handle NaN
+        norm = 1 / norm
+        mx *= norm
+        my *= norm
+        mz *= norm
+
+        # Auxiliary variables to avoid repeated arithmetic
+        q0q0 = q0 * q0
+        q0q1 = q0 * q1
+        q0q2 = q0 * q2
+        q0q3 = q0 * q3
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q3q3 = q3 * q3
+
+        # Reference direction of Earth's magnetic field
+        hx = 2 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+        hy = 2 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+        bx = sqrt(hx * hx + hy * hy)
+        bz = 2 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+
+        # Estimated direction of gravity and magnetic field (half)
+        halfvx = q1q3 - q0q2
+        halfvy = q0q1 + q2q3
+        halfvz = q0q0 - 0.5 + q3q3
+        halfwx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2)
+        halfwy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3)
+        halfwz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)
+
+        # Error is sum of cross product between estimated direction and measured direction of field vectors
+        return self._step(q, gx, gy, gz,
+                          (ay * halfvz - az * halfvy) + (my * halfwz - mz * halfwy),
+                          (az * halfvx - ax * halfvz) + (mz * halfwx - mx * halfwz),
+                          (ax * halfvy - ay * halfvx) + (mx * halfwy - my * halfwx), deltat)
+
+class Complementary:
+    """
+    Cheap complementary filter: integrates the gyro rates and pulls the
+    estimate towards the measured gravity with a time constant tau (seconds).
+    The magnetometer only corrects the heading, with time constant tau_mag.
+    Accel is assumed to be in g (close to unit length), so it is normalised
+    with a first order approximation instead of a square root.
+    """
+    def __init__(self, tau=1.0, tau_mag=2.0):
+        self.tau = tau
+        self.tau_mag = tau_mag
+
+    def _step(self, q, gx, gy, gz, deltat):
+        q0, q1, q2, q3 = q
+        k = 0.5 * deltat
+        gx *= k
+        gy *= k
+        gz *= k
+        qa, qb, qc = q0, q1, q2
+        q0 += -qb * gx - qc * gy - q3 * gz
+        q1 += qa * gx + qc * gz - q3 * gy
+        q2 += qa * gy - qb * gz + q3 * gx
+        q3 += qa * gz + qb * gy - qc * gx
+        # normalise quaternion, first order: the step is small
+        norm = 0.5 * (3 - (q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3))
+        return q0 * norm, q1 * norm, q2 * norm, q3 * norm
+
+    def _tilt(self, q, ax, ay, az):
+        """ returns the gravity error vector (measured x estimated), or None for zero accel """
+        q0, q1, q2, q3 = q
+        norm = ax * ax + ay * ay + az * az
+        if norm == 0:
+            return None # handle NaN
+        norm = 0.5 * (3 - norm) if 0.5 < norm < 1.5 else 1 / sqrt(norm)
+        ax *= norm
+        ay *= norm
+        az *= norm
+        vx = 2 * (q1 * q3 - q0 * q2)
+        vy = 2 * (q0 * q1 + q2 * q3)
+        vz = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+        return vx, vy, vz, ay * vz - az * vy, az * vx - ax * vz, ax * vy - ay * vx
+
+    def update_nomag(self, q, ax, ay, az, gx, gy, gz, deltat):
+        t = self._tilt(q, ax, ay, az)
+        if t is None:
+            return None
+        k = 1 / self.tau
+        return self._step(q, gx + k * t[3], gy + k * t[4], gz + k * t[5], deltat)
+
+    def update(self, q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat):
+        t = self._tilt(q, ax, ay, az)
+        if t is None:
+            return None
+        q0, q1, q2, q3 = q
+        # horizontal components of the mag vector in the earth frame
+        hx = mx * (0.5 - q2 * q2 - q3 * q3) + my * (q1 * q2 - q0 * q3) + mz * (q1 * q3 + q0 * q2)
+        hy = mx * (q1 * q2 + q0 * q3) + my * (0.5 - q1 * q1 - q3 * q3) + mz * (q2 * q3 - q0 * q1)
+        norm = hx * hx + hy * hy
+        if norm == 0:
+            return None # handle NaN
+        # heading error (sine) is applied around the vertical axis in the body frame
+        e = -hy / sqrt(norm) / self.tau_mag
+        k = 1 / self.tau
+        return self._step(q, gx + k * t[3] + e * t[0], gy + k * t[4] + e * t[1],
+                          gz + k * t[5] + e * t[2], deltat)
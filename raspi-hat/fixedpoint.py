@@ -0,0 +1,134 @@
+"""
+Compact fixed point sample format shared by the SenseHAT drivers
+
+A sample is a single small int that packs an integer mantissa and a decimal
+exponent:
+
+    fx = (mantissa << 8) | (exponent + 128)      value = mantissa * 10**exponent
+
+e.g. 27.046 degC from the HTS221 is mantissa 27046, exponent -3. Drivers
+created with fixed=True (HTS221, LPS25, LSM9DS1, uSenseHAT) return samples
+in this format, computed with integer arithmetic only, so no float is
+allocated in the acquisition path; conversion to float is left to where the
+value is displayed or stored. Mantissas up to +/-2^22 keep fx within the
+small int range of MicroPython.
+
+Raw sensor counts with a full scale range are converted with a scaler (an
+integer multiplier and the exponent, chosen so the mantissa has at least the
+resolution of the counts):
+
+    sc = scaler(245)                # +/-245 deg/s at 32768 counts
+    fx = scale(raw, sc)             # mantissa = raw * 245000 / 32768, exponent -3
+    raw = unscale(fx, sc)           # and back to counts (e.g. offset registers)
+
+Everything but fixed_to_float and the host side NumPy helpers uses integer
+arithmetic only, so the module imports and works on ports without float
+support.
+
+Example usage:
+>>> from fixedpoint import pack, fixed_to_float, mean
+>>> t = pack(27046, -3)
+>>> fixed_to_float(t)
+27.046
+>>> fixed_to_float(mean(t, pack(217, -1)))     # exponents are aligned
+24.373
+>>> sense = uSenseHAT(I2C(1), fixed=True)
+>>> sense.get_imu()             # tuples of fixed point samples
+
+On the host, bulk logs (needs NumPy):
+>>> import fixedpoint
+>>> fixedpoint.to_float_array([t, pack(-5, 2)])
+array([  27.046, -500.   ])
+>>> t_us, accel, gyro, mag = fixedpoint.load_log('fixed.csv')   # fusion_replay.load_log layout
+"""
+try:
+    from micropython import const
+except ImportError:
+    const = lambda x: x
+
+EXP_BIAS = const(128)
+_SHIFT = const(11)          # fraction bits of the scaler multiplier
+
+# 10**k for k 0..9 (small ints): a lookup instead of a pow for the common exponents
+_POW10 = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+
+def pack(mantissa, exponent):
+    return (mantissa << 8) | (exponent + EXP_BIAS)
+
+def mantissa(fx):
+    return fx >> 8
+
+def exponent(fx):
+    return (fx & 0xff) - EXP_BIAS
+
+def fixed_to_float(fx):
+    e = (fx & 0xff) - EXP_BIAS
+    m = fx >> 8
+    if e < 0:
+        # one correctly rounded division (27046 / 1000 is 27.046, 27046 * 0.001 is not)
+        return m / (_POW10[-e] if e >= -9 else 10 ** -e)
+    return float(m * (_POW10[e] if e <= 9 else 10 ** e))
+
+def align(fx, exp):
+    """ mantissa of fx at the exponent exp (truncated if exp is larger) """
+    e = (fx & 0xff) - EXP_BIAS
+    m = fx >> 8
+    if e > exp:
+        return m * 10 ** (e - exp)
+    if e < exp:
+        return m // 10 ** (exp - e)
+    return m
+
+def mean(*samples):
+    """ average of samples with any exponents, at the smallest exponent """
+    exp = min([(fx & 0xff) - EXP_BIAS for fx in samples])
+    total = 0
+    for fx in samples:
+        total += align(fx, exp)
+    return pack(total // len(samples), exp)
+
+def scaler(full_scale, counts=32768):
+    """
+    (multiplier, exponent) that converts raw counts of a sensor with full_scale (an
+    integer) at counts to fixed point: the exponent is the smallest for which a count
+    is worth at most 16 units of the mantissa, raw * multiplier stays within the small
+    ints. Integer arithmetic only: the value of one count is num / den.
+    """
+    exp = 0
+    num = full_scale
+    den = counts
+    while 10 * num < 16 * den:          # a count < 1.6 units
+        num *= 10
+        exp -= 1
+    while num >= 16 * den:
+        den *= 10
+        exp += 1
+    return ((num << _SHIFT) + (den >> 1)) // den, exp
+
+def scale(raw, sc):
+    """ fixed point sample of raw counts with scaler sc """
+    return (((raw * sc[0]) >> _SHIFT) << 8) | (sc[1] + EXP_BIAS)
+
+def unscale(fx, sc):
+    """ raw counts of a fixed point sample (any exponent) with scaler sc """
+    m = align(fx, sc[1])
+    if m < 0:
+        return -((((-m) << _SHIFT) + (sc[0] >> 1)) // sc[0])
+    return ((m << _SHIFT) + (sc[0] >> 1)) // sc[0]
+
+def to_float_array(samples):
+    """ host side: NumPy float array of an array/list/ndarray of fixed point samples """
+    import numpy as np
+    fx = np.asarray(samples, dtype=np.int64)
+    return (fx >> 8) * np.power(np.float64(10), (fx & 0xff) - EXP_BIAS)
+
+def load_log(path):
+    """
+    host side: a csv log with fixed point sample columns (t_us as plain integer, then
+    ax, ay, az, gx, gy, gz[, mx, my, mz]) as float arrays like fusion_replay.load_log
+    """
+    import numpy as np
+    data = np.loadtxt(path, delimiter=',', ndmin=2, dtype=np.int64)
+    values = to_float_array(data[:, 1:])
+    mag = values[:, 6:9] if values.shape[1] >= 9 else None
+    return data[:, 0].astype(float), values[:, 0:3], values[:, 3:6], mag
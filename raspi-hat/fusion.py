@@ -11,14 +11,19 @@
 # V0.4 calibrate method added
 
 import pyb 
-from math import sqrt, atan2, asin, degrees, radians
+import struct
+from math import radians, sqrt
+from engines import Madgwick
+from attitude import Attitude
 '''
 Supports 6 and 9 degrees of freedom sensors. Tested with InvenSense MPU-9150 9DOF sensor.
 Source https://github.com/xioTechnologies/Open-Source-AHRS-With-x-IMU.git
 also https://github.com/kriswiner/MPU-9250.git
 Ported to Python. Integrator timing adapted for pyboard.
 User should repeatedly call the appropriate 6 or 9 DOF update method and extract heading pitch and roll angles as
-required.
+required (they are computed once per update, see attitude.py for more outputs). Samples drained from a sensor
+FIFO should be passed to update_batch, which integrates them with the sensor's sample period instead of the
+(near zero) time between calls.
 Calibrate method:
 The sensor should be slowly rotated around each orthogonal axis while this runs.
 arguments:
@@ -26,19 +31,149 @@ getxyz must return current magnetometer (x, y, z) tuple from the sensor
 stopfunc (responding to time or user input) tells it to stop
 waitfunc provides an optional delay between readings to accommodate hardware or to avoid hogging
 the CPU in a threaded environment. It sets magbias to the mean values of x,y,z
+Warm start:
+init_attitude sets the quaternion in closed form from one accel (and mag) reading instead of letting the
+filter converge from the identity, followed by a short high gain phase (beta_start for converge_time
+seconds) before the normal beta is used. save/load keep q, magbias and this beta schedule in a flash file.
+>>> fuse.load()                             # optional: magbias and schedule from the last run
+>>> fuse.init_attitude(s.lsm.read_accel(), s.lsm.read_magnet())
+>>> fuse.save()                             # e.g. after calibrate
 '''
+STATE_FILE = 'fusion.dat'
+_STATE = '<4s10f'                           # magic, q, magbias, beta_start, converge_time, beta
+_MAGIC = b'FUS1'
+
 class Fusion(object):
     '''
-    Class provides sensor fusion allowing heading, pitch and roll to be extracted. This uses the Madgwick algorithm.
-    The update method must be called peiodically. The calculations take 1.6mS on the Pyboard.
+    Class provides sensor fusion allowing heading, pitch and roll to be extracted. This uses the Madgwick algorithm
+    unless another engine (see engines.py) is passed. The update method must be called peiodically.
+    The calculations take 1.6mS on the Pyboard.
     '''
     declination = 0                         # Optional offset for true north. A +ve value adds to heading
-    def __init__(self):
+    def __init__(self, engine=None):
         self.magbias = (0, 0, 0)            # local magnetic bias factors: set from calibration
         self.start_time = None              # Time between updates
         self.q = [1.0, 0.0, 0.0, 0.0]       # vector to hold quaternion
-        GyroMeasError = radians(60)         # Original code indicates this leads to a 2 sec response time
-        self.beta = sqrt(3.0 / 4.0) * GyroMeasError  # compute beta (see README)
+        self.engine = Madgwick() if engine is None else engine
+        self.accel = (0.0, 0.0, 1.0)        # last accel sample that updated q
+        self.attitude = Attitude(self)      # derived outputs, cached per update
+        self.mag_every = 1                  # multi-rate: gyro samples per mag sample (see set_multirate)
+        self._mag_due = 0
+        self._magcorr = None                # multi-rate: mag correction per step of the last mag sample
+        self.beta_start = 5.0               # warm start: gain of the convergence phase
+        self.converge_time = 0.1            # warm start: length of the convergence phase in s
+        self._converge_left = 0             # remaining time of the convergence phase
+        self._beta = None                   # normal gain while the convergence phase runs
+
+    @property
+    def beta(self):                         # gain of the Madgwick engine, None for other engines
+        return getattr(self.engine, 'beta', None)
+
+    @beta.setter
+    def beta(self, beta):
+        if not hasattr(self.engine, 'beta'):
+            raise AttributeError("{} engine has no beta gain".format(type(self.engine).__name__))
+        if self._converge_left:
+            self._beta = beta               # used after the convergence phase
+        else:
+            self.engine.beta = beta
+
+    def init_attitude(self, accel, mag=None):
+        '''
+        Sets q in closed form from a single accel (and mag) reading taken at rest: earth z is the
+        accel direction, earth x (north) the horizontal part of the mag vector. Without mag the
+        heading is set to 0. Starts the high gain convergence phase. Returns False for a zero
+        length vector.
+        '''
+        ax, ay, az = accel
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return False
+        zx, zy, zz = ax / norm, ay / norm, az / norm
+        if mag is None:
+            mx, my, mz = 1.0, 0.0, 0.0      # sensor x axis defines north
+        else:
+            mx, my, mz = (mag[x] - self.magbias[x] for x in range(3))
+        d = mx * zx + my * zy + mz * zz     # remove the vertical part
+        xx, xy, xz = mx - d * zx, my - d * zy, mz - d * zz
+        norm = sqrt(xx * xx + xy * xy + xz * xz)
+        if norm == 0:
+            if mag is not None:
+                return False
+            xx, xy, xz = -zz * zx, -zz * zy, 1 - zz * zz  # sensor x is vertical: use sensor z
+            norm = sqrt(xx * xx + xy * xy + xz * xz)
+        xx, xy, xz = xx / norm, xy / norm, xz / norm
+        yx, yy, yz = zy * xz - zz * xy, zz * xx - zx * xz, zx * xy - zy * xx    # earth y = z cross x
+        # rotation matrix (rows: earth axes in the sensor frame) to quaternion
+        tr = xx + yy + zz
+        if tr > 0:
+            w = sqrt(tr + 1) * 2
+            q = (w / 4, (zy - yz) / w, (xz - zx) / w, (yx - xy) / w)
+        elif xx > yy and xx > zz:
+            w = sqrt(1 + xx - yy - zz) * 2
+            q = ((zy - yz) / w, w / 4, (xy + yx) / w, (xz + zx) / w)
+        elif yy > zz:
+            w = sqrt(1 + yy - xx - zz) * 2
+            q = ((xz - zx) / w, (xy + yx) / w, w / 4, (yz + zy) / w)
+        else:
+            w = sqrt(1 + zz - xx - yy) * 2
+            q = ((yx - xy) / w, (xz + zx) / w, (yz + zy) / w, w / 4)
+        self.q = q
+        self.accel = accel
+        self.start_convergence()
+        return True
+
+    def start_convergence(self):
+        '''
+        Runs the filter with beta_start for converge_time seconds of samples, then hands over to
+        the normal beta. Engines without beta only get the closed form initialisation.
+        '''
+        if not hasattr(self.engine, 'beta') or self.converge_time <= 0:
+            return
+        if not self._converge_left:
+            self._beta = self.engine.beta
+        self.engine.beta = self.beta_start
+        self._converge_left = self.converge_time
+
+    def _converge(self, deltat):
+        self._converge_left -= deltat
+        if self._converge_left <= 0:
+            self._converge_left = 0
+            if hasattr(self.engine, 'beta'):    # unless the engine was replaced meanwhile
+                self.engine.beta = self._beta   # hand over to the normal gain
+
+    def save(self, path=STATE_FILE):
+        ''' writes q, magbias and the beta schedule to a file (flash) '''
+        beta = self._beta if self._converge_left else getattr(self.engine, 'beta', 0)
+        with open(path, 'wb') as f:
+            f.write(struct.pack(_STATE, _MAGIC, *(tuple(self.q) + tuple(self.magbias) +
+                                (self.beta_start, self.converge_time, beta))))
+
+    def load(self, path=STATE_FILE):
+        '''
+        Restores the state written by save and starts the convergence phase (the board may have
+        moved since). Returns False if there is no valid state file.
+        '''
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        # a truncated file (power loss during save) would raise struct.error on CPython,
+        # ValueError on MicroPython (whose ustruct has no error type)
+        if len(data) != struct.calcsize(_STATE):
+            return False
+        v = struct.unpack(_STATE, data)
+        if v[0] != _MAGIC:
+            return False
+        self.q = v[1:5]
+        self.magbias = v[5:8]
+        self.beta_start, self.converge_time = v[8], v[9]
+        if hasattr(self.engine, 'beta'):
+            self._converge_left = 0
+            self.engine.beta = v[10]
+        self.start_convergence()
+        return True
 
     def calibrate(self, getxyz, stopfunc, waitfunc = None):
         magmax = list(getxyz())             # Initialise max and min lists with current values
@@ -54,166 +189,142 @@ class Fusion(object):
 
     @property
     def heading(self):
-        return self.declination + degrees(atan2(2.0 * (self.q[1] * self.q[2] + self.q[0] * self.q[3]),
-            self.q[0] * self.q[0] + self.q[1] * self.q[1] - self.q[2] * self.q[2] - self.q[3] * self.q[3]))
+        return self.attitude.heading
 
     @property
     def pitch(self):
-        return degrees(-asin(2.0 * (self.q[1] * self.q[3] - self.q[0] * self.q[2])))
+        return self.attitude.pitch
 
     @property
     def roll(self):
-        return degrees(atan2(2.0 * (self.q[0] * self.q[1] + self.q[2] * self.q[3]),
-            self.q[0] * self.q[0] - self.q[1] * self.q[1] - self.q[2] * self.q[2] + self.q[3] * self.q[3]))
+        return self.attitude.roll
 
-    def update_nomag(self, accel, gyro):    # 3-tuples (x, y, z) for accel, gyro
+    def set_multirate(self, odr, odr_mag):
+        '''
+        Configures update_multirate for a magnetometer running at odr_mag Hz while gyro/accel run
+        at odr Hz (e.g. LSM9DS1.odr, LSM9DS1.odr_magnet)
+        '''
+        self.mag_every = max(1, int(odr / odr_mag + 0.5))
+        self._mag_due = 0
+        self._magcorr = None
+
+    def update_multirate(self, accel, gyro, readmag, deltat=None):
+        '''
+        Runs the 9DOF step only when a new mag sample is due and plain gyro integration in between.
+        readmag is only called then and may return None if no new sample is ready yet (it's retried
+        with the next sample). The correction of the 9DOF step (its result minus the gyro
+        integration, accel and mag part) is held and added to every following gyro step until the
+        next mag sample, so the filter keeps the gain and response of a 9DOF update on every sample.
+        The convergence phase uses 6DOF steps in between. Mahony's integral term only advances on
+        the 9DOF steps. At 952 Hz gyro and 80 Hz mag rate a sample costs about a third of update()
+        (CPython), heading/pitch/roll stay within 0.05 deg rms of update().
+        '''
+        if self.start_time is None:
+            self.start_time = pyb.micros()  # First run
+        now = None
+        if deltat is None:                  # one time step for both engine calls of a mag step
+            deltat = pyb.elapsed_micros(self.start_time) / 1000000
+            now = pyb.micros()
+        self._mag_due -= 1
+        mag = None
+        if self._mag_due <= 0:
+            mag = readmag()
+        c = self._magcorr
+        if mag is not None:
+            self._mag_due = self.mag_every
+            self._mag_step(accel, gyro, mag, deltat)
+        elif c is None or self._converge_left:
+            # high gain convergence phase: holding its large corrections would overshoot
+            self.update_nomag(accel, gyro, deltat)
+        else:
+            # gyro integration plus the correction of the last 9DOF step
+            gx, gy, gz = (radians(x) * 0.5 * deltat for x in gyro)
+            q1, q2, q3, q4 = self.q
+            q1, q2, q3, q4 = (q1 - q2 * gx - q3 * gy - q4 * gz + c[0], q2 + q1 * gx + q3 * gz - q4 * gy + c[1],
+                              q3 + q1 * gy - q2 * gz + q4 * gx + c[2], q4 + q1 * gz + q2 * gy - q3 * gx + c[3])
+            norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
+            self.q = q1 * norm, q2 * norm, q3 * norm, q4 * norm
+            self.accel = accel
+            if self._converge_left:
+                self._converge(deltat)
+        if now is not None:
+            self.start_time = now
+
+    def _mag_step(self, accel, gyro, mag, deltat):
+        mx, my, mz = (mag[x] - self.magbias[x] for x in range(3))
+        ax, ay, az = accel
+        gx, gy, gz = (radians(x) for x in gyro)
+        q = self.engine.update(self.q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat)
+        if q is None:
+            self._magcorr = None
+            return                          # invalid sample, time carries over to the next one
+        # correction of the step: the 9DOF result minus the gyro integration
+        q1, q2, q3, q4 = self.q
+        gx, gy, gz = gx * 0.5 * deltat, gy * 0.5 * deltat, gz * 0.5 * deltat
+        self._magcorr = (q[0] - (q1 - q2 * gx - q3 * gy - q4 * gz), q[1] - (q2 + q1 * gx + q3 * gz - q4 * gy),
+                         q[2] - (q3 + q1 * gy - q2 * gz + q4 * gx), q[3] - (q4 + q1 * gz + q2 * gy - q3 * gx))
+        self.q = q
+        self.accel = accel
+        if self._converge_left:
+            self._converge(deltat)
+
+    def update_batch(self, samples, odr, mag=None, readmag=None):
+        '''
+        Integrates a burst of (gyro, accel) samples as returned by LSM9DS1.iter_accel_gyro
+        with the time step of the sensor's output data rate odr (Hz, e.g. LSM9DS1.odr)
+        instead of the time between calls. If a mag 3-tuple is given the 9DOF update is used,
+        if a readmag function is given the samples go through update_multirate.
+        '''
+        deltat = 1 / odr
+        if readmag is not None:
+            update = self.update_multirate
+            for gyro, accel in samples:
+                update(accel, gyro, readmag, deltat)
+        elif mag is None:
+            update = self.update_nomag
+            for gyro, accel in samples:
+                update(accel, gyro, deltat)
+        else:
+            update = self.update
+            for gyro, accel in samples:
+                update(accel, gyro, mag, deltat)
+        self.start_time = pyb.micros()      # a following timed update starts from here
+
+    def update_nomag(self, accel, gyro, deltat=None):   # 3-tuples (x, y, z) for accel, gyro
         ax, ay, az = accel                  # Units G (but later normalised)
         gx, gy, gz = (radians(x) for x in gyro) # Units deg/s
         if self.start_time is None:
             self.start_time = pyb.micros()  # First run
-        q1, q2, q3, q4 = (self.q[x] for x in range(4))   # short name local variable for readability
-        # Auxiliary variables to avoid repeated arithmetic
-        _2q1 = 2 * q1
-        _2q2 = 2 * q2
-        _2q3 = 2 * q3
-        _2q4 = 2 * q4
-        _4q1 = 4 * q1
-        _4q2 = 4 * q2
-        _4q3 = 4 * q3
-        _8q2 = 8 * q2
-        _8q3 = 8 * q3
-        q1q1 = q1 * q1
-        q2q2 = q2 * q2
-        q3q3 = q3 * q3
-        q4q4 = q4 * q4
-
-        # Normalise accelerometer measurement
-        norm = sqrt(ax * ax + ay * ay + az * az)
-        if (norm == 0):
-            return # handle NaN
-        norm = 1 / norm        # use reciprocal for division
-        ax *= norm
-        ay *= norm
-        az *= norm
-
-        # Gradient decent algorithm corrective step
-        s1 = _4q1 * q3q3 + _2q3 * ax + _4q1 * q2q2 - _2q2 * ay
-        s2 = _4q2 * q4q4 - _2q4 * ax + 4 * q1q1 * q2 - _2q1 * ay - _4q2 + _8q2 * q2q2 + _8q2 * q3q3 + _4q2 * az
-        s3 = 4 * q1q1 * q3 + _2q1 * ax + _4q3 * q4q4 - _2q4 * ay - _4q3 + _8q3 * q2q2 + _8q3 * q3q3 + _4q3 * az
-        s4 = 4 * q2q2 * q4 - _2q2 * ax + 4 * q3q3 * q4 - _2q3 * ay
-        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
-        s1 *= norm
-        s2 *= norm
-        s3 *= norm
-        s4 *= norm
-
-        # Compute rate of change of quaternion
-        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz) - self.beta * s1
-        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy) - self.beta * s2
-        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx) - self.beta * s3
-        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx) - self.beta * s4
-
-        # Integrate to yield quaternion
-        deltat = pyb.elapsed_micros(self.start_time) / 1000000
-        self.start_time = pyb.micros()
-        q1 += qDot1 * deltat
-        q2 += qDot2 * deltat
-        q3 += qDot3 * deltat
-        q4 += qDot4 * deltat
-        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
-        self.q = q1 * norm, q2 * norm, q3 * norm, q4 * norm
-
-    def update(self, accel, gyro, mag):     # 3-tuples (x, y, z) for accel, gyro and mag data
+        now = None
+        if deltat is None:                  # seconds since last update unless given
+            deltat = pyb.elapsed_micros(self.start_time) / 1000000
+            now = pyb.micros()
+        q = self.engine.update_nomag(self.q, ax, ay, az, gx, gy, gz, deltat)
+        if q is None:
+            return                          # invalid sample, time carries over to the next one
+        self.q = q
+        self.accel = accel
+        if self._converge_left:
+            self._converge(deltat)
+        if now is not None:
+            self.start_time = now
+
+    def update(self, accel, gyro, mag, deltat=None):    # 3-tuples (x, y, z) for accel, gyro and mag data
         mx, my, mz = (mag[x] - self.magbias[x] for x in range(3)) # Units irrelevant (normalised)
         ax, ay, az = accel                  # Units irrelevant (normalised)
         gx, gy, gz = (radians(x) for x in gyro)  # Units deg/s
         if self.start_time is None:
             self.start_time = pyb.micros()  # First run
-        q1, q2, q3, q4 = (self.q[x] for x in range(4))   # short name local variable for readability
-        # Auxiliary variables to avoid repeated arithmetic
-        _2q1 = 2 * q1
-        _2q2 = 2 * q2
-        _2q3 = 2 * q3
-        _2q4 = 2 * q4
-        _2q1q3 = 2 * q1 * q3
-        _2q3q4 = 2 * q3 * q4
-        q1q1 = q1 * q1
-        q1q2 = q1 * q2
-        q1q3 = q1 * q3
-        q1q4 = q1 * q4
-        q2q2 = q2 * q2
-        q2q3 = q2 * q3
-        q2q4 = q2 * q4
-        q3q3 = q3 * q3
-        q3q4 = q3 * q4
-        q4q4 = q4 * q4
-
-        # Normalise accelerometer measurement
-        norm = sqrt(ax * ax + ay * ay + az * az)
-        if (norm == 0):
-            return # handle NaN
-        norm = 1 / norm                     # use reciprocal for division
-        ax *= norm
-        ay *= norm
-        az *= norm
-
-        # Normalise magnetometer measurement
-        norm = sqrt(mx * mx + my * my + mz * mz)
-        if (norm == 0):
-            return                          # handle NaN
-        norm = 1 / norm                     # use reciprocal for division
-        mx *= norm
-        my *= norm
-        mz *= norm
-
-        # Reference direction of Earth's magnetic field
-        _2q1mx = 2 * q1 * mx
-        _2q1my = 2 * q1 * my
-        _2q1mz = 2 * q1 * mz
-        _2q2mx = 2 * q2 * mx
-        hx = mx * q1q1 - _2q1my * q4 + _2q1mz * q3 + mx * q2q2 + _2q2 * my * q3 + _2q2 * mz * q4 - mx * q3q3 - mx * q4q4
-        hy = _2q1mx * q4 + my * q1q1 - _2q1mz * q2 + _2q2mx * q3 - my * q2q2 + my * q3q3 + _2q3 * mz * q4 - my * q4q4
-        _2bx = sqrt(hx * hx + hy * hy)
-        _2bz = -_2q1mx * q3 + _2q1my * q2 + mz * q1q1 + _2q2mx * q4 - mz * q2q2 + _2q3 * my * q4 - mz * q3q3 + mz * q4q4
-        _4bx = 2 * _2bx
-        _4bz = 2 * _2bz
-
-        # Gradient descent algorithm corrective step
-        s1 = (-_2q3 * (2 * q2q4 - _2q1q3 - ax) + _2q2 * (2 * q1q2 + _2q3q4 - ay) - _2bz * q3 * (_2bx * (0.5 - q3q3 - q4q4)
-             + _2bz * (q2q4 - q1q3) - mx) + (-_2bx * q4 + _2bz * q2) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
-             + _2bx * q3 * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
-
-        s2 = (_2q4 * (2 * q2q4 - _2q1q3 - ax) + _2q1 * (2 * q1q2 + _2q3q4 - ay) - 4 * q2 * (1 - 2 * q2q2 - 2 * q3q3 - az)
-             + _2bz * q4 * (_2bx * (0.5 - q3q3 - q4q4) + _2bz * (q2q4 - q1q3) - mx) + (_2bx * q3 + _2bz * q1) * (_2bx * (q2q3 - q1q4)
-             + _2bz * (q1q2 + q3q4) - my) + (_2bx * q4 - _4bz * q2) * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
-
-        s3 = (-_2q1 * (2 * q2q4 - _2q1q3 - ax) + _2q4 * (2 * q1q2 + _2q3q4 - ay) - 4 * q3 * (1 - 2 * q2q2 - 2 * q3q3 - az)
-             + (-_4bx * q3 - _2bz * q1) * (_2bx * (0.5 - q3q3 - q4q4) + _2bz * (q2q4 - q1q3) - mx)
-             + (_2bx * q2 + _2bz * q4) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
-             + (_2bx * q1 - _4bz * q3) * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
-
-        s4 = (_2q2 * (2 * q2q4 - _2q1q3 - ax) + _2q3 * (2 * q1q2 + _2q3q4 - ay) + (-_4bx * q4 + _2bz * q2) * (_2bx * (0.5 - q3q3 - q4q4)
-              + _2bz * (q2q4 - q1q3) - mx) + (-_2bx * q1 + _2bz * q3) * (_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my)
-              + _2bx * q2 * (_2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz))
-
-        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
-        s1 *= norm
-        s2 *= norm
-        s3 *= norm
-        s4 *= norm
-
-        # Compute rate of change of quaternion
-        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz) - self.beta * s1
-        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy) - self.beta * s2
-        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx) - self.beta * s3
-        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx) - self.beta * s4
-
-        # Integrate to yield quaternion
-        deltat = pyb.elapsed_micros(self.start_time) / 1000000
-        self.start_time = pyb.micros()
-        q1 += qDot1 * deltat
-        q2 += qDot2 * deltat
-        q3 += qDot3 * deltat
-        q4 += qDot4 * deltat
-        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
-        self.q = q1 * norm, q2 * norm, q3 * norm, q4 * norm
+        now = None
+        if deltat is None:                  # seconds since last update unless given
+            deltat = pyb.elapsed_micros(self.start_time) / 1000000
+            now = pyb.micros()
+        q = self.engine.update(self.q, ax, ay, az, gx, gy, gz, mx, my, mz, deltat)
+        if q is None:
+            return                          # invalid sample, time carries over to the next one
+        self.q = q
+        self.accel = accel
+        if self._converge_left:
+            self._converge(deltat)
+        if now is not None:
+            self.start_time = now
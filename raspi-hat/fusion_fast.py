@@ -0,0 +1,254 @@
+"""
+Madgwick sensor fusion with an in-place update kernel for the Pyboard
+
+Same algorithm and results as fusion.Fusion, but the update methods don't
+create any container objects: no generators, no tuples for the quaternion and
+no bias corrected magnetometer tuple. The filter state lives in a preallocated
+array('f') and the inputs are read from caller owned arrays (e.g. filled by
+the read_*_into methods of the LSM9DS1 driver).
+
+This is not a zero allocation kernel. The viper emitter has no float support,
+so the update methods are compiled with the native emitter, and on the default
+Pyboard build (MICROPY_OBJ_REPR_A) every float intermediate is boxed on the
+heap: update_nomag creates about 140 and update about 290 float objects per
+call. Only ports with immediate floats (MICROPY_OBJ_REPR_C/D) run them without
+heap allocation. What goes away are the generators and tuples of
+fusion.Fusion, so the collector runs less often but not never; bench() prints
+the bytes allocated per update on the target.
+
+Example usage:
+>>> import array
+>>> from fusion_fast import FusionFast
+>>> fuse = FusionFast()
+>>> a, g, m = array.array('f', [0,0,1]), array.array('f', [0,0,0]), array.array('f', [0.3,0,0.4])
+>>> fuse.update(a, g, m)        # units: g, deg/sec, gauss (any unit for a and m)
+>>> fuse.q                      # quaternion (w,x,y,z) array, updated in place
+>>> fuse.heading, fuse.pitch, fuse.roll
+>>> import fusion_fast; fusion_fast.bench()     # us per update compared to fusion.Fusion
+"""
+import array
+import micropython
+import pyb
+from math import sqrt, atan2, asin, degrees, radians
+
+_DEG_TO_RAD = 0.017453292519943295
+
+class FusionFast:
+    """
+    Madgwick filter working on a preallocated array('f') state.
+    q holds the quaternion [q1, q2, q3, q4], magbias is an array('f') of 3 as well.
+    """
+    declination = 0                         # Optional offset for true north. A +ve value adds to heading
+    def __init__(self):
+        self.q = array.array('f', [1.0, 0.0, 0.0, 0.0])
+        self.magbias = array.array('f', [0.0, 0.0, 0.0])
+        self.start_time = None
+        GyroMeasError = radians(60)         # Original code indicates this leads to a 2 sec response time
+        self.beta = sqrt(3.0 / 4.0) * GyroMeasError
+
+    @property
+    def heading(self):
+        q = self.q
+        return self.declination + degrees(atan2(2.0 * (q[1] * q[2] + q[0] * q[3]),
+            q[0] * q[0] + q[1] * q[1] - q[2] * q[2] - q[3] * q[3]))
+
+    @property
+    def pitch(self):
+        q = self.q
+        return degrees(-asin(2.0 * (q[1] * q[3] - q[0] * q[2])))
+
+    @property
+    def roll(self):
+        q = self.q
+        return degrees(atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
+            q[0] * q[0] - q[1] * q[1] - q[2] * q[2] + q[3] * q[3]))
+
+    @micropython.native
+    def _deltat(self):
+        if self.start_time is None:
+            self.start_time = pyb.micros()  # First run
+        deltat = pyb.elapsed_micros(self.start_time) / 1000000
+        self.start_time = pyb.micros()
+        return deltat
+
+    @micropython.native
+    def update_nomag(self, accel, gyro):    # arrays of 3 (x, y, z) for accel (g), gyro (deg/s)
+        q = self.q
+        ax = accel[0]
+        ay = accel[1]
+        az = accel[2]
+        gx = gyro[0] * _DEG_TO_RAD
+        gy = gyro[1] * _DEG_TO_RAD
+        gz = gyro[2] * _DEG_TO_RAD
+        q1 = q[0]
+        q2 = q[1]
+        q3 = q[2]
+        q4 = q[3]
+        if self.start_time is None:
+            self.start_time = pyb.micros()  # First run
+
+        # Normalise accelerometer measurement
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return # handle NaN
+        norm = 1 / norm
+        ax *= norm
+        ay *= norm
+        az *= norm
+
+        # Auxiliary variables to avoid repeated arithmetic
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _4q1 = 4 * q1
+        _4q2 = 4 * q2
+        _4q3 = 4 * q3
+        _8q2 = 8 * q2
+        _8q3 = 8 * q3
+        q1q1 = q1 * q1
+        q2q2 = q2 * q2
+        q3q3 = q3 * q3
+        q4q4 = q4 * q4
+
+        # Gradient decent algorithm corrective step
+        s1 = _4q1 * q3q3 + _2q3 * ax + _4q1 * q2q2 - _2q2 * ay
+        s2 = _4q2 * q4q4 - _2q4 * ax + 4 * q1q1 * q2 - _2q1 * ay - _4q2 + _8q2 * q2q2 + _8q2 * q3q3 + _4q2 * az
+        s3 = 4 * q1q1 * q3 + _2q1 * ax + _4q3 * q4q4 - _2q4 * ay - _4q3 + _8q3 * q2q2 + _8q3 * q3q3 + _4q3 * az
+        s4 = 4 * q2q2 * q4 - _2q2 * ax + 4 * q3q3 * q4 - _2q3 * ay
+        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
+        beta = self.beta * norm
+        # Compute rate of change of quaternion and integrate
+        deltat = self._deltat()
+        q1 += (0.5 * (-q2 * gx - q3 * gy - q4 * gz) - beta * s1) * deltat
+        q2 += (0.5 * (q[0] * gx + q3 * gz - q4 * gy) - beta * s2) * deltat
+        q3 += (0.5 * (q[0] * gy - q[1] * gz + q4 * gx) - beta * s3) * deltat
+        q4 += (0.5 * (q[0] * gz + q[1] * gy - q[2] * gx) - beta * s4) * deltat
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
+        q[0] = q1 * norm
+        q[1] = q2 * norm
+        q[2] = q3 * norm
+        q[3] = q4 * norm
+
+    @micropython.native
+    def update(self, accel, gyro, mag):     # arrays of 3 (x, y, z) for accel, gyro and mag data
+        q = self.q
+        bias = self.magbias
+        mx = mag[0] - bias[0]               # Units irrelevant (normalised)
+        my = mag[1] - bias[1]
+        mz = mag[2] - bias[2]
+        ax = accel[0]                       # Units irrelevant (normalised)
+        ay = accel[1]
+        az = accel[2]
+        gx = gyro[0] * _DEG_TO_RAD          # Units deg/s
+        gy = gyro[1] * _DEG_TO_RAD
+        gz = gyro[2] * _DEG_TO_RAD
+        q1 = q[0]
+        q2 = q[1]
+        q3 = q[2]
+        q4 = q[3]
+        if self.start_time is None:
+            self.start_time = pyb.micros()  # First run
+
+        # Normalise accelerometer measurement
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm == 0:
+            return # handle NaN
+        norm = 1 / norm
+        ax *= norm
+        ay *= norm
+        az *= norm
+
+        # Normalise magnetometer measurement
+        norm = sqrt(mx * mx + my * my + mz * mz)
+        if norm == 0:
+            return # handle NaN
+        norm = 1 / norm
+        mx *= norm
+        my *= norm
+        mz *= norm
+
+        # Auxiliary variables to avoid repeated arithmetic
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _2q1q3 = 2 * q1 * q3
+        _2q3q4 = 2 * q3 * q4
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q1q4 = q1 * q4
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q2q4 = q2 * q4
+        q3q3 = q3 * q3
+        q3q4 = q3 * q4
+        q4q4 = q4 * q4
+
+        # Reference direction of Earth's magnetic field
+        _2q1mx = 2 * q1 * mx
+        _2q1my = 2 * q1 * my
+        _2q1mz = 2 * q1 * mz
+        _2q2mx = 2 * q2 * mx
+        hx = mx * q1q1 - _2q1my * q4 + _2q1mz * q3 + mx * q2q2 + _2q2 * my * q3 + _2q2 * mz * q4 - mx * q3q3 - mx * q4q4
+        hy = _2q1mx * q4 + my * q1q1 - _2q1mz * q2 + _2q2mx * q3 - my * q2q2 + my * q3q3 + _2q3 * mz * q4 - my * q4q4
+        _2bx = sqrt(hx * hx + hy * hy)
+        _2bz = -_2q1mx * q3 + _2q1my * q2 + mz * q1q1 + _2q2mx * q4 - mz * q2q2 + _2q3 * my * q4 - mz * q3q3 + mz * q4q4
+        _4bx = 2 * _2bx
+        _4bz = 2 * _2bz
+
+        # common terms of the objective function
+        fa1 = 2 * q2q4 - _2q1q3 - ax
+        fa2 = 2 * q1q2 + _2q3q4 - ay
+        fa3 = 1 - 2 * q2q2 - 2 * q3q3 - az
+        fm1 = _2bx * (0.5 - q3q3 - q4q4) + _2bz * (q2q4 - q1q3) - mx
+        fm2 = _2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4) - my
+        fm3 = _2bx * (q1q3 + q2q4) + _2bz * (0.5 - q2q2 - q3q3) - mz
+
+        # Gradient descent algorithm corrective step
+        s1 = -_2q3 * fa1 + _2q2 * fa2 - _2bz * q3 * fm1 + (-_2bx * q4 + _2bz * q2) * fm2 + _2bx * q3 * fm3
+        s2 = _2q4 * fa1 + _2q1 * fa2 - 4 * q2 * fa3 + _2bz * q4 * fm1 + (_2bx * q3 + _2bz * q1) * fm2 + (_2bx * q4 - _4bz * q2) * fm3
+        s3 = -_2q1 * fa1 + _2q4 * fa2 - 4 * q3 * fa3 + (-_4bx * q3 - _2bz * q1) * fm1 + (_2bx * q2 + _2bz * q4) * fm2 + (_2bx * q1 - _4bz * q3) * fm3
+        s4 = _2q2 * fa1 + _2q3 * fa2 + (-_4bx * q4 + _2bz * q2) * fm1 + (-_2bx * q1 + _2bz * q3) * fm2 + _2bx * q2 * fm3
+        norm = 1 / sqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)    # normalise step magnitude
+        beta = self.beta * norm
+
+        # Compute rate of change of quaternion and integrate
+        deltat = self._deltat()
+        q1 += (0.5 * (-q2 * gx - q3 * gy - q4 * gz) - beta * s1) * deltat
+        q2 += (0.5 * (q[0] * gx + q3 * gz - q4 * gy) - beta * s2) * deltat
+        q3 += (0.5 * (q[0] * gy - q[1] * gz + q4 * gx) - beta * s3) * deltat
+        q4 += (0.5 * (q[0] * gz + q[1] * gy - q[2] * gx) - beta * s4) * deltat
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
+        q[0] = q1 * norm
+        q[1] = q2 * norm
+        q[2] = q3 * norm
+        q[3] = q4 * norm
+
+def bench(n=1000):
+    """
+    prints us per update and heap bytes allocated per update of fusion.Fusion
+    and FusionFast, using the same constant input. Boxed float temporaries are
+    included in the byte count, so FusionFast doesn't show 0 on the Pyboard.
+    """
+    import gc
+    from fusion import Fusion
+    a, g, m = (0.01, 0.07, 0.99), (-0.4, 0.8, -0.05), (0.53, -0.01, -0.12)
+    af, gf, mf = array.array('f', a), array.array('f', g), array.array('f', m)
+    for name, fuse, args in (('Fusion', Fusion(), (a, g, m)), ('FusionFast', FusionFast(), (af, gf, mf))):
+        acc, gyr, mag = args
+        for label in ('update', 'update_nomag'):
+            gc.collect()
+            mem = gc.mem_free()
+            t = pyb.micros()
+            if label == 'update':
+                for i in range(n):
+                    fuse.update(acc, gyr, mag)
+            else:
+                for i in range(n):
+                    fuse.update_nomag(acc, gyr)
+            delta = pyb.elapsed_micros(t)
+            alloc = mem - gc.mem_free()
+            print('{:>10}.{:<12} {:8.1f}us/update {:6d} bytes/update'.format(
+                name, label, delta / n, alloc // n))
@@ -0,0 +1,367 @@
+"""
+Fixed point Madgwick sensor fusion for ports without FPU (e.g. ESP8266)
+
+Same API as fusion.Fusion (update, update_nomag, heading, pitch, roll) but all
+filter math is done with integers, so no soft float routines are involved in
+an update:
+- the quaternion state is kept in Q29, the gradient step is computed in Q14
+- vectors are normalised with a table based inverse square root
+- heading/pitch/roll use a table based atan2 (asin is derived from it)
+Intermediate values are kept within the small int range of MicroPython where
+possible; the few sums that can exceed it transparently fall back to long ints.
+
+Inputs are the raw integer counts of the sensor. Units of accel and mag are
+irrelevant (normalised), gyro counts are converted with gyro_lsb (counts per
+deg/sec, e.g. LSM9DS1.scale_gyro).
+
+Example usage:
+>>> from fusion_fixed import FusionFixed
+>>> fuse = FusionFixed(gyro_lsb=32768/245)
+>>> fuse.update((120, -40, 16300), (-5, 12, 3), (2100, -80, -900))
+>>> fuse.heading, fuse.pitch, fuse.roll     # degrees
+>>> import fusion_fixed; fusion_fixed.bench()   # updates per second on target
+
+Accuracy against the float filter on a recorded log (host, needs NumPy):
+>>> import fusion_replay, fusion_fixed
+>>> fusion_fixed.compare(*fusion_replay.load_log('flight.csv'))
+"""
+import array
+import time
+from math import atan, pi, sqrt, radians
+
+try:
+    from micropython import const
+except ImportError:
+    const = lambda x: x
+
+_Q = const(14)              # fraction bits of the working values
+_ONE = const(16384)         # 1.0 in Q14
+_HALF = const(8192)         # 0.5 in Q14
+_Q_STATE = const(29)        # fraction bits of the quaternion state
+_DT_SCALE = const(34360)    # us -> Q25 seconds: (dt_us * _DT_SCALE) >> 10
+
+# 1/sqrt(x) for x in [2^14, 2^16), indexed by x >> 8, scaled by 2^22
+_RSQRT = array.array('H', [int((1 << 22) / sqrt((i + 0.5) * 256)) for i in range(64, 256)])
+# atan(i / 32) in 1/100 degrees for i = 0..32 (plus a guard entry for interpolation)
+_ATAN = array.array('h', [int(atan(i / 32) * 18000 / pi + 0.5) for i in range(33)] + [4500])
+
+def _rsqrt(x):
+    """
+    inverse square root of a positive int, returned as (shift << 16) | y
+    so that v * y >> shift == v / sqrt(x) in Q14 (no tuple allocation)
+    """
+    shift = 8
+    while x >= 65536:
+        x >>= 2
+        shift += 1
+    while x < 16384:
+        x <<= 2
+        shift -= 1
+    if shift < 0:
+        shift = 0
+    return (shift << 16) | _RSQRT[(x >> 8) - 64]
+
+def _sqrt(x):
+    """ integer square root of x (x in Q28 -> result in Q14) """
+    if x <= 0:
+        return 0
+    r = _rsqrt(x)
+    s = (x * (r & 0xffff)) >> (r >> 16)         # sqrt(x) in Q28
+    s >>= _Q
+    if s == 0:
+        return 0
+    return (s + x // s) >> 1                    # one Newton step refines the table value
+
+def _normalise4(s1, s2, s3, s4):
+    """ scales a 4 vector of any magnitude to unit length in Q14 """
+    m = (s1 if s1 > 0 else -s1) | (s2 if s2 > 0 else -s2) | (s3 if s3 > 0 else -s3) | (s4 if s4 > 0 else -s4)
+    if m == 0:
+        return 0, 0, 0, 0
+    while m >= 32768:       # keep the squares in the small int range
+        m >>= 1
+        s1 >>= 1
+        s2 >>= 1
+        s3 >>= 1
+        s4 >>= 1
+    norm = _rsqrt(s1 * s1 + s2 * s2 + s3 * s3 + s4 * s4)
+    shift = norm >> 16
+    norm &= 0xffff
+    return (s1 * norm) >> shift, (s2 * norm) >> shift, (s3 * norm) >> shift, (s4 * norm) >> shift
+
+def _atan2(y, x):
+    """ atan2 of two ints of the same scale in 1/100 degrees """
+    if x == 0 and y == 0:
+        return 0
+    ax = -x if x < 0 else x
+    ay = -y if y < 0 else y
+    if ay <= ax:
+        r = (ay << 15) // ax
+    else:
+        r = (ax << 15) // ay
+    i = r >> 10
+    a = _ATAN[i] + (((_ATAN[i + 1] - _ATAN[i]) * (r & 1023)) >> 10)
+    if ay > ax:
+        a = 9000 - a
+    if x < 0:
+        a = 18000 - a
+    if y < 0:
+        a = -a
+    return a
+
+class FusionFixed:
+    """
+    Madgwick filter in integer arithmetic. q holds the quaternion state as
+    array of Q29 ints, magbias the magnetometer bias in raw counts.
+    """
+    declination = 0                         # Optional offset for true north. A +ve value adds to heading
+    def __init__(self, gyro_lsb=1):
+        self.magbias = (0, 0, 0)            # local magnetic bias factors: set from calibration
+        self.start_time = None              # Time between updates
+        self.q = array.array('i', [1 << _Q_STATE, 0, 0, 0])
+        # gyro counts -> rad/s in Q14, factor kept in Q12
+        self.gyro_k = int(radians(1) / gyro_lsb * (1 << (_Q + 12)) + 0.5)
+        GyroMeasError = radians(60)         # Original code indicates this leads to a 2 sec response time
+        self.beta = int(sqrt(3.0 / 4.0) * GyroMeasError * _ONE)    # Q14
+
+    # --- euler angles (Fusion compatible, degrees) ---
+    def _quat(self):
+        q = self.q
+        return q[0] >> 15, q[1] >> 15, q[2] >> 15, q[3] >> 15
+
+    @property
+    def heading(self):
+        q1, q2, q3, q4 = self._quat()
+        return self.declination + _atan2(2 * (q2 * q3 + q1 * q4) >> _Q,
+            (q1 * q1 + q2 * q2 - q3 * q3 - q4 * q4) >> _Q) / 100
+
+    @property
+    def pitch(self):
+        q1, q2, q3, q4 = self._quat()
+        v = (2 * (q2 * q4 - q1 * q3)) >> _Q
+        v = _ONE if v > _ONE else -_ONE if v < -_ONE else v
+        # asin(v) = atan2(v, sqrt(1 - v^2))
+        return -_atan2(v, _sqrt((_ONE * _ONE) - v * v)) / 100
+
+    @property
+    def roll(self):
+        q1, q2, q3, q4 = self._quat()
+        return _atan2(2 * (q1 * q2 + q3 * q4) >> _Q,
+            (q1 * q1 - q2 * q2 - q3 * q3 + q4 * q4) >> _Q) / 100
+
+    # --- filter ---
+    def _deltat(self, deltat_us):
+        if deltat_us is None:
+            now = time.ticks_us()
+            if self.start_time is None:
+                self.start_time = now           # First run
+            deltat_us = time.ticks_diff(now, self.start_time)
+            self.start_time = now
+        return (deltat_us * _DT_SCALE) >> 10    # Q25 seconds
+
+    def _integrate(self, dt, s1, s2, s3, s4, gx, gy, gz):
+        """ integrates the rate of change (Q14) into the Q29 state and renormalises """
+        q = self.q
+        q1 = (q[0] + 16384) >> 15
+        q2 = (q[1] + 16384) >> 15
+        q3 = (q[2] + 16384) >> 15
+        q4 = (q[3] + 16384) >> 15
+        beta = self.beta
+        # Compute rate of change of quaternion (Q14)
+        qDot1 = ((-q2 * gx - q3 * gy - q4 * gz) >> 15) - ((beta * s1) >> _Q)
+        qDot2 = ((q1 * gx + q3 * gz - q4 * gy) >> 15) - ((beta * s2) >> _Q)
+        qDot3 = ((q1 * gy - q2 * gz + q4 * gx) >> 15) - ((beta * s3) >> _Q)
+        qDot4 = ((q1 * gz + q2 * gy - q3 * gx) >> 15) - ((beta * s4) >> _Q)
+        # Integrate to yield quaternion (Q14 * Q25 >> 10 -> Q29)
+        q1 = q[0] + ((qDot1 * dt) >> 10)
+        q2 = q[1] + ((qDot2 * dt) >> 10)
+        q3 = q[2] + ((qDot3 * dt) >> 10)
+        q4 = q[3] + ((qDot4 * dt) >> 10)
+        # normalise quaternion: first order correction q *= (3 - |q|^2) / 2
+        r1 = (q1 + 16384) >> 15
+        r2 = (q2 + 16384) >> 15
+        r3 = (q3 + 16384) >> 15
+        r4 = (q4 + 16384) >> 15
+        err = (1 << 28) - (r1 * r1 + r2 * r2 + r3 * r3 + r4 * r4)
+        q[0] = q1 + ((r1 * err) >> 14)
+        q[1] = q2 + ((r2 * err) >> 14)
+        q[2] = q3 + ((r3 * err) >> 14)
+        q[3] = q4 + ((r4 * err) >> 14)
+
+    def update_nomag(self, accel, gyro, deltat_us=None):    # raw (x, y, z) for accel, gyro
+        ax, ay, az = accel
+        gk = self.gyro_k
+        gx = (gyro[0] * gk) >> 12           # rad/s in Q14
+        gy = (gyro[1] * gk) >> 12
+        gz = (gyro[2] * gk) >> 12
+        q = self.q
+        q1 = (q[0] + 16384) >> 15
+        q2 = (q[1] + 16384) >> 15
+        q3 = (q[2] + 16384) >> 15
+        q4 = (q[3] + 16384) >> 15
+
+        # Normalise accelerometer measurement
+        norm = ax * ax + ay * ay + az * az
+        if norm == 0:
+            return # handle NaN
+        norm = _rsqrt(norm)
+        shift = norm >> 16
+        norm &= 0xffff
+        ax = (ax * norm) >> shift
+        ay = (ay * norm) >> shift
+        az = (az * norm) >> shift
+
+        # Auxiliary variables to avoid repeated arithmetic
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _4q1 = 4 * q1
+        _4q2 = 4 * q2
+        _4q3 = 4 * q3
+        _8q2 = 8 * q2
+        _8q3 = 8 * q3
+        q1q1 = (q1 * q1) >> _Q
+        q2q2 = (q2 * q2) >> _Q
+        q3q3 = (q3 * q3) >> _Q
+        q4q4 = (q4 * q4) >> _Q
+
+        # Gradient decent algorithm corrective step
+        s1 = _4q1 * q3q3 + _2q3 * ax + _4q1 * q2q2 - _2q2 * ay
+        s2 = _4q2 * q4q4 - _2q4 * ax + 4 * q1q1 * q2 - _2q1 * ay - (_4q2 << _Q) + _8q2 * q2q2 + _8q2 * q3q3 + _4q2 * az
+        s3 = 4 * q1q1 * q3 + _2q1 * ax + _4q3 * q4q4 - _2q4 * ay - (_4q3 << _Q) + _8q3 * q2q2 + _8q3 * q3q3 + _4q3 * az
+        s4 = 4 * q2q2 * q4 - _2q2 * ax + 4 * q3q3 * q4 - _2q3 * ay
+        s1, s2, s3, s4 = _normalise4(s1, s2, s3, s4)    # normalise step magnitude
+        self._integrate(self._deltat(deltat_us), s1, s2, s3, s4, gx, gy, gz)
+
+    def update(self, accel, gyro, mag, deltat_us=None):     # raw (x, y, z) for accel, gyro and mag data
+        mx = mag[0] - self.magbias[0]
+        my = mag[1] - self.magbias[1]
+        mz = mag[2] - self.magbias[2]
+        ax, ay, az = accel
+        gk = self.gyro_k
+        gx = (gyro[0] * gk) >> 12           # rad/s in Q14
+        gy = (gyro[1] * gk) >> 12
+        gz = (gyro[2] * gk) >> 12
+        q = self.q
+        q1 = (q[0] + 16384) >> 15
+        q2 = (q[1] + 16384) >> 15
+        q3 = (q[2] + 16384) >> 15
+        q4 = (q[3] + 16384) >> 15
+
+        # Normalise accelerometer measurement
+        norm = ax * ax + ay * ay + az * az
+        if norm == 0:
+            return # handle NaN
+        norm = _rsqrt(norm)
+        shift = norm >> 16
+        norm &= 0xffff
+        ax = (ax * norm) >> shift
+        ay = (ay * norm) >> shift
+        az = (az * norm) >> shift
+
+        # Normalise magnetometer measurement
+        norm = mx * mx + my * my + mz * mz
+        if norm == 0:
+            return # handle NaN
+        norm = _rsqrt(norm)
+        shift = norm >> 16
+        norm &= 0xffff
+        mx = (mx * norm) >> shift
+        my = (my * norm) >> shift
+        mz = (mz * norm) >> shift
+
+        # Auxiliary variables to avoid repeated arithmetic (all Q14)
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q4 = 2 * q4
+        _2q1q3 = (2 * q1 * q3) >> _Q
+        _2q3q4 = (2 * q3 * q4) >> _Q
+        q1q1 = (q1 * q1) >> _Q
+        q1q2 = (q1 * q2) >> _Q
+        q1q3 = (q1 * q3) >> _Q
+        q1q4 = (q1 * q4) >> _Q
+        q2q2 = (q2 * q2) >> _Q
+        q2q3 = (q2 * q3) >> _Q
+        q2q4 = (q2 * q4) >> _Q
+        q3q3 = (q3 * q3) >> _Q
+        q3q4 = (q3 * q4) >> _Q
+        q4q4 = (q4 * q4) >> _Q
+
+        # Reference direction of Earth's magnetic field
+        _2q1mx = (_2q1 * mx) >> _Q
+        _2q1my = (_2q1 * my) >> _Q
+        _2q1mz = (_2q1 * mz) >> _Q
+        _2q2mx = (_2q2 * mx) >> _Q
+        _2q2my = (_2q2 * my) >> _Q
+        _2q2mz = (_2q2 * mz) >> _Q
+        _2q3my = (_2q3 * my) >> _Q
+        _2q3mz = (_2q3 * mz) >> _Q
+        hx = (mx * q1q1 - _2q1my * q4 + _2q1mz * q3 + mx * q2q2 + _2q2my * q3 + _2q2mz * q4 - mx * q3q3 - mx * q4q4) >> _Q
+        hy = (_2q1mx * q4 + my * q1q1 - _2q1mz * q2 + _2q2mx * q3 - my * q2q2 + my * q3q3 + _2q3mz * q4 - my * q4q4) >> _Q
+        _2bx = _sqrt(hx * hx + hy * hy)
+        _2bz = (-_2q1mx * q3 + _2q1my * q2 + mz * q1q1 + _2q2mx * q4 - mz * q2q2 + _2q3my * q4 - mz * q3q3 + mz * q4q4) >> _Q
+        _4bx = 2 * _2bx
+        _4bz = 2 * _2bz
+
+        # common terms of the objective function
+        fa1 = 2 * q2q4 - _2q1q3 - ax
+        fa2 = 2 * q1q2 + _2q3q4 - ay
+        fa3 = _ONE - 2 * q2q2 - 2 * q3q3 - az
+        fm1 = ((_2bx * (_HALF - q3q3 - q4q4) + _2bz * (q2q4 - q1q3)) >> _Q) - mx
+        fm2 = ((_2bx * (q2q3 - q1q4) + _2bz * (q1q2 + q3q4)) >> _Q) - my
+        fm3 = ((_2bx * (q1q3 + q2q4) + _2bz * (_HALF - q2q2 - q3q3)) >> _Q) - mz
+
+        # Gradient descent algorithm corrective step
+        s1 = (-_2q3 * fa1 + _2q2 * fa2 - ((_2bz * q3) >> _Q) * fm1 + ((-_2bx * q4 + _2bz * q2) >> _Q) * fm2
+              + ((_2bx * q3) >> _Q) * fm3)
+        s2 = (_2q4 * fa1 + _2q1 * fa2 - 4 * q2 * fa3 + ((_2bz * q4) >> _Q) * fm1 + ((_2bx * q3 + _2bz * q1) >> _Q) * fm2
+              + ((_2bx * q4 - _4bz * q2) >> _Q) * fm3)
+        s3 = (-_2q1 * fa1 + _2q4 * fa2 - 4 * q3 * fa3 + ((-_4bx * q3 - _2bz * q1) >> _Q) * fm1
+              + ((_2bx * q2 + _2bz * q4) >> _Q) * fm2 + ((_2bx * q1 - _4bz * q3) >> _Q) * fm3)
+        s4 = (_2q2 * fa1 + _2q3 * fa2 + ((-_4bx * q4 + _2bz * q2) >> _Q) * fm1 + ((-_2bx * q1 + _2bz * q3) >> _Q) * fm2
+              + ((_2bx * q2) >> _Q) * fm3)
+        s1, s2, s3, s4 = _normalise4(s1, s2, s3, s4)    # normalise step magnitude
+        self._integrate(self._deltat(deltat_us), s1, s2, s3, s4, gx, gy, gz)
+
+def bench(n=500):
+    """ prints update rate of the 6 and 9DOF update on the target """
+    fuse = FusionFixed(gyro_lsb=32768/245)
+    a, g, m = (120, -40, 16300), (-5, 12, 3), (2100, -80, -900)
+    t = time.ticks_us()
+    for i in range(n):
+        fuse.update(a, g, m)
+    dt = time.ticks_diff(time.ticks_us(), t)
+    print('update:       {:6d}us/update {:6d}Hz'.format(dt // n, 1000000 * n // dt))
+    t = time.ticks_us()
+    for i in range(n):
+        fuse.update_nomag(a, g)
+    dt = time.ticks_diff(time.ticks_us(), t)
+    print('update_nomag: {:6d}us/update {:6d}Hz'.format(dt // n, 1000000 * n // dt))
+
+def compare(t_us, accel, gyro, mag=None, scale_accel=16384, scale_gyro=32768/245, scale_magnet=8192):
+    """
+    host side accuracy check against the float filter on a recorded log
+    (arrays as returned by fusion_replay.load_log). The log is quantised to raw
+    counts with the given LSM9DS1 scale factors, run through FusionFixed and
+    compared with fusion_replay.replay. Returns the max and rms error of
+    heading, pitch and roll in degrees.
+    """
+    import numpy as np
+    import fusion_replay
+    _, ref = fusion_replay.replay(accel, gyro, mag, t_us, use_jit=fusion_replay.HAVE_NUMBA)
+    fuse = FusionFixed(gyro_lsb=scale_gyro)
+    a = np.rint(np.asarray(accel) * scale_accel).astype(int).tolist()
+    g = np.rint(np.asarray(gyro) * scale_gyro).astype(int).tolist()
+    m = np.rint(np.asarray(mag) * scale_magnet).astype(int).tolist() if mag is not None else None
+    dt = np.diff(np.asarray(t_us), prepend=t_us[0]).astype(int).tolist()
+    out = np.empty((len(a), 3))
+    for i in range(len(a)):
+        if m is None:
+            fuse.update_nomag(a[i], g[i], dt[i])
+        else:
+            fuse.update(a[i], g[i], m[i], dt[i])
+        out[i] = fuse.heading, fuse.pitch, fuse.roll
+    err = out - ref
+    err[:, 0] = (err[:, 0] + 180) % 360 - 180       # heading wraps around
+    return np.abs(err).max(axis=0), np.sqrt((err ** 2).mean(axis=0))
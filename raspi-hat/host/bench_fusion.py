@@ -0,0 +1,343 @@
+"""
+Host benchmark of the fusion update kernels with regression tracking
+
+Runs fusion.Fusion (with each engine of engines.py) and fusion_fast.FusionFast
+over synthetic motion profiles and recorded logs (fusion_replay csv format) on
+CPython. The pyb and micropython stand-ins in this directory replace the
+board modules: the virtual clock is advanced by the sample period before every
+update, so the filters see the same time steps as on the board and the
+results are deterministic.
+
+For every kernel, profile and update method (update, update_nomag) the
+results contain the time per update (best of several repeats), the final
+quaternion and the heading/pitch/roll rms error against the true attitude
+(synthetic profiles) or against Fusion with Madgwick (recorded logs).
+Host timings are not board timings, but the ratio between two kernels and
+between two revisions of a kernel are meaningful.
+
+Usage (from the raspi-hat directory):
+    python3 host/bench_fusion.py [-o results.json] [--baseline old.json] [--tolerance 0.1] [log.csv ...]
+
+With --baseline the run is compared to an earlier results file: the exit
+status is 1 if any kernel got slower than the noise allows or if its final
+quaternion changed (numerical regression). Times are compared relative to a
+reference workload timed in both runs, so a baseline from another machine
+can be used. The reference is timed next to every pass of a kernel, so the
+comparison also follows CPU clock changes during a run. Every time is the
+best of the repeats (the loop overhead too, it's timed along and subtracted),
+and every result records how well its best time repeats (second best -
+best, relative).
+
+If the median change of all results exceeds --tolerance, every kernel
+slower than --tolerance is flagged: a regression in the Fusion wrapper slows
+down most kernels alike. A single kernel is flagged if its change exceeds
+the median by more than --tolerance, NOISE times the scatter of the changes
+around the median (the run to run noise, a common slowdown doesn't widen
+it) and NOISE times the spread of the kernel in both runs. After a passing
+comparison the gate checks itself: if the same comparison with a uniform
+slowdown of SLOWDOWN (20%) added to the current run wouldn't flag every
+result, the exit status is 2 (the baseline is too far off, e.g. taken
+under a different machine load).
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)                            # pyb, micropython stand-ins
+sys.path.insert(1, os.path.dirname(HERE))           # raspi-hat modules
+
+import array
+import pyb
+from fusion import Fusion
+from bench_engines import ENGINES, synthetic, load, euler
+
+try:
+    from fusion_fast import FusionFast
+except ImportError:
+    FusionFast = None
+
+REPEAT = 5
+Q_TOLERANCE = 1e-6
+NOISE = 3                   # changes within NOISE x their scatter around the median are noise
+SLOWDOWN = 0.2              # uniform slowdown of all kernels the gate must detect
+
+def kernels():
+    """ (name, factory, wrap) tuples: wrap converts a sample tuple to the kernel's input type """
+    k = [('fusion-' + name, lambda cls=cls: Fusion(engine=cls()), tuple) for name, cls in ENGINES]
+    if FusionFast is not None:
+        k.append(('fusion_fast', FusionFast, lambda v: array.array('f', v)))
+    return k
+
+def profiles(logs, n):
+    """ (name, samples, truth, periods_us) tuples """
+    out = []
+    for name, amplitude in (('slow', 0.3), ('fast', 2.0)):
+        samples, truth, dt = synthetic(n, amplitude=amplitude)
+        out.append((name, samples, truth, [int(dt * 1000000)] * len(samples)))
+    for path in logs:
+        samples, deltat = load(path)
+        out.append((os.path.basename(path), samples, None, [int(d * 1000000) for d in deltat]))
+    return out
+
+def _prepare(factory, wrap, samples):
+    pyb.reset()
+    fuse = factory()
+    data = [(wrap(a), wrap(g), wrap(m) if m is not None else None) for a, g, m in samples]
+    return fuse, data
+
+def run(factory, wrap, samples, periods, use_mag):
+    """ feeds all samples through a new kernel, returns the quaternion after every sample """
+    fuse, data = _prepare(factory, wrap, samples)
+    out = []
+    for i, (a, g, m) in enumerate(data):
+        pyb.advance(periods[i])
+        if use_mag:
+            fuse.update(a, g, m)
+        else:
+            fuse.update_nomag(a, g)
+        out.append(tuple(fuse.q))
+    return out
+
+def timed(factory, wrap, samples, periods, use_mag):
+    """ seconds of one pass with the update calls and of the same loop without them """
+    fuse, data = _prepare(factory, wrap, samples)
+    advance = pyb.advance
+    clock = time.perf_counter
+    gc.collect()
+    gc.disable()
+    try:
+        t = clock()
+        for i, (a, g, m) in enumerate(data):
+            advance(periods[i])
+        empty = clock() - t
+        pyb.reset()
+        if use_mag:
+            update = fuse.update
+            t = clock()
+            for i, (a, g, m) in enumerate(data):
+                advance(periods[i])
+                update(a, g, m)
+        else:
+            update = fuse.update_nomag
+            t = clock()
+            for i, (a, g, m) in enumerate(data):
+                advance(periods[i])
+                update(a, g)
+        total = clock() - t
+    finally:
+        gc.enable()
+    return total, empty
+
+def timed_pass(factory, wrap, samples, periods, use_mag):
+    """ (pass, loop overhead, reference workload) in seconds, see timed """
+    ref = reference(1)
+    t, e = timed(factory, wrap, samples, periods, use_mag)
+    return t, e, min(ref, reference(1)) / 1000000
+
+def best_of(passes):
+    """
+    time spent in the update calls (best pass minus the best loop overhead) of a list
+    of timed_pass results in seconds and in units of the reference workload timed next
+    to every pass, and the spread of the best time: (second best - best) / best in
+    reference units
+    """
+    best = max(0, min(t for t, e, r in passes) - min(e for t, e, r in passes))
+    rel_total = sorted(t / r for t, e, r in passes)
+    rel = max(0, rel_total[0] - min(e / r for t, e, r in passes))
+    spread = (rel_total[1] - rel_total[0]) / rel if rel and len(passes) > 1 else 0
+    return best, rel, spread
+
+def rms(est, ref, use_mag):
+    sq = [0.0, 0.0, 0.0]
+    for q, r in zip(est, ref):
+        e = euler(q)
+        for k in range(3):
+            d = e[k] - r[k]
+            if k == 0:
+                d = 0 if not use_mag else (d + 180) % 360 - 180
+            sq[k] += d * d
+    n = max(1, len(est))
+    return [(x / n) ** 0.5 for x in sq]
+
+def reference(repeat=REPEAT):
+    """
+    us for a fixed float workload, measured with every run: comparing times in
+    units of this reference cancels most of the difference between machines
+    and CPU clock changes between runs
+    """
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        s = 0.0
+        for k in range(20000):
+            s += (k * 0.5) * (k * 0.25)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best * 1000000
+
+def bench(logs=(), n=2000, repeat=REPEAT):
+    cases = []
+    results = []
+    ref_us = reference(repeat)
+    for pname, samples, truth, periods in profiles(logs, n):
+        has_mag = samples[0][2] is not None
+        for use_mag in ((False, True) if has_mag else (False,)):
+            ref = truth
+            if ref is None:
+                ref = [euler(x) for x in run(Fusion, tuple, samples, periods, use_mag)]
+            for kname, factory, wrap in kernels():
+                q = run(factory, wrap, samples, periods, use_mag)
+                cases.append((factory, wrap, samples, periods, use_mag))
+                results.append({
+                    'kernel': kname,
+                    'profile': pname,
+                    'method': 'update' if use_mag else 'update_nomag',
+                    'samples': len(samples),
+                    'final_q': list(q[-1]),
+                    'rms_err_hpr': rms(q, ref, use_mag),
+                })
+    # the repeats of a kernel are spread over the whole run (one pass of every kernel per
+    # round), so slow phases of the machine show up in the spread instead of in the best
+    passes = [[] for c in cases]
+    for i in range(repeat):
+        for c, case in enumerate(cases):
+            passes[c].append(timed_pass(*case))
+    for r, p in zip(results, passes):
+        best, rel, spread = best_of(p)
+        r['us_per_update'] = best * 1000000 / r['samples']
+        r['relative'] = rel / r['samples']      # per update in reference units
+        r['spread'] = spread
+    return {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'reference_us': ref_us,
+        'results': results,
+    }
+
+def _key(r):
+    return r['kernel'], r['profile'], r['method']
+
+def _change(r, b, scale):
+    if 'relative' in r and 'relative' in b:
+        return r['relative'] / b['relative'] - 1
+    return r['us_per_update'] * scale / b['us_per_update'] - 1
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0
+
+def gate(current, baseline, tolerance):
+    """
+    (key, result, baseline result or None, change, limit, flag) for every current result,
+    and the median change of all results
+    """
+    old = {_key(r): r for r in baseline['results']}
+    scale = baseline['reference_us'] / current['reference_us']   # machine speed correction
+    changes = {_key(r): _change(r, old[_key(r)], scale) for r in current['results'] if _key(r) in old}
+    # a slowdown of most kernels (e.g. in the Fusion wrapper) moves the median, noise
+    # scatters the changes around it: the median is compared with the tolerance, every
+    # kernel's change above the median with the scatter
+    median = _median(changes.values())
+    scatter = _median(abs(c - median) for c in changes.values())
+    limit = max(tolerance, NOISE * scatter)
+    rows = []
+    for r in current['results']:
+        b = old.get(_key(r))
+        if b is None:
+            rows.append((_key(r), r, None, 0, limit, ''))
+            continue
+        change = changes[_key(r)]
+        # a kernel whose best time didn't repeat well in either run gets a wider limit
+        lim = max(limit, NOISE * (r.get('spread', 0) + b.get('spread', 0)))
+        dq = max(abs(x - y) for x, y in zip(r['final_q'], b['final_q']))
+        flag = ''
+        if change - median > lim or (median > tolerance and change > tolerance):
+            flag = 'SLOWER'
+        if dq > Q_TOLERANCE:
+            flag += ' RESULT CHANGED'
+        rows.append((_key(r), r, b, change, lim, flag.strip()))
+    return rows, median
+
+def slowed(current, slowdown=SLOWDOWN):
+    """ copy of a run with all kernels slowed down uniformly """
+    out = dict(current)
+    out['results'] = []
+    for r in current['results']:
+        r = dict(r)
+        r['us_per_update'] *= 1 + slowdown
+        if 'relative' in r:
+            r['relative'] *= 1 + slowdown
+        out['results'].append(r)
+    return out
+
+def check_gate(current, baseline, tolerance, slowdown=SLOWDOWN):
+    """
+    keys of the results for which the gate misses a uniform slowdown of all kernels
+    added to the current run: empty if the gate works with this pair of runs
+    """
+    rows, median = gate(slowed(current, slowdown), baseline, tolerance)
+    return [row[0] for row in rows if row[2] is not None and 'SLOWER' not in row[5]]
+
+def compare(current, baseline, tolerance):
+    """ prints the change against a baseline run, returns the list of regressions """
+    regressions = []
+    print('{:<26}{:<12}{:<14}{:>10}{:>10}{:>9}{:>8}'.format('kernel', 'profile', 'method', 'us', 'base us',
+                                                           'change', 'limit'))
+    rows, median = gate(current, baseline, tolerance)
+    for key, r, b, change, limit, flag in rows:
+        if b is None:
+            print('{:<26}{:<12}{:<14}{:>10.2f}{:>10}'.format(*key, r['us_per_update'], 'new'))
+            continue
+        if flag:
+            regressions.append((key, flag))
+        print('{:<26}{:<12}{:<14}{:>10.2f}{:>10.2f}{:>+8.1f}%{:>7.1f}% {}'.format(
+            *key, r['us_per_update'], b['us_per_update'], change * 100, limit * 100, flag))
+    print('median change of all kernels: {:+.1f}% (limit {:.1f}%){}'.format(
+        median * 100, tolerance * 100, ', MOST KERNELS SLOWER' if median > tolerance else ''))
+    return regressions
+
+def report(current):
+    print('{:<26}{:<12}{:<14}{:>10}{:>26}'.format('kernel', 'profile', 'method', 'us', 'rms err h/p/r'))
+    for r in current['results']:
+        print('{:<26}{:<12}{:<14}{:>10.2f}{:>26}'.format(
+            *_key(r), r['us_per_update'], '{:.3f}/{:.3f}/{:.3f}'.format(*r['rms_err_hpr'])))
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='host benchmark of the fusion kernels')
+    p.add_argument('logs', nargs='*', help='recorded logs (fusion_replay csv format)')
+    p.add_argument('-o', '--output', help='write results as JSON')
+    p.add_argument('-n', type=int, default=2000, help='samples per synthetic profile')
+    p.add_argument('--repeat', type=int, default=REPEAT)
+    p.add_argument('--baseline', help='results of an earlier run to compare with')
+    p.add_argument('--tolerance', type=float, default=0.1,
+                   help='allowed median slowdown of all kernels and of a kernel against the median (0.1: 10%%)')
+    args = p.parse_args(argv)
+    current = bench(args.logs, args.n, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for key, what in regressions:
+            print('regression: {} {} {}: {}'.format(*key, what))
+        if regressions:
+            return 1
+        blind = check_gate(current, baseline, args.tolerance)
+        if blind:
+            print('gate check failed: a uniform {:.0f}% slowdown would pass for {} of {} results, '
+                  'take a new baseline'.format(SLOWDOWN * 100, len(blind), len(current['results'])))
+            return 2
+        return 0
+    report(current)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Report of I2CTrace dumps: bus time per device and register
+
+Reads the lines printed by I2CTrace.dump (a captured console log is fine,
+other lines are skipped; several dumps in one file are added up) and prints
+the transfers, bytes and time per device and per register, with each
+entry's share of the total time. With --baseline a second dump (e.g. taken
+before a driver change, running the same workload) is compared per device.
+
+Usage (from the raspi-hat directory):
+    python3 host/i2creport.py console.log [--baseline before.log] [--top 20]
+    python3 host/i2creport.py --sim         # trace a short uSenseHAT run on the simulated bus
+"""
+import os
+import sys
+import argparse
+
+DEVICES = {0x1c: 'LSM9DS1-M', 0x6a: 'LSM9DS1-AG', 0x5c: 'LPS25H', 0x5f: 'HTS221',
+           0x46: 'Atmel', 0x50: 'EEPROM', 0xff: '(table full)'}
+
+# register names, the ST sensors' auto increment bit 7 is removed when parsing
+REGISTERS = {
+    0x1c: {0x05: 'OFFSET_M', 0x0f: 'WHO_AM_I', 0x20: 'CTRL_REG1_M', 0x21: 'CTRL_REG2_M',
+           0x22: 'CTRL_REG3_M', 0x23: 'CTRL_REG4_M', 0x24: 'CTRL_REG5_M', 0x27: 'STATUS_REG_M',
+           0x28: 'OUT_M'},
+    0x6a: {0x0c: 'INT1_CTRL', 0x0d: 'INT2_CTRL', 0x0f: 'WHO_AM_I', 0x10: 'CTRL_REG1_G',
+           0x17: 'STATUS_REG', 0x18: 'OUT_G', 0x1e: 'CTRL_REG4', 0x22: 'CTRL_REG8',
+           0x23: 'CTRL_REG9', 0x27: 'STATUS_REG', 0x28: 'OUT_XL', 0x2e: 'FIFO_CTRL', 0x2f: 'FIFO_SRC'},
+    0x5c: {0x0f: 'WHO_AM_I', 0x10: 'RES_CONF', 0x20: 'CTRL_REG1', 0x21: 'CTRL_REG2',
+           0x27: 'STATUS', 0x28: 'PRESS_OUT', 0x2b: 'TEMP_OUT', 0x2e: 'FIFO_CTRL', 0x2f: 'FIFO_STATUS'},
+    0x5f: {0x0f: 'WHO_AM_I', 0x10: 'AV_CONF', 0x20: 'CTRL_REG1', 0x21: 'CTRL_REG2',
+           0x22: 'CTRL_REG3', 0x27: 'STATUS', 0x28: 'H_OUT', 0x2a: 'T_OUT', 0x30: 'CALIB'},
+    0x46: {0x00: 'FB', 0xf0: 'ID', 0xf1: 'VER', 0xf2: 'KEYS'},
+}
+ST_SENSORS = (0x1c, 0x6a, 0x5c, 0x5f)
+
+def parse(lines):
+    """ {(addr, rw, reg): [count, bytes, us]} from dump lines, ST sensor registers without bit 7 """
+    table = {}
+    in_dump = False
+    for line in lines:
+        f = line.split()
+        if f and f[0] == '#i2ctrace':
+            in_dump = True
+            continue
+        if not in_dump or len(f) != 6 or f[1] not in ('r', 'w'):
+            in_dump = False
+            continue
+        try:
+            addr, reg = int(f[0], 16), int(f[2], 16)
+            values = [int(v) for v in f[3:]]
+        except ValueError:
+            in_dump = False
+            continue
+        if addr in ST_SENSORS:
+            reg &= 0x7f                     # with and without auto increment: one register
+        key = (addr, f[1], reg)
+        s = table.setdefault(key, [0, 0, 0])
+        for i in range(3):
+            s[i] += values[i]
+    return table
+
+def load(path):
+    with open(path) as f:
+        return parse(f)
+
+def register_name(addr, reg):
+    names = REGISTERS.get(addr, {})
+    if reg in names:
+        return names[reg]
+    if addr == 0x46 and reg < 0xc0:
+        return 'FB+%d' % reg
+    return '0x%02x' % reg
+
+def per_device(table):
+    out = {}
+    for (addr, rw, reg), v in table.items():
+        s = out.setdefault(addr, [0, 0, 0])
+        for i in range(3):
+            s[i] += v[i]
+    return out
+
+def report(table, top=20):
+    total = sum(v[2] for v in table.values()) or 1
+    lines = ['%-12s %8s %9s %10s %6s' % ('device', 'count', 'bytes', 'us', 'time')]
+    for addr, (c, n, us) in sorted(per_device(table).items(), key=lambda kv: -kv[1][2]):
+        lines.append('%-12s %8d %9d %10d %5.1f%%' % (DEVICES.get(addr, '0x%02x' % addr), c, n, us, 100 * us / total))
+    lines.append('')
+    lines.append('%-12s %-14s %2s %8s %9s %10s %8s %6s' % ('device', 'register', 'rw', 'count', 'bytes',
+                                                          'us', 'us/call', 'time'))
+    entries = sorted(table.items(), key=lambda kv: -kv[1][2])
+    for (addr, rw, reg), (c, n, us) in entries[:top]:
+        lines.append('%-12s %-14s %2s %8d %9d %10d %8.1f %5.1f%%' % (
+            DEVICES.get(addr, '0x%02x' % addr), register_name(addr, reg), rw, c, n, us, us / c, 100 * us / total))
+    if len(entries) > top:
+        lines.append('... %d more entries' % (len(entries) - top))
+    c = sum(v[0] for v in table.values())
+    n = sum(v[1] for v in table.values())
+    lines.append('total: %d transfers, %d bytes, %d us' % (c, n, sum(v[2] for v in table.values())))
+    return '\n'.join(lines)
+
+def compare(table, baseline):
+    cur = per_device(table)
+    base = per_device(baseline)
+    lines = ['%-12s %10s %10s %8s %10s %10s' % ('device', 'us before', 'us after', 'change', 'xfers bef', 'xfers aft')]
+    for addr in sorted(set(cur) | set(base), key=lambda a: -base.get(a, cur.get(a))[2]):
+        b = base.get(addr, [0, 0, 0])
+        a = cur.get(addr, [0, 0, 0])
+        change = '%+7.1f%%' % (100 * (a[2] - b[2]) / b[2]) if b[2] else '    new'
+        lines.append('%-12s %10d %10d %8s %10d %10d' % (DEVICES.get(addr, '0x%02x' % addr), b[2], a[2], change, b[0], a[0]))
+    return '\n'.join(lines)
+
+def simulate():
+    """ dump lines of a short traced uSenseHAT run on host/sim_i2c.py """
+    import io
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    sys.path.insert(1, os.path.dirname(here))
+    import pyb
+    from sim_i2c import SimI2C
+    from sensehat import uSenseHAT
+    sense = uSenseHAT(SimI2C(), trace=True)
+    sense.trace.reset()
+    for i in range(10):
+        sense.measure()
+        sense.get_humidity()
+        sense.get_temperature()
+        sense.get_pressure()
+        for k in range(10):
+            pyb.delay(10)
+            sense.lsm.read_fifo()
+            sense.lsm.read_magnet_cached()
+        sense.matrix.set_pixel(i % 8, 0, (31, 0, 0), refresh=True)
+    out = io.StringIO()
+    sense.trace.dump(out)
+    return out.getvalue().splitlines()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    ap.add_argument('dump', nargs='?', help='file with I2CTrace.dump output')
+    ap.add_argument('--baseline', help='dump to compare against')
+    ap.add_argument('--top', type=int, default=20, help='register entries shown')
+    ap.add_argument('--sim', action='store_true', help='trace a run on the simulated bus')
+    args = ap.parse_args(argv)
+    if args.sim:
+        table = parse(simulate())
+    elif args.dump:
+        table = load(args.dump)
+    else:
+        ap.error('a dump file or --sim is required')
+    if not table:
+        print('no i2ctrace dump found')
+        return 1
+    print(report(table, args.top))
+    if args.baseline:
+        print()
+        print(compare(table, load(args.baseline)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
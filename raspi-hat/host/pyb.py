@@ -0,0 +1,45 @@
+"""
+pyb stand-in for running the drivers and filters on CPython
+
+Only the timing functions are provided. They run on a virtual clock that
+starts at 0 and only moves when the host code says so (advance, delay,
+udelay), so filters that measure the time between updates get a
+deterministic time step independent of the speed of the host.
+
+Example usage:
+>>> import sys; sys.path.insert(0, 'host')
+>>> import pyb
+>>> from fusion import Fusion
+>>> fuse = Fusion()
+>>> for accel, gyro, mag in samples:
+...     pyb.advance(2000)               # 500 Hz
+...     fuse.update(accel, gyro, mag)   # deltat = 0.002
+"""
+_now = 0                                # virtual time in us
+
+def advance(us):
+    """ moves the virtual clock forward by us microseconds """
+    global _now
+    _now += int(us)
+
+def reset(us=0):
+    global _now
+    _now = int(us)
+
+def micros():
+    return _now & 0x3fffffff
+
+def millis():
+    return (_now // 1000) & 0x3fffffff
+
+def elapsed_micros(start):
+    return (micros() - start) & 0x3fffffff
+
+def elapsed_millis(start):
+    return (millis() - start) & 0x3fffffff
+
+def udelay(us):
+    advance(us)
+
+def delay(ms):
+    advance(ms * 1000)
@@ -0,0 +1,706 @@
+"""
+Simulated SenseHAT I2C bus for running the raspi-hat drivers on CPython
+
+SimI2C stands in for machine.I2C / pyb.I2C (readfrom_mem, readfrom_mem_into,
+writeto_mem, mem_read, mem_write). Register level models of the SenseHAT
+chips answer on their bus addresses:
+
+    0x1c  LSM9DS1 magnetometer      MagnetModel
+    0x6a  LSM9DS1 accelerometer/gyro, with fifo   GyroAccelModel
+    0x5c  LPS25H pressure/temperature   LPS25HModel
+    0x5f  HTS221 humidity/temperature   HTS221Model
+    0x46  Atmel LED matrix/joystick     AtmelModel
+    0x50  HAT ID EEPROM (24C32)         EEPROMModel
+
+The models run on the virtual clock of the pyb stand-in in this directory:
+sensors produce samples at their configured output data rate as the clock
+advances, one-shot conversions take their conversion time, the LSM9DS1 fifo
+fills and overruns like the chip's. Every transfer advances the clock by its
+bus time estimated by BusTiming (bits at the bus frequency plus a fixed
+software overhead per call), and the time is accounted per device, direction
+and register, so the bus cost of a driver operation can be read from the
+statistics. time.ticks_us/ticks_ms/ticks_diff/ticks_add/sleep_ms/sleep_us are
+added to the time module (running on the same virtual clock) and const to the
+builtins if missing, so uSenseHAT and the drivers run unmodified.
+
+Sensitivities are nominal (full scale / 32768 per LSB, the convention of
+lsm9ds1.py), not the typical values of the datasheets.
+
+Example usage (from the raspi-hat directory):
+>>> import sys; sys.path.insert(0, 'host')
+>>> from sim_i2c import SimI2C
+>>> bus = SimI2C()
+>>> from sensehat import uSenseHAT
+>>> sense = uSenseHAT(bus)
+>>> bus.reset_stats()
+>>> with bus.op('read_fifo'):
+...     n = sense.lsm.read_fifo()
+>>> print(bus.report())
+>>> bus.lsm.motion = lambda t: ((0, 0, 1), (0, 0, 90), (0.3, 0, -0.4))   # turning at 90 deg/s
+"""
+import sys
+import os
+import time
+import builtins
+import errno
+import struct
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))      # pyb stand-in
+import pyb
+
+def _install():
+    """
+    MicroPython's builtin const and time functions (on the virtual clock), where
+    the host lacks them
+    """
+    if not hasattr(builtins, 'const'):
+        builtins.const = lambda x: x
+    extra = {
+        'ticks_us': pyb.micros,
+        'ticks_ms': pyb.millis,
+        'ticks_diff': lambda a, b: ((a - b + 0x20000000) & 0x3fffffff) - 0x20000000,
+        'ticks_add': lambda a, b: (a + b) & 0x3fffffff,
+        'sleep_ms': pyb.delay,
+        'sleep_us': pyb.udelay,
+    }
+    for name, f in extra.items():
+        if not hasattr(time, name):
+            setattr(time, name, f)
+
+_install()
+
+def _clip16(v):
+    v = int(round(v))
+    return 32767 if v > 32767 else -32768 if v < -32768 else v
+
+class BusTiming:
+    def __init__(self, freq=400000, call_us=20):
+        """
+        freq: bus clock in Hz, call_us: software overhead per transfer (driver call,
+        i2c peripheral setup)
+        """
+        self.freq = freq
+        self.call_us = call_us
+
+    def transfer_us(self, read, memsize, n):
+        """ estimated time of a memory read or write of n bytes with a memsize byte register address """
+        if read:
+            # START, addr+W, register, repeated START, addr+R, data, STOP
+            bits = 9 * (2 + memsize + n) + 3
+        else:
+            # START, addr+W, register, data, STOP
+            bits = 9 * (1 + memsize + n) + 2
+        return self.call_us + bits * 1000000 / self.freq
+
+class Device:
+    """ register file of 256 bytes, sub addresses with bit 7 set auto increment (ST convention) """
+    name = 'device'
+    autoinc_bit = 0x80
+
+    def __init__(self):
+        self.regs = bytearray(256)
+
+    def sync(self, now):
+        """ brings the model up to the virtual time now (us) """
+        pass
+
+    def _start(self, reg):
+        if self.autoinc_bit:
+            return reg & ~self.autoinc_bit & 0xff, bool(reg & self.autoinc_bit)
+        return reg, True
+
+    def next_reg(self, reg):
+        return (reg + 1) & 0xff
+
+    def read(self, reg, n):
+        reg, inc = self._start(reg)
+        out = bytearray(n)
+        for i in range(n):
+            out[i] = self.read_reg(reg)
+            if inc:
+                reg = self.next_reg(reg)
+        return out
+
+    def write(self, reg, data):
+        reg, inc = self._start(reg)
+        for b in data:
+            self.write_reg(reg, b)
+            if inc:
+                reg = self.next_reg(reg)
+
+    def read_reg(self, reg):
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        self.regs[reg] = value
+
+class _Sampler:
+    """ output data rate clock of a sensor: yields the sample times up to now """
+    def __init__(self, ppm=0):
+        self.ppm = ppm
+        self.odr = 0
+        self.next = None
+
+    def set_odr(self, odr, now):
+        if odr != self.odr:
+            self.odr = odr
+            self.next = now + self.period() if odr else None
+
+    def period(self):
+        return 1000000 / (self.odr * (1 + self.ppm * 1e-6))
+
+    def due(self, now, limit=64):
+        """ times of the samples produced until now, at most the last limit ones """
+        if self.next is None or self.next > now:
+            return []
+        p = self.period()
+        count = int((now - self.next) // p) + 1
+        skip = max(0, count - limit)
+        times = [self.next + (skip + i) * p for i in range(count - skip)]
+        self.next += count * p
+        return times
+
+class GyroAccelModel(Device):
+    """
+    LSM9DS1 accelerometer/gyroscope: CTRL_REG1_G ODR and full scale, CTRL_REG6_XL
+    (accelerometer only mode), CTRL_REG8 IF_ADD_INC, CTRL_REG9 FIFO_EN, FIFO_CTRL
+    modes bypass, fifo, continuous (continuous-to-fifo behaves as continuous,
+    bypass-to-continuous as bypass: there are no trigger events), FIFO_SRC and
+    STATUS_REG. With the fifo enabled the output registers show the oldest frame,
+    a read across OUT_Z_H_G continues at OUT_X_L_XL and the frame is removed when
+    OUT_Z_H_XL has been read.
+    motion(t) returns (accel g, gyro dps, mag gauss) at t seconds.
+    """
+    name = 'lsm9ds1-ag'
+    ODR = (0, 14.9, 59.5, 119, 238, 476, 952)
+    ODR_XL = (0, 10, 50, 119, 238, 476, 952)    # accelerometer only mode
+    FS_G = (245, 500, 245, 2000)
+    FS_XL = (2, 16, 4, 8)
+    DEPTH = 32
+
+    def __init__(self, motion=None, ppm=0):
+        super().__init__()
+        self.motion = motion or still
+        self.regs[0x0f] = 0x68              # WHO_AM_I
+        self.regs[0x22] = 0x04              # CTRL_REG8: IF_ADD_INC
+        self.clock = _Sampler(ppm)
+        self.fifo = []                      # frames (12 bytes each), oldest first
+        self.overrun = False
+        self.current = bytes(12)            # latest sample (bypass mode)
+        self.samples = 0
+
+    def fifo_active(self):
+        return self.regs[0x23] & 0x02 and (self.regs[0x2e] >> 5) in (1, 3, 6)
+
+    def sync(self, now):
+        r = self.regs
+        odr = self.ODR[min(r[0x10] >> 5, 6)] or self.ODR_XL[min(r[0x20] >> 5, 6)]
+        self.clock.set_odr(odr, now)
+        gyro_on = r[0x10] >> 5
+        fs_g = self.FS_G[(r[0x10] >> 3) & 3]
+        fs_xl = self.FS_XL[(r[0x20] >> 3) & 3]
+        mode = r[0x2e] >> 5
+        for t in self.clock.due(now, self.DEPTH + 1):
+            a, g, m = self.motion(t * 1e-6)
+            gyro = [_clip16(v * 32768 / fs_g) if gyro_on else 0 for v in g]
+            accel = [_clip16(v * 32768 / fs_xl) for v in a]
+            frame = struct.pack('<6h', *(gyro + accel))
+            self.current = frame
+            self.samples += 1
+            r[0x17] |= 0x03 if gyro_on else 0x01        # GDA, XLDA
+            r[0x27] = r[0x17]
+            if self.fifo_active():
+                if len(self.fifo) < self.DEPTH:
+                    self.fifo.append(frame)
+                elif mode == 1:             # fifo mode: stops collecting
+                    self.overrun = True
+                else:                       # continuous: oldest frame overwritten
+                    self.fifo.pop(0)
+                    self.fifo.append(frame)
+                    self.overrun = True
+
+    def next_reg(self, reg):
+        if not self.regs[0x22] & 0x04:      # IF_ADD_INC off
+            return reg
+        if self.fifo_active():
+            if reg == 0x1d:
+                return 0x28
+            if reg == 0x2d:
+                return 0x18
+        return (reg + 1) & 0xff
+
+    def _frame(self):
+        if self.fifo_active() and self.fifo:
+            return self.fifo[0]
+        return self.current
+
+    def _start(self, reg):
+        return reg & 0x7f, True             # auto increment is set by IF_ADD_INC
+
+    def read_reg(self, reg):
+        r = self.regs
+        if 0x18 <= reg <= 0x1d:
+            r[0x17] &= ~0x02
+            r[0x27] = r[0x17]
+            return self._frame()[reg - 0x18]
+        if 0x28 <= reg <= 0x2d:
+            v = self._frame()[reg - 0x28 + 6]
+            r[0x17] &= ~0x01
+            r[0x27] = r[0x17]
+            if reg == 0x2d and self.fifo_active() and self.fifo:
+                self.fifo.pop(0)
+                self.overrun = False
+            return v
+        if reg == 0x2f:                     # FIFO_SRC
+            n = len(self.fifo)
+            fth = r[0x2e] & 0x1f
+            return (0x80 if fth and n >= fth else 0) | (0x40 if self.overrun else 0) | n
+        return r[reg]
+
+    def write_reg(self, reg, value):
+        if reg == 0x2e and not value >> 5:  # bypass: fifo reset
+            self.fifo = []
+            self.overrun = False
+        if reg in (0x0f, 0x17, 0x27, 0x2f) or 0x15 <= reg <= 0x1d or 0x28 <= reg <= 0x2d:
+            return                          # read only
+        self.regs[reg] = value
+
+    def int1(self):
+        """ level of the INT1_A/G line (INT_FTH, INT_DRDY_G of INT1_CTRL) """
+        ctrl = self.regs[0x0c]
+        src = self.read_reg(0x2f)
+        return bool((ctrl & 0x08 and src & 0x80) or (ctrl & 0x02 and self.regs[0x17] & 0x02))
+
+class MagnetModel(Device):
+    """
+    LSM9DS1 magnetometer: CTRL_REG1_M DO rate, CTRL_REG2_M full scale, CTRL_REG3_M
+    continuous/single/power down, offset registers (subtracted from the output),
+    STATUS_REG_M ZYXDA/ZYXOR (cleared by reading OUT_Z_H_M)
+    """
+    name = 'lsm9ds1-m'
+    ODR = (0.625, 1.25, 2.5, 5, 10, 20, 40, 80)
+    FS = (4, 8, 12, 16)
+
+    def __init__(self, motion=None, ppm=0):
+        super().__init__()
+        self.motion = motion or still
+        self.regs[0x0f] = 0x3d              # WHO_AM_I
+        self.regs[0x20] = 0x10
+        self.regs[0x22] = 0x03              # power down
+        self.clock = _Sampler(ppm)
+        self.samples = 0
+
+    def sync(self, now):
+        r = self.regs
+        md = r[0x22] & 3
+        self.clock.set_odr(self.ODR[(r[0x20] >> 2) & 7] if md == 0 else 0, now)
+        times = self.clock.due(now, 2)
+        if md == 1:                         # single conversion, then power down
+            times = [now]
+            r[0x22] |= 0x03
+        if not times:
+            return
+        a, g, m = self.motion(times[-1] * 1e-6)
+        fs = self.FS[(r[0x21] >> 5) & 3]
+        off = struct.unpack_from('<3h', r, 0x05)
+        struct.pack_into('<3h', r, 0x28, *[_clip16(m[i] * 32768 / fs - off[i]) for i in range(3)])
+        self.samples += len(times)
+        if r[0x27] & 0x08 or len(times) > 1:
+            r[0x27] |= 0x80                 # ZYXOR: overwritten before read
+        r[0x27] |= 0x08
+
+    def read_reg(self, reg):
+        if reg == 0x2d:
+            self.regs[0x27] &= ~0x88
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        if reg not in (0x0f, 0x27) and not 0x28 <= reg <= 0x2d:
+            self.regs[reg] = value
+
+class HTS221Model(Device):
+    """
+    HTS221: CTRL_REG1 PD and ODR (one-shot, 1, 7, 12.5 Hz), CTRL_REG2 ONE_SHOT
+    (cleared after conversion_us), STATUS H_DA/T_DA (cleared by reading the high
+    bytes), calibration registers of a typical part
+    """
+    name = 'hts221'
+    ODR = (0, 1, 7, 12.5)
+
+    def __init__(self, temperature=22.5, humidity=45.0, conversion_us=4500):
+        super().__init__()
+        self.temperature = temperature
+        self.humidity = humidity
+        self.conversion_us = conversion_us
+        r = self.regs
+        r[0x0f] = 0xbc                      # WHO_AM_I
+        r[0x10] = 0x1b                      # AV_CONF default
+        # calibration: 10 and 35 degC at -300 and 4700, 20 and 80 %rH at -5000 and 7000
+        self.cal = (10.0, 35.0, -300, 4700, 20.0, 80.0, -5000, 7000)
+        t0, t1, t0_out, t1_out, h0, h1, h0_out, h1_out = self.cal
+        t0x8, t1x8 = int(t0 * 8), int(t1 * 8)
+        r[0x30], r[0x31] = int(h0 * 2), int(h1 * 2)
+        r[0x32], r[0x33] = t0x8 & 0xff, t1x8 & 0xff
+        r[0x35] = (t0x8 >> 8) | (t1x8 >> 8) << 2
+        struct.pack_into('<h', r, 0x36, h0_out)
+        struct.pack_into('<h', r, 0x3a, h1_out)
+        struct.pack_into('<h', r, 0x3c, t0_out)
+        struct.pack_into('<h', r, 0x3e, t1_out)
+        self.clock = _Sampler()
+        self.done = None                    # end of the running one-shot conversion
+        self.samples = 0
+
+    def _sample(self):
+        t0, t1, t0_out, t1_out, h0, h1, h0_out, h1_out = self.cal
+        r = self.regs
+        t = t0_out + (self.temperature - t0) * (t1_out - t0_out) / (t1 - t0)
+        h = h0_out + (self.humidity - h0) * (h1_out - h0_out) / (h1 - h0)
+        struct.pack_into('<hh', r, 0x28, _clip16(h), _clip16(t))
+        r[0x27] |= 0x03
+        self.samples += 1
+
+    def sync(self, now):
+        r = self.regs
+        on = r[0x20] & 0x80
+        self.clock.set_odr(self.ODR[r[0x20] & 3] if on else 0, now)
+        if self.clock.due(now, 1):
+            self._sample()
+        if self.done is not None and now >= self.done:
+            self.done = None
+            r[0x21] &= ~0x01
+            self._sample()
+
+    def read_reg(self, reg):
+        if reg == 0x29:
+            self.regs[0x27] &= ~0x02
+        elif reg == 0x2b:
+            self.regs[0x27] &= ~0x01
+        return self.regs[reg]
+
+    def write_reg(self, reg, value):
+        if reg == 0x21 and value & 0x01 and self.regs[0x20] & 0x80 and self.done is None:
+            self.done = pyb._now + self.conversion_us
+        if reg not in (0x0f, 0x27) and not 0x28 <= reg <= 0x2b and not 0x30 <= reg <= 0x3f:
+            self.regs[reg] = value
+
+class LPS25HModel(Device):
+    """
+    LPS25H: CTRL_REG1 PD and ODR (one-shot, 1, 7, 12.5, 25 Hz), CTRL_REG2 ONE_SHOT
+    (cleared after conversion_us), STATUS P_DA/T_DA (cleared by reading the high bytes),
+    fifo (CTRL_REG2 FIFO_EN, FIFO_CTRL, FIFO_STATUS): fifo mode, stream (stream-to-fifo
+    behaves as stream, the bypass-to-x modes as bypass: there are no trigger events) and
+    mean mode (running mean of WTM_POINT + 1 samples in the outputs, FIFO_MEAN_DEC is
+    ignored). In fifo and stream mode the outputs show the oldest sample, a read across
+    TEMP_OUT_H continues at PRESS_OUT_XL and the sample is removed when TEMP_OUT_H has
+    been read. noise: standard deviation of the pressure samples in hPa.
+    """
+    name = 'lps25h'
+    ODR = (0, 1, 7, 12.5, 25, 0, 0, 0)
+    DEPTH = 32
+
+    def __init__(self, temperature=22.5, pressure=1013.25, conversion_us=36000, noise=0.0):
+        super().__init__()
+        self.temperature = temperature
+        self.pressure = pressure
+        self.conversion_us = conversion_us
+        self.noise = noise
+        self.random = random.Random(1)
+        self.regs[0x0f] = 0xbd              # WHO_AM_I
+        self.regs[0x10] = 0x05              # RES_CONF default
+        self.clock = _Sampler()
+        self.done = None
+        self.samples = 0
+        self.fifo = []                      # (pressure, temperature) raw, oldest first
+        self.history = []                   # samples of the running mean
+
+    def _mode(self):
+        r = self.regs
+        return r[0x2e] >> 5 if r[0x21] & 0x40 else 0
+
+    def _sample(self):
+        r = self.regs
+        p = self.pressure + (self.random.gauss(0, self.noise) if self.noise else 0)
+        p = int(round(p * 4096))
+        t = _clip16((self.temperature - 42.5) * 480)
+        mode = self._mode()
+        if mode == 6:
+            self.history.append((p, t))
+            del self.history[:-((r[0x2e] & 0x1f) + 1)]
+            n = len(self.history)
+            p = sum(v[0] for v in self.history) // n
+            t = sum(v[1] for v in self.history) // n
+        elif mode in (1, 2, 3):
+            if len(self.fifo) < self.DEPTH:
+                self.fifo.append((p, t))
+            elif mode != 1:
+                self.fifo.pop(0)
+                self.fifo.append((p, t))
+        self._output(p, t)
+        r[0x27] |= 0x03
+        self.samples += 1
+
+    def _output(self, p, t):
+        r = self.regs
+        r[0x28:0x2b] = (p & 0xffffff).to_bytes(3, 'little')
+        struct.pack_into('<h', r, 0x2b, t)
+
+    def sync(self, now):
+        r = self.regs
+        on = r[0x20] & 0x80
+        self.clock.set_odr(self.ODR[(r[0x20] >> 4) & 7] if on else 0, now)
+        for t in self.clock.due(now, self.DEPTH + 1):
+            self._sample()
+        if self.done is not None and now >= self.done:
+            self.done = None
+            r[0x21] &= ~0x01
+            self._sample()
+
+    def next_reg(self, reg):
+        if reg == 0x2c and self._mode() in (1, 2, 3):
+            return 0x28
+        return (reg + 1) & 0xff
+
+    def read_reg(self, reg):
+        r = self.regs
+        fifo = self._mode() in (1, 2, 3) and self.fifo
+        if fifo and reg == 0x28:
+            self._output(*self.fifo[0])
+        if reg == 0x2a:
+            r[0x27] &= ~0x02
+        elif reg == 0x2c:
+            r[0x27] &= ~0x01
+            if fifo:
+                v = r[reg]
+                self.fifo.pop(0)
+                return v
+        elif reg == 0x2f:                   # FIFO_STATUS
+            n = len(self.fifo)
+            wtm = r[0x2e] & 0x1f
+            return ((0x80 if r[0x21] & 0x20 and wtm and n >= wtm else 0) |
+                    (0x40 if n == self.DEPTH else 0) | (0x20 if n == 0 else 0) | (n & 0x1f))
+        return r[reg]
+
+    def write_reg(self, reg, value):
+        if reg == 0x21 and value & 0x01 and self.regs[0x20] & 0x80 and self.done is None:
+            self.done = pyb._now + self.conversion_us
+        if reg == 0x2e and not value >> 5:  # bypass: fifo reset
+            self.fifo = []
+            self.history = []
+        if reg not in (0x0f, 0x27, 0x2f) and not 0x28 <= reg <= 0x2c:
+            self.regs[reg] = value
+
+class AtmelModel(Device):
+    """
+    Atmel LED/joystick controller: framebuffer 0x00-0xbf (24 bytes per row: 8 red,
+    8 green, 8 blue, 5 bit values), 0xf0 id 's', 0xf1 version, 0xf2 keys.
+    The register address always auto increments.
+    """
+    name = 'atmel'
+    autoinc_bit = 0
+
+    def __init__(self):
+        super().__init__()
+        self.regs[0xf0] = ord('s')
+        self.regs[0xf1] = 0x00
+        self.keys = 0                       # KEY_xxx bits of atmel.SenseAtmel
+        self.frames = 0                     # framebuffer writes
+
+    def read_reg(self, reg):
+        if reg == 0xf2:
+            return self.keys
+        return self.regs[reg]
+
+    def write(self, reg, data):
+        if reg < 0xc0:
+            self.frames += 1
+        super().write(reg, data)
+
+    def write_reg(self, reg, value):
+        if reg < 0xc0:
+            self.regs[reg] = value & 0x1f
+
+    def pixel(self, x, y):
+        """ (r, g, b) of pixel x, y as shown """
+        i = 24 * y + x
+        return self.regs[i], self.regs[i + 8], self.regs[i + 16]
+
+class EEPROMModel(Device):
+    """
+    24C32 HAT ID EEPROM: 4 kbyte, 16 bit addresses, 32 byte write pages. During
+    the internal write cycle the chip doesn't acknowledge (OSError ENODEV).
+    """
+    name = 'eeprom'
+    autoinc_bit = 0
+    SIZE = 4096
+    PAGE = 32
+
+    def __init__(self, image=None, write_cycle_us=5000):
+        self.write_cycle_us = write_cycle_us
+        self.regs = bytearray(b'\xff' * self.SIZE)
+        image = sensehat_eeprom() if image is None else image
+        self.regs[:len(image)] = image
+        self.busy = 0                       # end of the write cycle (virtual us)
+
+    def next_reg(self, reg):
+        return (reg + 1) % self.SIZE
+
+    def write(self, reg, data):
+        page = reg - reg % self.PAGE
+        for b in data:
+            self.regs[reg] = b
+            reg = page + (reg + 1) % self.PAGE  # wraps within the page like the chip
+        self.busy = pyb._now + self.write_cycle_us
+
+def _crc16(data):
+    crc = 0
+    for b in data:
+        crc ^= b
+        for i in range(8):
+            crc = (crc >> 1) ^ 0xa001 if crc & 1 else crc >> 1
+    return crc
+
+def sensehat_eeprom(vendor=b'Raspberry Pi', product=b'Sense HAT', pid=1, pver=1):
+    """ HAT EEPROM image (R-Pi header, vendor and GPIO atoms) as read by ideeprom.py """
+    atoms = []
+    uuid = bytes(range(16))
+    vendor_data = uuid + struct.pack('<HHBB', pid, pver, len(vendor), len(product)) + vendor + product
+    gpio_data = bytes([0x00, 0x00]) + bytes(28)
+    for count, (kind, data) in enumerate(((1, vendor_data), (2, gpio_data))):
+        head = struct.pack('<HHL', kind, count, len(data) + 2)
+        atoms.append(head + data + struct.pack('<H', _crc16(head + data)))
+    body = b''.join(atoms)
+    return struct.pack('<4sBBHL', b'R-Pi', 1, 0, len(atoms), 12 + len(body)) + body
+
+def still(t):
+    """ motion of a board lying flat: (accel g, gyro dps, mag gauss) """
+    return (0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (0.3, 0.0, -0.4)
+
+class _Op:
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+
+    def __enter__(self):
+        self.prev = self.bus.label
+        self.bus.label = self.name
+        return self
+
+    def __exit__(self, *exc):
+        self.bus.label = self.prev
+
+class SimI2C:
+    def __init__(self, timing=None, motion=None, devices=None, advance=True):
+        """
+        timing: BusTiming, motion: motion(t) for the LSM9DS1 (see still)
+        devices: {address: Device} to replace or add models
+        advance: advance the virtual clock by the bus time of every transfer
+        """
+        self.timing = timing or BusTiming()
+        self.advance = advance
+        self.lsm = GyroAccelModel(motion)
+        self.magnet = MagnetModel(motion)
+        self.hts = HTS221Model()
+        self.lps = LPS25HModel()
+        self.atmel = AtmelModel()
+        self.eeprom = EEPROMModel()
+        self.devices = {0x6a: self.lsm, 0x1c: self.magnet, 0x5f: self.hts,
+                        0x5c: self.lps, 0x46: self.atmel, 0x50: self.eeprom}
+        if devices:
+            self.devices.update(devices)
+        self.label = None                   # operation name for the statistics, see op
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {}                     # (operation, device, 'r'/'w', register) -> [transfers, bytes, us]
+        self.transfers = 0
+        self.total_us = 0.0
+        self.last_us = 0.0
+
+    def op(self, name):
+        """ context manager: transfers inside are accounted under the operation name """
+        return _Op(self, name)
+
+    def _device(self, addr):
+        dev = self.devices.get(addr)
+        if dev is None or (isinstance(dev, EEPROMModel) and pyb._now < dev.busy):
+            raise OSError(errno.ENODEV, "no ack from address 0x%02x" % addr)
+        dev.sync(pyb._now)
+        return dev
+
+    def _account(self, dev, read, reg, memsize, n):
+        us = self.timing.transfer_us(read, memsize, n)
+        key = (self.label or '-', dev.name, 'r' if read else 'w', reg)
+        s = self.stats.get(key)
+        if s is None:
+            s = self.stats[key] = [0, 0, 0.0]
+        s[0] += 1
+        s[1] += n
+        s[2] += us
+        self.transfers += 1
+        self.total_us += us
+        self.last_us = us
+        if self.advance:
+            pyb.advance(us)
+
+    # machine.I2C
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        dev = self._device(addr)
+        mv = memoryview(buf).cast('B')
+        mv[:] = dev.read(memaddr, mv.nbytes)
+        self._account(dev, True, memaddr, addrsize // 8, mv.nbytes)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, memaddr, buf, addrsize)
+        return bytes(buf)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        dev = self._device(addr)
+        data = bytes(memoryview(buf).cast('B'))
+        dev.write(memaddr, data)
+        dev.sync(pyb._now)                  # a new ODR or mode starts now, not at the next access
+        self._account(dev, False, memaddr, addrsize // 8, len(data))
+
+    # pyb.I2C
+    def mem_read(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        if isinstance(data, int):
+            return self.readfrom_mem(addr, memaddr, data, addr_size)
+        self.readfrom_mem_into(addr, memaddr, data, addr_size)
+        return data
+
+    def mem_write(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        if isinstance(data, int):
+            data = bytes([data])
+        elif isinstance(data, str):
+            data = data.encode()
+        self.writeto_mem(addr, memaddr, data, addr_size)
+
+    def report(self):
+        """ bus time per operation and register, most expensive first """
+        lines = ['%-16s %-11s %s %6s %8s %8s %10s %8s' % ('operation', 'device', 'rw', 'reg',
+                                                          'count', 'bytes', 'us', 'us/call')]
+        for key, (count, n, us) in sorted(self.stats.items(), key=lambda kv: -kv[1][2]):
+            name, dev, rw, reg = key
+            lines.append('%-16s %-11s %s  0x%04x %8d %8d %10.0f %8.1f' % (name, dev, rw, reg, count, n, us, us / count))
+        lines.append('%d transfers, %.0f us bus time at %d Hz' % (self.transfers, self.total_us, self.timing.freq))
+        return '\n'.join(lines)
+
+if __name__ == '__main__':
+    sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sensehat import uSenseHAT
+    bus = SimI2C()
+    sense = uSenseHAT(bus)
+    bus.reset_stats()
+    with bus.op('measure env'):
+        sense.measure()
+        print('humidity %.2f %%rH, temperature %.2f C, pressure %.2f hPa' % (
+            sense.get_humidity(), sense.get_temperature(), sense.get_pressure()))
+    with bus.op('get_imu'):
+        print('imu', sense.get_imu())
+    pyb.delay(20)
+    with bus.op('read_fifo'):
+        print('fifo frames', sense.lsm.read_fifo())
+    with bus.op('matrix'):
+        sense.matrix.set_pixel(4, 4, (20, 20, 0), refresh=True)
+    print(bus.report())
@@ -4,85 +4,202 @@ Example usage:
 >>> from hts221 import HTS221
 >>> hts = HTS221(I2C(1))
 >>> hts.measure()
+>>> hts.poll()      # non blocking: True when the result is ready
+True
 >>> hts.get_humidity()
 62.07
 >>> hts.get_temperature()
 27.046
+>>> await hts.measure_async()     # in a uasyncio task: (temperature, humidity)
+(27.046, 62.07)
+>>> hts.set_mode(sample_rate=3, avg_t=16, avg_h=32)     # continuous at 12.5Hz
+>>> hts.read()      # one burst read: True if there was a new result
+True
 """
-import uctypes
 import time
+from micropython import const
+from regmap import RegMap, BF_POS, BF_LEN, SIGNED
+from fixedpoint import pack, fixed_to_float
+
+HTS_WHO_AM_I = const(0xf)
+
+LAYOUT = {
+    'AVGT':         0x10 | 3 << BF_POS | 3 << BF_LEN,   # AV_CONF
+    'AVGH':         0x10 | 0 << BF_POS | 3 << BF_LEN,
+    'PD':           0x20 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG1
+    'BDU':          0x20 | 2 << BF_POS | 1 << BF_LEN,
+    'ODR':          0x20 | 0 << BF_POS | 2 << BF_LEN,
+    'BOOT':         0x21 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG2
+    'HEATER':       0x21 | 1 << BF_POS | 1 << BF_LEN,
+    'ONE_SHOT':     0x21 | 0 << BF_POS | 1 << BF_LEN,
+    'DRDY_H_L':     0x22 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG3
+    'PP_OD':        0x22 | 6 << BF_POS | 1 << BF_LEN,
+    'DRDY_EN':      0x22 | 2 << BF_POS | 1 << BF_LEN,
+    'STATUS':       0x27 | 0 << BF_POS | 8 << BF_LEN,   # bit 1: H_DA, bit 0: T_DA
+    'H_OUT':        0x28 | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'T_OUT':        0x2a | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'H0_RH_X2':     0x30 | 0 << BF_POS | 8 << BF_LEN,   # calibration
+    'H1_RH_X2':     0x31 | 0 << BF_POS | 8 << BF_LEN,
+    'T0_DEGC_X8':   0x32 | 0 << BF_POS | 8 << BF_LEN,
+    'T1_DEGC_X8':   0x33 | 0 << BF_POS | 8 << BF_LEN,
+    'T0_MSB':       0x35 | 0 << BF_POS | 2 << BF_LEN,
+    'T1_MSB':       0x35 | 2 << BF_POS | 2 << BF_LEN,
+    'H0_T0_OUT':    0x36 | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'H1_T0_OUT':    0x3a | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'T0_OUT':       0x3c | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'T1_OUT':       0x3e | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+}
+BLOCKS = ((0x10, 1), (0x20, 3), (0x27, 5), (0x30, 16))
 
 class HTS221:    
-    HTS_WHO_AM_I = const(0xf) 
+    ODR = (0, 1, 7, 12.5)                   # Hz indexed by sample_rate, 0: one-shot
+    AVG_T = (2, 4, 8, 16, 32, 64, 128, 256) # internal averages (AV_CONF AVGT)
+    AVG_H = (4, 8, 16, 32, 64, 128, 256, 512)
+
     def __init__(self, i2c, addr=95, fixed=False):
         self.i2c = i2c
         self.addr = addr
         self.fixed = fixed
         if (self.i2c.readfrom_mem(addr, HTS_WHO_AM_I, 1) != b'\xbc'):
             raise OSError("No HTS221 device on address {} found".format(addr))
-        self.cal_buf = bytearray(16)
-        self.calib = uctypes.struct(uctypes.addressof(self.cal_buf), {
-                'h0_rh':(uctypes.UINT8 | 0), 
-                'h1_rh':(uctypes.UINT8 | 1), 
-                't0_deg':(uctypes.UINT8 | 2), 
-                't1_deg':(uctypes.UINT8 | 3), 
-                'res':(uctypes.UINT8 | 4),
-                't1t0msb':(uctypes.UINT8 | 5),
-                'h0_out':(uctypes.INT16 | 6),
-                'res1':(uctypes.INT16 | 8),
-                'h1_out':(uctypes.INT16 | 10),
-                't0_out':(uctypes.INT16 | 12),
-                't1_out':(uctypes.INT16 | 14)})
-        self.val_buf = bytearray(5)
-        self.raw_val = uctypes.struct(uctypes.addressof(self.val_buf), {
-                'status':(uctypes.UINT8 | 0), 
-                'h_out':(uctypes.INT16 | 1), 
-                't_out':(uctypes.INT16 | 3)})        
+        self.regs = regs = RegMap(i2c, addr, LAYOUT, BLOCKS)
+        regs.load()                         # control registers and calibration
         # enable sensor, one-shot
-        i2c.writeto_mem(addr, 0x20, b'\x84')
-        i2c.readfrom_mem_into(95, 0x30|0x80, self.cal_buf)
+        regs.update(PD=1, BDU=1, ODR=0)
         # add 2 bits from reg 0x35 -> 10bit unsigned values)
-        self.t0_deg = (self.calib.t0_deg | ((self.calib.t1t0msb & 0x3) << 8))
-        self.t1_deg = (self.calib.t1_deg | ((self.calib.t1t0msb & 0xc) << 6))
+        self.t0_deg = regs['T0_DEGC_X8'] | (regs['T0_MSB'] << 8)
+        self.t1_deg = regs['T1_DEGC_X8'] | (regs['T1_MSB'] << 8)
+        self.t0_out = regs['T0_OUT']
+        self.h0_rh = regs['H0_RH_X2']
+        self.h0_out = regs['H0_T0_OUT']
         # multiply with large base to keep it accurate for fixed point division
-        self.t_slope = (1000 * (self.t1_deg - self.t0_deg)) // (self.calib.t1_out - self.calib.t0_out)
-        self.h_slope = (10000 * (self.calib.h1_rh - self.calib.h0_rh)) // (self.calib.h1_out - self.calib.h0_out)
+        self.t_slope = (1000 * (self.t1_deg - self.t0_deg)) // (regs['T1_OUT'] - self.t0_out)
+        self.h_slope = (10000 * (regs['H1_RH_X2'] - self.h0_rh)) // (regs['H1_T0_OUT'] - self.h0_out)
+        self.measure_done = False
+        self._started = time.ticks_ms()
+        # expected one-shot conversion time in ms, the result is polled after it
+        self.conversion_ms = self._conversion_ms()
+        self.sample_rate = 0
         
+    def set_mode(self, sample_rate=0, avg_t=None, avg_h=None):
+        """
+        sample_rate: 0-3 (one-shot, 1Hz, 7Hz, 12.5Hz continuous conversion)
+        avg_t, avg_h: number of internal averages for temperature and humidity
+        (values of AVG_T, AVG_H), None leaves the setting unchanged
+        In continuous mode measure() only reads the latest result, see read().
+        """
+        assert 0 <= sample_rate < 4, "invalid sample rate: %d" % sample_rate
+        fields = {'ODR': sample_rate}
+        if avg_t is not None:
+            fields['AVGT'] = self.AVG_T.index(avg_t)
+        if avg_h is not None:
+            fields['AVGH'] = self.AVG_H.index(avg_h)
+        self.regs.update(**fields)
+        self.sample_rate = sample_rate
+        self.conversion_ms = self._conversion_ms()
+        self._started = time.ticks_ms()
+
+    def _conversion_ms(self):
+        # the conversion time grows with the internal samples: 5ms for the default
+        # AVGT 16, AVGH 32, scaled by the sum of the selected averages
+        n = self.AVG_T[self.regs['AVGT']] + self.AVG_H[self.regs['AVGH']]
+        return (5 * n + 47) // 48
+
+    def read(self):
+        """
+        continuous mode: reads status and outputs in one burst transfer, converts the
+        result if both data ready bits are set and returns True, else returns False
+        (the previous result stays)
+        """
+        regs = self.regs
+        regs.load(0x27)
+        if (regs['STATUS'] & 0x3) != 0x3:
+            return False
+        self._convert()
+        return True
+
     def measure(self):
+        if self.sample_rate:
+            # continuous conversion: no trigger, the latest result is read
+            self.read()
+            return
         # enable one-shot measurement
-        self.i2c.writeto_mem(self.addr, 0x21, b'\x01')
+        self.regs.strobe('ONE_SHOT')
         self.measure_done = False
+        self._started = time.ticks_ms()
+
+    def _timeout(self):
+        # status polls of 2ms: 0.2sec, plus a sample period in continuous mode
+        if self.sample_rate:
+            return 100 + int(500 / self.ODR[self.sample_rate])
+        return 100
+
+    def poll(self):
+        """
+        returns True if the measurement is done (the results are then converted), else
+        False. Doesn't wait: one status read while the conversion is running.
+        """
+        if self.measure_done:
+            return True
+        # status alone first: reading the outputs clears their data ready bits
+        if (self.regs.read('STATUS') & 0x3) != 0x3:
+            return False
+        self.regs.load(0x27)
+        self._convert()
+        return True
 
     def measure_end(self):
-        # blocking, timeout after 0.2sec
+        # blocking, waits for the conversion time, timeout after 0.2sec (one-shot)
+        wait = self.conversion_ms - time.ticks_diff(time.ticks_ms(), self._started)
+        if wait > 0:
+            time.sleep_ms(wait)
         delay_cntr = 0
-        while (delay_cntr < 20):
-            self.i2c.readfrom_mem_into(self.addr, 0x27|0x80, self.val_buf)
-            if (self.raw_val.status & 0x3):
-                break
-            time.sleep_ms(10)
+        while not self.poll():
+            if delay_cntr >= self._timeout():
+                raise OSError("Timeout Sensor")
+            time.sleep_ms(2)
             delay_cntr += 1
-        else:
-            raise OSError("Timeout Sensor")
-        self.temperature = (1000 * self.t0_deg + self.t_slope * (self.raw_val.t_out - self.calib.t0_out)) // 8
-        self.humidity = (10000 * self.calib.h0_rh + self.h_slope * (self.raw_val.h_out - self.calib.h0_out)) // 200
+
+    async def wait_async(self):
+        """ awaits the end of the measurement started with measure() """
+        try:
+            from uasyncio import sleep_ms
+        except ImportError:                 # CPython asyncio has no sleep_ms
+            import asyncio
+            sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+        if self.measure_done:
+            return
+        wait = self.conversion_ms - time.ticks_diff(time.ticks_ms(), self._started)
+        await sleep_ms(wait if wait > 0 else 0)
+        delay_cntr = 0
+        while not self.poll():
+            if delay_cntr >= self._timeout():
+                raise OSError("Timeout Sensor")
+            await sleep_ms(2)
+            delay_cntr += 1
+
+    async def measure_async(self):
+        """ one-shot measurement without blocking, returns (temperature, humidity) """
+        self.measure()
+        await self.wait_async()
+        return self.temperature, self.humidity
+
+    def _convert(self):
+        self.temperature = (1000 * self.t0_deg + self.t_slope * (self.regs['T_OUT'] - self.t0_out)) // 8
+        self.humidity = (10000 * self.h0_rh + self.h_slope * (self.regs['H_OUT'] - self.h0_out)) // 200
         if self.fixed:
-            self.temperature = (self.temperature << 8 ) | (-3 + 128)
-            self.humidity = (self.humidity << 8) | (-2 + 128)
+            self.temperature = pack(self.temperature, -3)
+            self.humidity = pack(self.humidity, -2)
         else:
             self.temperature = self.temperature / 1000.
             self.humidity = self.humidity / 100.
         self.measure_done = True
 
     def set_heater(self, switch_on):
-        if switch_on: 
-            self.i2c.writeto_mem(self.addr, 0x21, b'\x02')
-        else:
-            self.i2c.writeto_mem(self.addr, 0x21, b'\x00')
+        self.regs.update(HEATER=1 if switch_on else 0)
 
     def fixed_to_float(self,fx):
-        # may be moved to a generic location
-        return (fx >> 8) * 10**((fx & 0xff) - 128)
+        return fixed_to_float(fx)
 
     def get_humidity(self):
         if not self.measure_done:
@@ -0,0 +1,140 @@
+"""
+I2C transaction tracer for profiling the bus time of the SenseHAT drivers
+
+I2CTrace wraps an I2C object and is passed to the drivers instead of it.
+Every memory read/write is counted per device address, direction and
+register: transfers, bytes moved and elapsed us (time.ticks_us around the
+call, so it includes the driver side overhead of the transfer). The table
+is preallocated with a fixed number of entries and updating it doesn't
+allocate, so tracing can stay on in the main loop. Transfers that don't fit
+into the table are counted in the last entry (address 0xff).
+
+The counters saturate at LIMIT (2**30 - 1, the largest small int): the us
+of an entry after about 17 minutes of bus time on its register, the bytes
+and transfers much later. A saturated value is a lower bound, reset()
+starts over.
+
+dump prints the table in a compact line format that host/i2creport.py
+reads back from a captured console log or file.
+
+Example usage:
+>>> from sensehat import uSenseHAT
+>>> sense = uSenseHAT(I2C(1), trace=True)      # or I2CTrace(i2c) for a single driver
+>>> sense.matrix.write("Hi")
+>>> sense.trace.dump()
+#i2ctrace addr rw reg count bytes us
+0x46 w 0x00 16 3072 81024
+>>> sense.trace.total()           # (transfers, bytes, us)
+(16, 3072, 81024)
+>>> sense.trace.reset()
+"""
+import array
+import time
+from micropython import const
+
+LIMIT = const(0x3fffffff)                  # larger values would allocate a long int
+
+def _nbytes(buf):
+    if isinstance(buf, (bytes, bytearray, str)):
+        return len(buf)
+    if not isinstance(buf, memoryview):
+        buf = memoryview(buf)               # arrays have no itemsize on MicroPython
+    return len(buf) * buf.itemsize
+
+class I2CTrace:
+    OTHER = 0xff << 17                      # key of the overflow entry
+
+    def __init__(self, i2c, entries=48):
+        self.i2c = i2c
+        self.size = entries
+        self.keys = array.array('i', [0] * entries)      # addr << 17 | write << 16 | register
+        self.count = array.array('i', [0] * entries)
+        self.nbytes = array.array('i', [0] * entries)
+        self.us = array.array('i', [0] * entries)
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.used = 0
+        for i in range(self.size):
+            self.count[i] = 0
+            self.nbytes[i] = 0
+            self.us[i] = 0
+
+    def _record(self, addr, write, reg, n, t0):
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        if not self.enabled:
+            return
+        key = addr << 17 | write << 16 | reg
+        keys = self.keys
+        i = 0
+        used = self.used
+        while i < used and keys[i] != key:
+            i += 1
+        if i == used:
+            if used < self.size - 1:
+                self.used = used + 1
+            else:                           # table full: last entry collects the rest
+                i = self.size - 1
+                key = self.OTHER
+                if used < self.size:
+                    self.used = self.size
+            keys[i] = key
+        # saturating: the comparisons keep every intermediate value a small int
+        c = self.count[i]
+        if c < LIMIT:
+            self.count[i] = c + 1
+        c = self.nbytes[i]
+        self.nbytes[i] = c + n if c < LIMIT - n else LIMIT
+        c = self.us[i]
+        self.us[i] = c + dt if c < LIMIT - dt else LIMIT
+
+    # machine.I2C (explicit signatures: *args, **kw would allocate on every call)
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        t0 = time.ticks_us()
+        self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        self._record(addr, 0, memaddr, _nbytes(buf), t0)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        t0 = time.ticks_us()
+        data = self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        self._record(addr, 0, memaddr, nbytes, t0)
+        return data
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        t0 = time.ticks_us()
+        self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        self._record(addr, 1, memaddr, _nbytes(buf), t0)
+
+    # pyb.I2C
+    def mem_read(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        t0 = time.ticks_us()
+        r = self.i2c.mem_read(data, addr, memaddr, timeout=timeout, addr_size=addr_size)
+        self._record(addr, 0, memaddr, data if isinstance(data, int) else _nbytes(data), t0)
+        return r
+
+    def mem_write(self, data, addr, memaddr, timeout=5000, addr_size=8):
+        t0 = time.ticks_us()
+        self.i2c.mem_write(data, addr, memaddr, timeout=timeout, addr_size=addr_size)
+        self._record(addr, 1, memaddr, 1 if isinstance(data, int) else _nbytes(data), t0)
+
+    def __getattr__(self, name):
+        # scan, readfrom, writeto, ... are passed through untraced
+        return getattr(self.i2c, name)
+
+    def total(self):
+        """ (transfers, bytes, us) over all entries """
+        c = b = u = 0
+        for i in range(self.used):
+            c += self.count[i]
+            b += self.nbytes[i]
+            u += self.us[i]
+        return c, b, u
+
+    def dump(self, file=None):
+        """ prints the table (to file if given), one line per address, direction and register """
+        print('#i2ctrace addr rw reg count bytes us', file=file)
+        for i in range(self.used):
+            k = self.keys[i]
+            print('0x%02x %s 0x%02x %d %d %d' % (k >> 17, 'w' if k & 0x10000 else 'r', k & 0xffff,
+                                                self.count[i], self.nbytes[i], self.us[i]), file=file)
@@ -3,61 +3,286 @@ LPS25 - STMicro I2C pressure/temperature sensor driver for MicroPython
 >>> from lps25 import LPS25
 >>> lps = LPS25(I2C(1))
 >>> lps.measure()
+>>> lps.poll()      # non blocking: True when the result is ready
+True
 >>> lps.get_temperature()
 21.71667
+>>> await lps.measure_async()     # in a uasyncio task: (pressure, temperature)
+(970.86, 21.71667)
+>>> lps.set_mode(sample_rate=4, avg_t=16, avg_p=32)     # continuous at 25Hz
+>>> lps.read()      # one burst read: True if there was a new result
+True
+>>> lps.set_fifo(LPS25.FIFO_MEAN, 32)    # hardware running mean of 32 samples in the outputs
+>>> lps.read(); lps.get_pressure()
+970.8611
+>>> lps.set_fifo(LPS25.FIFO_STREAM)      # collect samples, drain them in bursts
+>>> n = lps.read_fifo()                  # raw samples in fifo_press[:n], fifo_temp[:n]
+>>> lps.fifo_hpa(n)[:n]
+array('f', [970.861, 970.8589, 970.8635])
 """
-import uctypes
+import array
 import time
+from micropython import const
+from regmap import RegMap, BF_POS, BF_LEN, SIGNED
+from fixedpoint import pack, fixed_to_float
+
+LPS_WHO_AM_I = const(0xf)
+
+LAYOUT = {
+    'AVGT':         0x10 | 2 << BF_POS | 2 << BF_LEN,   # RES_CONF
+    'AVGP':         0x10 | 0 << BF_POS | 2 << BF_LEN,
+    'PD':           0x20 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG1
+    'ODR':          0x20 | 4 << BF_POS | 3 << BF_LEN,
+    'DIFF_EN':      0x20 | 3 << BF_POS | 1 << BF_LEN,
+    'BDU':          0x20 | 2 << BF_POS | 1 << BF_LEN,
+    'BOOT':         0x21 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG2
+    'FIFO_EN':      0x21 | 6 << BF_POS | 1 << BF_LEN,
+    'WTM_EN':       0x21 | 5 << BF_POS | 1 << BF_LEN,
+    'FIFO_MEAN_DEC': 0x21 | 4 << BF_POS | 1 << BF_LEN,
+    'SWRESET':      0x21 | 2 << BF_POS | 1 << BF_LEN,
+    'ONE_SHOT':     0x21 | 0 << BF_POS | 1 << BF_LEN,
+    'STATUS':       0x27 | 0 << BF_POS | 8 << BF_LEN,   # bit 1: P_DA, bit 0: T_DA
+    'PRESS_OUT':    0x28 | 0 << BF_POS | 24 << BF_LEN | SIGNED,
+    'TEMP_OUT':     0x2b | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'F_MODE':       0x2e | 5 << BF_POS | 3 << BF_LEN,   # FIFO_CTRL
+    'WTM_POINT':    0x2e | 0 << BF_POS | 5 << BF_LEN,
+    'FIFO_STATUS':  0x2f | 0 << BF_POS | 8 << BF_LEN,   # bit 7: WTM, 6: FULL, 5: EMPTY, 4-0: level
+}
+BLOCKS = ((0x10, 1), (0x20, 2), (0x27, 6), (0x2e, 1))
+LPS_PRESS_OUT = const(0x28)
+FIFO_DEPTH = const(32)
 
 class LPS25:    
-    WHO_AM_I = const(0xf)
+    FIFO_BYPASS = const(0)      # fifo modes (FIFO_CTRL F_MODE)
+    FIFO_MODE = const(1)        # stops collecting when full
+    FIFO_STREAM = const(2)      # overwrites the oldest samples when full
+    FIFO_STREAM_TO_FIFO = const(3)
+    FIFO_BYPASS_TO_STREAM = const(4)
+    FIFO_MEAN = const(6)        # running mean in the output registers
+    FIFO_BYPASS_TO_FIFO = const(7)
+    MEAN_SAMPLES = (2, 4, 8, 16, 32)
+
+    ODR = (0, 1, 7, 12.5, 25)               # Hz indexed by sample_rate, 0: one-shot
+    AVG_T = (8, 16, 32, 64)                 # internal averages (RES_CONF AVGT)
+    AVG_P = (8, 32, 128, 512)
 
     def __init__(self, i2c, addr=92, fixed=False):
         self.i2c = i2c
         self.addr = addr
         self.fixed = fixed
-        if (self.i2c.readfrom_mem(addr, WHO_AM_I, 1) != b'\xbd'):
+        if (self.i2c.readfrom_mem(addr, LPS_WHO_AM_I, 1) != b'\xbd'):
             raise OSError("No LPS25 device on address {} found".format(addr))
-        
-        self.val_buf = bytearray(5)
-        self.raw_val = uctypes.struct(uctypes.addressof(self.val_buf), { 
-                'p_low':(uctypes.UINT8 | 0), 
-                'p_out':(uctypes.UINT16 | 1), 
-                't_out':(uctypes.INT16 | 3)})
-
-        i2c.writeto_mem(addr, 0x20, b'\x00')
-        i2c.writeto_mem(addr, 0x20, b'\x84')
+        self.regs = regs = RegMap(i2c, addr, LAYOUT, BLOCKS)
+        regs.load()
+        # power down before changing the configuration, then enable with BDU, one-shot
+        regs.update(PD=0)
+        regs.update(PD=1, ODR=0, BDU=1)
+        self.measure_done = False
+        self._started = time.ticks_ms()
+        # expected one-shot conversion time in ms, the result is polled after it
+        self.conversion_ms = self._conversion_ms()
+        self.sample_rate = 0
+        self.fifo_mode = self.FIFO_BYPASS
+        self.fifo_status = bytearray(1)
+        self.fifo_buf = bytearray(5 * FIFO_DEPTH)           # press_xl, press_l, press_h, temp_l, temp_h
+        self.fifo_press = array.array('i', [0] * FIFO_DEPTH)    # raw, hPa * 4096
+        self.fifo_temp = array.array('h', [0] * FIFO_DEPTH)     # raw, (degC - 42.5) * 480
+        self.fifo_scaled = array.array('f', [0] * FIFO_DEPTH)
     
+    def set_mode(self, sample_rate=0, avg_t=None, avg_p=None):
+        """
+        sample_rate: 0-4 (one-shot, 1Hz, 7Hz, 12.5Hz, 25Hz continuous conversion)
+        avg_t, avg_p: number of internal averages for temperature and pressure
+        (values of AVG_T, AVG_P), None leaves the setting unchanged
+        In continuous mode measure() only reads the latest result, see read().
+        """
+        assert 0 <= sample_rate < 5, "invalid sample rate: %d" % sample_rate
+        regs = self.regs
+        # configuration is changed in power down
+        regs.update(PD=0)
+        if avg_t is not None:
+            regs['AVGT'] = self.AVG_T.index(avg_t)
+        if avg_p is not None:
+            regs['AVGP'] = self.AVG_P.index(avg_p)
+        regs.update(PD=1, ODR=sample_rate)
+        self.sample_rate = sample_rate
+        self.conversion_ms = self._conversion_ms()
+        self._started = time.ticks_ms()
+
+    def _conversion_ms(self):
+        # the conversion time grows with the internal samples: 40ms for the default
+        # AVGT 16, AVGP 32, scaled by the sum of the selected averages
+        n = self.AVG_T[self.regs['AVGT']] + self.AVG_P[self.regs['AVGP']]
+        return (40 * n + 47) // 48
+
+    def set_fifo(self, mode=FIFO_STREAM, samples=0, decimate=False):
+        """
+        Configures the fifo (needs continuous mode, see set_mode; set_fifo selects 1Hz if
+        the sensor is in one-shot mode). The fifo is emptied (passes bypass mode).
+        FIFO_MEAN: the output registers hold the running mean of samples (2, 4, 8, 16,
+        32) values, read() reads it. decimate: the mean is updated at 1Hz only.
+        FIFO_MODE, FIFO_STREAM, ...: samples collect in the 32 slot fifo, read_fifo drains
+        it. samples (1-31): watermark level (bit 7 of FIFO_STATUS), 0: none.
+        FIFO_BYPASS: fifo off.
+        """
+        assert mode in (0, 1, 2, 3, 4, 6, 7), "invalid fifo mode: %d" % mode
+        if mode == self.FIFO_MEAN:
+            assert samples in self.MEAN_SAMPLES, "invalid number of mean samples: %d" % samples
+            wtm = samples - 1
+        else:
+            assert 0 <= samples < FIFO_DEPTH, "invalid fifo watermark: %d" % samples
+            wtm = samples
+        if mode and not self.sample_rate:
+            self.set_mode(1)
+        regs = self.regs
+        regs.update(F_MODE=self.FIFO_BYPASS)
+        regs.update(FIFO_EN=1 if mode else 0, WTM_EN=1 if wtm and mode != self.FIFO_MEAN else 0,
+                    FIFO_MEAN_DEC=1 if decimate else 0)
+        regs.update(F_MODE=mode, WTM_POINT=wtm)
+        self.fifo_mode = mode
+
+    def fifo_level(self):
+        """ reads FIFO_STATUS, returns (samples in fifo, watermark reached, full) """
+        self.i2c.readfrom_mem_into(self.addr, 0x2f, self.fifo_status)
+        v = self.fifo_status[0]
+        n = FIFO_DEPTH if v & 0x40 else v & 0x1f
+        if v & 0x20:
+            n = 0
+        return n, bool(v & 0x80), bool(v & 0x40)
+
+    def read_fifo(self):
+        """
+        Drains the fifo with one burst read into fifo_buf, decodes the 24 bit pressure
+        and 16 bit temperature samples into fifo_press[:n] and fifo_temp[:n] (raw values,
+        oldest first) and returns n. Assumes that the register address rolls over from
+        TEMP_OUT_H (0x2c) to PRESS_OUT_XL (0x28) while the fifo is read, so every 5 bytes
+        are the next sample.
+        """
+        n = self.fifo_level()[0]
+        if not n:
+            return 0
+        buf = self.fifo_buf
+        mv = memoryview(buf)
+        self.i2c.readfrom_mem_into(self.addr, LPS_PRESS_OUT | 0x80, mv[:5 * n])
+        press = self.fifo_press
+        temp = self.fifo_temp
+        k = 0
+        for i in range(n):
+            p = buf[k] | buf[k + 1] << 8 | buf[k + 2] << 16
+            if p & 0x800000:
+                p -= 0x1000000
+            press[i] = p
+            t = buf[k + 3] | buf[k + 4] << 8
+            if t & 0x8000:
+                t -= 0x10000
+            temp[i] = t
+            k += 5
+        return n
+
+    def fifo_hpa(self, n, out=None):
+        """ converts fifo_press[:n] to hPa into out (array('f')) or fifo_scaled, returns it """
+        if out is None:
+            out = self.fifo_scaled
+        press = self.fifo_press
+        for i in range(n):
+            out[i] = press[i] / 4096
+        return out
+
+    def read(self):
+        """
+        continuous mode: reads status and outputs in one burst transfer, converts the
+        result if both data ready bits are set and returns True, else returns False
+        (the previous result stays)
+        """
+        regs = self.regs
+        regs.load(0x27)
+        if (regs['STATUS'] & 0x3) != 0x3:
+            return False
+        self._convert()
+        return True
+
     def measure(self):
+        if self.sample_rate:
+            # continuous conversion: no trigger, the latest result is read
+            self.read()
+            return
         # init one-shot measurement
-        self.i2c.writeto_mem(self.addr, 0x21, b'\x01')
+        self.regs.strobe('ONE_SHOT')
         self.measure_done = False
+        self._started = time.ticks_ms()
+
+    def _timeout(self):
+        # status polls of 2ms: 0.1sec, plus a sample period in continuous mode
+        if self.sample_rate:
+            return 50 + int(500 / self.ODR[self.sample_rate])
+        return 50
+
+    def poll(self):
+        """
+        returns True if the measurement is done (the results are then converted), else
+        False. Doesn't wait: one register read while the conversion is running.
+        """
+        if self.measure_done:
+            return True
+        if self.sample_rate:
+            if (self.regs.read('STATUS') & 0x3) != 0x3:
+                return False
+        elif self.regs.read('ONE_SHOT'):
+            return False
+        self.regs.load(0x28)
+        self._convert()
+        return True
 
     def measure_end(self):
+        # blocking, waits for the conversion time, timeout after 0.1sec (one-shot)
+        wait = self.conversion_ms - time.ticks_diff(time.ticks_ms(), self._started)
+        if wait > 0:
+            time.sleep_ms(wait)
         delay_cntr = 0
-        while (delay_cntr < 10):
-            if not (int.from_bytes(self.i2c.readfrom_mem(self.addr, 0x21, 1),'big') & 0x1):
-                break
-            time.sleep_ms(10)
+        while not self.poll():
+            if delay_cntr >= self._timeout():
+                raise OSError("Timeout Sensor")
+            time.sleep_ms(2)
             delay_cntr += 1
-        else:
-            raise OSError("Timeout Sensor")
-        self.i2c.readfrom_mem_into(self.addr, 0x28|0x80, self.val_buf)
-        # p_total is a signed 24 bit value...
-        p_total = 256 * self.raw_val.p_out + self.raw_val.p_low
-        if p_total & 0x800000: p_total -= 0xffffff
+
+    async def wait_async(self):
+        """ awaits the end of the measurement started with measure() """
+        try:
+            from uasyncio import sleep_ms
+        except ImportError:                 # CPython asyncio has no sleep_ms
+            import asyncio
+            sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+        if self.measure_done:
+            return
+        wait = self.conversion_ms - time.ticks_diff(time.ticks_ms(), self._started)
+        await sleep_ms(wait if wait > 0 else 0)
+        delay_cntr = 0
+        while not self.poll():
+            if delay_cntr >= self._timeout():
+                raise OSError("Timeout Sensor")
+            await sleep_ms(2)
+            delay_cntr += 1
+
+    async def measure_async(self):
+        """ one-shot measurement without blocking, returns (pressure, temperature) """
+        self.measure()
+        await self.wait_async()
+        return self.pressure, self.temperature
+
+    def _convert(self):
+        # p_total is a signed 24 bit value
+        p_total = self.regs['PRESS_OUT']
+        t_out = self.regs['TEMP_OUT']
         if self.fixed:
-            self.temperature = ((((20400 + self.raw_val.t_out) << 8) // 48 ) & ~0xff) | (-1 + 128)
-            self.pressure = (((100 * p_total) >> 4) & ~0xff) | (-2 + 128)
+            self.temperature = pack((20400 + t_out) // 48, -1)
+            self.pressure = pack((100 * p_total) >> 12, -2)
         else:
-            self.temperature = 42.5 + self.raw_val.t_out / 480
+            self.temperature = 42.5 + t_out / 480
             self.pressure = p_total / 4096.
-
         self.measure_done = True
 
     def fixed_to_float(self,fx):
-        # may be moved to a generic location
-        return (fx >> 8) * 10**((fx & 0xff) - 128)
+        return fixed_to_float(fx)
 
     def get_pressure(self):
         if not self.measure_done:
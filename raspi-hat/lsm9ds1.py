@@ -4,8 +4,16 @@ LSM9DS1 - 9DOF inertial sensor of STMicro driver for MicroPython
 The sensor contains an accelerometer / gyroscope / magnetometer
 The magnetometer is using a different I2C address!
 
-Uses the internal FIFO to store up to 16 gyro/accel data, use
-the iter_accel_gyro generator to access it.
+Uses the internal FIFO to store up to 32 gyro/accel data, use
+the iter_accel_gyro generator to access it. read_fifo drains the FIFO with
+one status read and a single burst read of all frames (with the FIFO enabled
+the register address rolls over from the last gyro to the first accel
+register and from the last accel back to the first gyro register, so every
+12 bytes are the next frame) into the raw int16 buffer fifo_raw; scale_fifo
+converts it to floats in one pass.
+Every drained frame gets a timestamp (time.ticks_us) reconstructed from the
+drain time and the fifo level, the sensor's clock drift is estimated on the
+way (see fifoclock.py).
 
 Example usage:
 >>> from lsm9ds1 import LSM9DS1
@@ -17,40 +25,153 @@ Example usage:
 >>> lsm.read_magnet()     # (x,y,z) in gauss 
 (0.5358887, -0.001586914, -0.1228027)
 >>> for g,a in lsm.iter_accel_gyro(): print(g,a)    # using fifo
+>>> lsm.read_magnet_cached(), lsm.mag_fresh   # bus read only if there is a new sample
+((0.5358887, -0.001586914, -0.1228027), False)
+>>> lsm.mag_stats()       # calls, data reads, status reads, data reads saved
+(952, 80, 95, 872)
+>>> fuse.update_batch(lsm.iter_accel_gyro(), lsm.odr)   # fusion with fifo timing
+>>> g = array.array('f', [0,0,0])
+>>> lsm.read_gyro_into(g)                 # same as read_gyro, but without allocation
+>>> raw = array.array('h', [0,0,0])
+>>> lsm.read_accel_into(raw, raw=True)    # adc counts
+>>> buf = array.array('h', bytes(2 * 6 * 32))
+>>> lsm.start_irq('X3', threshold=16)     # INT1 -> pyboard pin: FIFO drained by interrupt
+>>> n = lsm.ring.get_into(buf)            # non blocking, frames of gx,gy,gz,ax,ay,az raw counts
+>>> lsm.ring_ts.get_into(tbuf, n)         # their timestamps (array('i'))
+>>> len(lsm.ring), lsm.ring.dropped, lsm.fifo_overruns
+>>> lsm.set_fifo_mode(LSM9DS1.FIFO_MODE, threshold=24)   # stop when full instead of overwriting
+>>> lsm.fifo_stats()      # (samples read, drains, overruns, average fifo depth per drain)
+(1200, 50, 0, 24.0)
+>>> n = lsm.read_fifo()   # number of frames in lsm.fifo_raw: gx,gy,gz,ax,ay,az raw counts
+>>> lsm.scale_fifo(n)     # array('f') of n frames in deg/sec and g
+>>> lsm.clock.ts[:n]      # ticks_us of the n frames
+>>> for g,a,t in lsm.iter_accel_gyro(timestamps=True): print(t,g,a)
+>>> fuse.update_batch(lsm.iter_accel_gyro(), lsm.clock.odr)   # measured instead of nominal rate
+>>> lsm = LSM9DS1(I2C(1), fixed=True)   # integer samples, no floats (see fixedpoint.py)
+>>> lsm.read_gyro()
+(-103382, -102614, 125)
 """
 import array
+import time
+import micropython
+from micropython import const
+from ringbuf import RingBuffer
+from fifoclock import FifoClock
+from regmap import RegMap, BF_POS, BF_LEN, SIGNED
+from fixedpoint import scaler, scale, unscale
+
+WHO_AM_I = const(0xf)
+OUT_G = const(0x18)
+OUT_XL = const(0x28)
+FIFO_SRC = const(0x2f)
+STATUS_REG_M = const(0x27)
+OUT_M = const(0x28)
+FIFO_DEPTH = const(32)  # gyro/accel frames
+
+# control registers of the accelerometer/gyro
+LAYOUT_GYRO_ACCEL = {
+    'INT1_CTRL':    0x0c | 0 << BF_POS | 8 << BF_LEN,
+    'INT2_CTRL':    0x0d | 0 << BF_POS | 8 << BF_LEN,
+    'ODR_G':        0x10 | 5 << BF_POS | 3 << BF_LEN,   # CTRL_REG1_G
+    'FS_G':         0x10 | 3 << BF_POS | 2 << BF_LEN,
+    'BW_G':         0x10 | 0 << BF_POS | 2 << BF_LEN,
+    'CTRL_REG2_G':  0x11 | 0 << BF_POS | 8 << BF_LEN,
+    'CTRL_REG3_G':  0x12 | 0 << BF_POS | 8 << BF_LEN,
+    'ORIENT_CFG_G': 0x13 | 0 << BF_POS | 8 << BF_LEN,
+    'EN_G':         0x1e | 3 << BF_POS | 3 << BF_LEN,   # CTRL_REG4: Zen/Yen/Xen_G
+    'LIR_XL1':      0x1e | 1 << BF_POS | 1 << BF_LEN,
+    'D4_XL1':       0x1e | 0 << BF_POS | 1 << BF_LEN,
+    'DEC':          0x1f | 6 << BF_POS | 2 << BF_LEN,   # CTRL_REG5_XL
+    'EN_XL':        0x1f | 3 << BF_POS | 3 << BF_LEN,
+    'ODR_XL':       0x20 | 5 << BF_POS | 3 << BF_LEN,   # CTRL_REG6_XL
+    'FS_XL':        0x20 | 3 << BF_POS | 2 << BF_LEN,
+    'BW_SCAL_ODR':  0x20 | 2 << BF_POS | 1 << BF_LEN,
+    'BW_XL':        0x20 | 0 << BF_POS | 2 << BF_LEN,
+    'CTRL_REG7_XL': 0x21 | 0 << BF_POS | 8 << BF_LEN,
+    'BDU':          0x22 | 6 << BF_POS | 1 << BF_LEN,   # CTRL_REG8
+    'IF_ADD_INC':   0x22 | 2 << BF_POS | 1 << BF_LEN,
+    'SW_RESET':     0x22 | 0 << BF_POS | 1 << BF_LEN,
+    'SLEEP_G':      0x23 | 6 << BF_POS | 1 << BF_LEN,   # CTRL_REG9
+    'FIFO_TEMP_EN': 0x23 | 4 << BF_POS | 1 << BF_LEN,
+    'I2C_DISABLE':  0x23 | 2 << BF_POS | 1 << BF_LEN,
+    'FIFO_EN':      0x23 | 1 << BF_POS | 1 << BF_LEN,
+    'STOP_ON_FTH':  0x23 | 0 << BF_POS | 1 << BF_LEN,
+    'FMODE':        0x2e | 5 << BF_POS | 3 << BF_LEN,   # FIFO_CTRL
+    'FTH':          0x2e | 0 << BF_POS | 5 << BF_LEN,
+}
+BLOCKS_GYRO_ACCEL = ((0x0c, 2), (0x10, 4), (0x1e, 6), (0x2e, 1))
+
+# control registers of the magnetometer
+LAYOUT_MAGNET = {
+    'OFFSET_X_M':   0x05 | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'OFFSET_Y_M':   0x07 | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'OFFSET_Z_M':   0x09 | 0 << BF_POS | 16 << BF_LEN | SIGNED,
+    'TEMP_COMP':    0x20 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG1_M
+    'OM':           0x20 | 5 << BF_POS | 2 << BF_LEN,
+    'DO':           0x20 | 2 << BF_POS | 3 << BF_LEN,
+    'FAST_ODR':     0x20 | 1 << BF_POS | 1 << BF_LEN,
+    'ST':           0x20 | 0 << BF_POS | 1 << BF_LEN,
+    'FS_M':         0x21 | 5 << BF_POS | 2 << BF_LEN,   # CTRL_REG2_M
+    'REBOOT':       0x21 | 3 << BF_POS | 1 << BF_LEN,
+    'SOFT_RST':     0x21 | 2 << BF_POS | 1 << BF_LEN,
+    'LP':           0x22 | 5 << BF_POS | 1 << BF_LEN,   # CTRL_REG3_M
+    'MD':           0x22 | 0 << BF_POS | 2 << BF_LEN,
+    'OMZ':          0x23 | 2 << BF_POS | 2 << BF_LEN,   # CTRL_REG4_M
+    'BLE_M':        0x23 | 1 << BF_POS | 1 << BF_LEN,
+    'FAST_READ':    0x24 | 7 << BF_POS | 1 << BF_LEN,   # CTRL_REG5_M
+    'BDU_M':        0x24 | 6 << BF_POS | 1 << BF_LEN,
+}
+BLOCKS_MAGNET = ((0x05, 6), (0x20, 5))
 
 class LSM9DS1:
-    WHO_AM_I = const(0xf)
-    CTRL_REG1_G = const(0x10)
-    INT_GEN_SRC_G = const(0x14)
-    OUT_TEMP = const(0x15)  
-    OUT_G = const(0x18) 
-    CTRL_REG4_G = const(0x1e)
-    
-    STATUS_REG = const(0x27)
-    OUT_XL = const(0x28)
-    FIFO_CTRL_REG = const(0x2e)
-    FIFO_SRC = const(0x2f)
-    
-    OFFSET_REG_X_M = const(0x05)
-    CTRL_REG1_M = const(0x20)
-    OUT_M = const(0x28)
+    FIFO_BYPASS = const(0)      # fifo modes (FIFO_CTRL FMODE)
+    FIFO_MODE = const(1)        # stops collecting when full
+    FIFO_CONTINUOUS_TO_FIFO = const(3)
+    FIFO_BYPASS_TO_CONTINUOUS = const(4)
+    FIFO_CONTINUOUS = const(6)  # overwrites the oldest frames when full
     
+    ODR_GYRO_ACCEL = (0, 14.9, 59.5, 119, 238, 476, 952)  # Hz, indexed by sample_rate
+    ODR_MAGNET = (0.625, 1.25, 2.5, 5, 10, 20, 40, 80)  # Hz, indexed by sample_rate
     SCALE_GYRO = [(245,0),(500,1),(2000,3)]
     SCALE_ACCEL = [(2,0),(4,2),(8,3),(16,1)]
     
-    def __init__(self, i2c, address_gyro=106, address_magnet=28):
+    def __init__(self, i2c, address_gyro=106, address_magnet=28, fixed=False):
+        """ fixed: values are returned as fixed point samples (see fixedpoint.py) instead of floats """
         self.i2c = i2c
+        self.fixed = fixed
         self.address_gyro = address_gyro
         self.address_magnet = address_magnet
         # check id's of accelerometer/gyro and magnetometer
         if (self.read_id_magnet() != b'=') or (self.read_id_gyro() != b'h'):
             raise OSError("Invalid LSM9DS1 device, using address {}/{}".format(
                     address_gyro,address_magnet))
+        # shadowed control registers
+        self.regs = RegMap(i2c, address_gyro, LAYOUT_GYRO_ACCEL, BLOCKS_GYRO_ACCEL)
+        self.regs_magnet = RegMap(i2c, address_magnet, LAYOUT_MAGNET, BLOCKS_MAGNET)
+        self.regs.load()
+        self.regs_magnet.load()
         # allocate scratch buffer for efficient conversions and memread op's
-        self.scratch = array.array('B',[0,0,0,0,0,0])
         self.scratch_int = array.array('h',[0,0,0])
+        self.fifo_src = bytearray(1)
+        self.fifo_raw = array.array('h', bytes(2 * 6 * FIFO_DEPTH))
+        # either fifo_scaled (floats) or fifo_fixed (fixed point samples)
+        self.fifo_scaled = array.array('f', bytes(4 * 6 * FIFO_DEPTH)) if not fixed else None
+        self.fifo_fixed = array.array('i', bytes(4 * 6 * FIFO_DEPTH)) if fixed else None
+        self.clock = None                   # timestamps of the fifo frames, set by init_gyro_accel
+        self.ring = None                    # interrupt driven acquisition, see start_irq
+        self.ring_ts = None                 # timestamps of the frames in ring
+        self.mag_drdy = None                # optional pyb.Pin wired to DRDY_M (see read_magnet_cached)
+        self.mag = (0, 0, 0) if fixed else (0.0, 0.0, 0.0)     # last magnetometer sample
+        self.mag_fresh = False
+        self.mag_status = bytearray(1)
+        self.reset_mag_stats()
+        self.extint = None
+        self.fifo_mode = self.FIFO_CONTINUOUS
+        self.fifo_threshold = 0
+        self.reset_fifo_stats()
+        self.irq_count = 0
+        self._irq_pending = False
+        self._drain_cb = self._drain        # bound once: no allocation in the interrupt handler
         self.init_gyro_accel()
         self.init_magnetometer()
         
@@ -64,31 +185,34 @@ class LSM9DS1:
         assert scale_gyro <= 2, "invalid gyro scaling: %d" % scale_gyro
         assert scale_accel <= 3, "invalid accelerometer scaling: %d" % scale_accel
         
-        i2c = self.i2c
-        addr = self.address_gyro
-        mv = memoryview(self.scratch)        
         # angular control registers 1-3 / Orientation
-        mv[0] = ((sample_rate & 0x07) << 5) | ((self.SCALE_GYRO[scale_gyro][1] & 0x3) << 3) 
-        mv[1:4] = b'\x00\x00\x00'
-        i2c.writeto_mem(addr, CTRL_REG1_G, mv[:5])
         # ctrl4 - enable x,y,z, outputs, no irq latching, no 4D
         # ctrl5 - enable all axes, no decimation
         # ctrl6 - set scaling and sample rate of accel 
-        # ctrl7,8 - leave at default values
+        # ctrl7 - leave at default values
+        # ctrl8 - register address auto increment
         # ctrl9 - FIFO enabled
-        mv[0] = mv[1] = 0x38
-        mv[2] = ((sample_rate & 7) << 5) | ((self.SCALE_ACCEL[scale_accel][1] & 0x3) << 3)
-        mv[3] = 0x00
-        mv[4] = 0x4
-        mv[5] = 0x2
-        i2c.writeto_mem(addr, CTRL_REG4_G, mv[:6])
+        self.regs.update(ODR_G=sample_rate, FS_G=self.SCALE_GYRO[scale_gyro][1], BW_G=0,
+                         CTRL_REG2_G=0, CTRL_REG3_G=0, ORIENT_CFG_G=0,
+                         EN_G=7, LIR_XL1=0, D4_XL1=0, DEC=0, EN_XL=7,
+                         ODR_XL=sample_rate, FS_XL=self.SCALE_ACCEL[scale_accel][1], BW_SCAL_ODR=0, BW_XL=0,
+                         CTRL_REG7_XL=0, BDU=0, IF_ADD_INC=1,
+                         SLEEP_G=0, FIFO_TEMP_EN=0, I2C_DISABLE=0, FIFO_EN=1, STOP_ON_FTH=0)
         
         # fifo: use continous mode (overwrite old data if overflow)
-        i2c.writeto_mem(addr, FIFO_CTRL_REG, b'\x00')
-        i2c.writeto_mem(addr, FIFO_CTRL_REG, b'\xc0')
+        self.set_fifo_mode(self.fifo_mode, self.fifo_threshold)
         
-        self.scale_gyro = 32768 / self.SCALE_GYRO[scale_gyro][0]
-        self.scale_accel = 32768 / self.SCALE_ACCEL[scale_accel][0]
+        self.odr = self.ODR_GYRO_ACCEL[sample_rate]
+        self.clock = FifoClock(self.odr, FIFO_DEPTH) if self.odr else None
+        # counts per unit (floats) or integer scalers in fixed point mode
+        if self.fixed:
+            self.scale_gyro = self.scale_accel = None
+            self.fx_gyro = scaler(self.SCALE_GYRO[scale_gyro][0])
+            self.fx_accel = scaler(self.SCALE_ACCEL[scale_accel][0])
+        else:
+            self.scale_gyro = 32768 / self.SCALE_GYRO[scale_gyro][0]
+            self.scale_accel = 32768 / self.SCALE_ACCEL[scale_accel][0]
+            self.fx_gyro = self.fx_accel = None
         
     def init_magnetometer(self, sample_rate=7, scale_magnet=0):
         """ 
@@ -97,31 +221,37 @@ class LSM9DS1:
         """
         assert sample_rate < 8, "invalid sample rate: %d (0-7)" % sample_rate
         assert scale_magnet < 4, "invalid scaling: %d (0-3)" % scale_magnet
-        i2c = self.i2c
-        addr = self.address_magnet
-        mv = memoryview(self.scratch)       
-        mv[0] = 0x40 | (sample_rate << 2) # ctrl1: high performance mode
-        mv[1] = scale_magnet << 5 # ctrl2: scale, normal mode, no reset
-        mv[2] = 0x00 # ctrl3: continous conversion, no low power, I2C
-        mv[3] = 0x08 # ctrl4: high performance z-axis
-        mv[4] = 0x00 # ctr5: no fast read, no block update
-        i2c.writeto_mem(addr, CTRL_REG1_M, mv[:5])
-        self.scale_factor_magnet = 32768 / ((scale_magnet+1) * 4 )
+        # ctrl1: high performance mode, ctrl2: scale, normal mode, no reset
+        # ctrl3: continous conversion, no low power, I2C, ctrl4: high performance z-axis
+        # ctrl5: no fast read, no block update
+        self.regs_magnet.update(TEMP_COMP=0, OM=2, DO=sample_rate, FAST_ODR=0, ST=0,
+                                FS_M=scale_magnet, REBOOT=0, SOFT_RST=0, LP=0, MD=0,
+                                OMZ=2, BLE_M=0, FAST_READ=0, BDU_M=0)
+        self.odr_magnet = self.ODR_MAGNET[sample_rate]
+        if self.fixed:
+            self.scale_factor_magnet = None
+            self.fx_magnet = scaler((scale_magnet+1) * 4)
+        else:
+            self.scale_factor_magnet = 32768 / ((scale_magnet+1) * 4 )
+            self.fx_magnet = None
+        self._mag_period = int(950000 / self.odr_magnet)   # 95% of the sample period in us
+        self._mag_check = None              # time of the last status check
+        self._mag_next = None               # no new data possible before this time
         
     def calibrate_magnet(self, offset):
         """ 
         offset is a magnet vecor that will be substracted by the magnetometer
         for each measurement. It is written to the magnetometer's offset register
+        (gauss, or fixed point samples with fixed=True)
         """
-        offset = [int(i*self.scale_factor_magnet) for i in offset]
-        mv = memoryview(self.scratch) 
-        mv[0] = offset[0] & 0xff
-        mv[1] = offset[0] >> 8
-        mv[2] = offset[1] & 0xff
-        mv[3] = offset[1] >> 8
-        mv[4] = offset[2] & 0xff
-        mv[5] = offset[2] >> 8
-        self.i2c.writeto_mem(self.address_magnet, OFFSET_REG_X_M, mv[:6])
+        if self.fixed:
+            sc = self.fx_magnet
+            self.regs_magnet.update(OFFSET_X_M=unscale(offset[0], sc), OFFSET_Y_M=unscale(offset[1], sc),
+                                    OFFSET_Z_M=unscale(offset[2], sc))
+            return
+        f = self.scale_factor_magnet
+        self.regs_magnet.update(OFFSET_X_M=int(offset[0]*f), OFFSET_Y_M=int(offset[1]*f),
+                                OFFSET_Z_M=int(offset[2]*f))
                 
     def read_id_gyro(self):
         return self.i2c.readfrom_mem(self.address_gyro, WHO_AM_I, 1)
@@ -134,30 +264,259 @@ class LSM9DS1:
         raw_values: if True, the non-scaled adc values are returned
         """
         mv = memoryview(self.scratch_int)
-        f = self.scale_factor_magnet
         self.i2c.readfrom_mem_into(self.address_magnet, OUT_M | 0x80, mv)
+        if self.fixed:
+            sc = self.fx_magnet
+            return (scale(mv[0], sc), scale(mv[1], sc), scale(mv[2], sc))
+        f = self.scale_factor_magnet
         return (mv[0]/f, mv[1]/f, mv[2]/f)
     
+    def reset_mag_stats(self):
+        self.mag_calls = 0                  # read_magnet_cached calls
+        self.mag_reads = 0                  # 6 byte data reads
+        self.mag_status_reads = 0           # 1 byte status reads
+
+    def mag_stats(self):
+        """Returns (calls, data reads, status reads, data reads saved)."""
+        return self.mag_calls, self.mag_reads, self.mag_status_reads, self.mag_calls - self.mag_reads
+
+    def read_magnet_cached(self):
+        """Returns the magnetometer vector in gauss, but reads it only if the sensor has
+        a new sample: self.mag_fresh tells if it's new, otherwise the last sample is
+        returned. Readiness is taken from the DRDY_M pin if mag_drdy is set, else from
+        the status register, which is not even asked until a sample period has passed
+        since the last sample was seen to arrive.
+        """
+        self.mag_calls += 1
+        if self.mag_drdy is not None:
+            ready = self.mag_drdy.value()
+        else:
+            now = time.ticks_us()
+            if self._mag_next is not None and time.ticks_diff(now, self._mag_next) < 0:
+                ready = False
+            else:
+                self.i2c.readfrom_mem_into(self.address_magnet, STATUS_REG_M, self.mag_status)
+                self.mag_status_reads += 1
+                ready = self.mag_status[0] & 0x08  # ZYXDA
+                if ready and self._mag_check is not None:
+                    # the sample arrived after the previous check: the next one can't
+                    # arrive before a period later
+                    self._mag_next = time.ticks_add(self._mag_check, self._mag_period)
+                self._mag_check = now
+        self.mag_fresh = bool(ready)
+        if ready:
+            self.mag_reads += 1
+            self.mag = self.read_magnet()
+        return self.mag
+
+    def read_magnet_new(self):
+        """Returns a new magnetometer sample in gauss or None if there is none yet
+        (for Fusion.update_multirate, see read_magnet_cached)."""
+        m = self.read_magnet_cached()
+        return m if self.mag_fresh else None
+
     def read_gyro(self):
         """Returns gyroscope vector in degrees/sec."""
         mv = memoryview(self.scratch_int)
-        f = self.scale_gyro
         self.i2c.readfrom_mem_into(self.address_gyro, OUT_G | 0x80, mv)
+        if self.fixed:
+            sc = self.fx_gyro
+            return (scale(mv[0], sc), scale(mv[1], sc), scale(mv[2], sc))
+        f = self.scale_gyro
         return (mv[0]/f, mv[1]/f, mv[2]/f)
     
     def read_accel(self):
         """Returns acceleration vector in gravity units (9.81m/s^2)."""
         mv = memoryview(self.scratch_int)
-        f = self.scale_accel
         self.i2c.readfrom_mem_into(self.address_gyro, OUT_XL | 0x80, mv)
+        if self.fixed:
+            sc = self.fx_accel
+            return (scale(mv[0], sc), scale(mv[1], sc), scale(mv[2], sc))
+        f = self.scale_accel
         return (mv[0]/f, mv[1]/f, mv[2]/f)
         
-    def iter_accel_gyro(self):
-        """A generator that returns tuples of (gyro,accelerometer) data from the fifo."""
-        while True:
-            fifo_state = int.from_bytes(self.i2c.readfrom_mem(self.address_gyro, FIFO_SRC, 1),'big')
-            if fifo_state & 0x3f:
-                # print("Available samples=%d" % (fifo_state & 0x1f))
-                yield self.read_gyro(),self.read_accel()
+    def _read_into(self, addr, reg, buf, f, sc, raw):
+        if raw:
+            self.i2c.readfrom_mem_into(addr, reg | 0x80, buf)
+        else:
+            v = self.scratch_int
+            self.i2c.readfrom_mem_into(addr, reg | 0x80, v)
+            if self.fixed:
+                # an array('f') would round the packed ints (no typecode attribute on MicroPython)
+                assert isinstance(buf[0], int), "fixed point samples need an array('i') buffer"
+                buf[0] = scale(v[0], sc)
+                buf[1] = scale(v[1], sc)
+                buf[2] = scale(v[2], sc)
             else:
+                buf[0] = v[0]/f
+                buf[1] = v[1]/f
+                buf[2] = v[2]/f
+        return buf
+
+    def read_magnet_into(self, buf, raw=False):
+        """Reads the magnetometer vector into buf without allocating: an array('f') of 3
+        for gauss or, if raw is True, an array('h') of 3 for adc counts (array('i') for
+        fixed point samples if the driver was created with fixed=True). Returns buf.
+        """
+        return self._read_into(self.address_magnet, OUT_M, buf, self.scale_factor_magnet, self.fx_magnet, raw)
+
+    def read_gyro_into(self, buf, raw=False):
+        """Reads the gyroscope vector into buf (deg/sec or raw counts, see read_magnet_into)."""
+        return self._read_into(self.address_gyro, OUT_G, buf, self.scale_gyro, self.fx_gyro, raw)
+
+    def read_accel_into(self, buf, raw=False):
+        """Reads the acceleration vector into buf (g or raw counts, see read_magnet_into)."""
+        return self._read_into(self.address_gyro, OUT_XL, buf, self.scale_accel, self.fx_accel, raw)
+
+    def set_fifo_mode(self, mode=FIFO_CONTINUOUS, threshold=0):
+        """Sets the fifo mode (FIFO_BYPASS, FIFO_MODE, FIFO_CONTINUOUS, ...) and the
+        threshold level (0-31) that sets the FTH flag of FIFO_SRC (and the threshold
+        interrupt). The fifo is emptied (passes bypass mode).
+        """
+        assert mode in (0, 1, 3, 4, 6), "invalid fifo mode: %d" % mode
+        assert 0 <= threshold < FIFO_DEPTH, "invalid fifo threshold: %d" % threshold
+        self.fifo_mode = mode
+        self.fifo_threshold = threshold
+        self.regs.update(FMODE=self.FIFO_BYPASS)
+        self.regs.update(FMODE=mode, FTH=threshold)
+
+    def fifo_status(self):
+        """Reads FIFO_SRC, returns (frames in fifo, threshold reached, overrun)."""
+        self.i2c.readfrom_mem_into(self.address_gyro, FIFO_SRC, self.fifo_src)
+        v = self.fifo_src[0]
+        return v & 0x3f, bool(v & 0x80), bool(v & 0x40)
+
+    def reset_fifo_stats(self):
+        self.fifo_samples = 0               # frames read by read_fifo
+        self.fifo_drains = 0                # read_fifo calls that found data
+        self.fifo_overruns = 0              # drains that found the overrun flag set (frames lost in the chip)
+
+    def fifo_stats(self):
+        """Returns (frames read, drains, overruns, average fifo depth per drain)."""
+        d = self.fifo_drains
+        return self.fifo_samples, d, self.fifo_overruns, self.fifo_samples / d if d else 0
+
+    def read_fifo(self):
+        """Drains the fifo into fifo_raw, returns the number of (gyro,accel) frames.
+        Frame i is fifo_raw[6*i:6*i+6] = gx,gy,gz,ax,ay,az in raw counts. The FIFO_SRC
+        value of the drain stays in fifo_src (bit 7 threshold, bit 6 overrun). In
+        FIFO_MODE a full fifo stops collecting, it's restarted after the drain.
+        The timestamps of the frames are in clock.ts[:n].
+        """
+        i2c = self.i2c
+        addr = self.address_gyro
+        i2c.readfrom_mem_into(addr, FIFO_SRC, self.fifo_src)
+        t = time.ticks_us()
+        src = self.fifo_src[0]
+        n = src & 0x3f
+        if not n:
+            return 0
+        # one transfer for all n frames, the address rolls over 0x1d->0x28, 0x2d->0x18
+        i2c.readfrom_mem_into(addr, OUT_G | 0x80, memoryview(self.fifo_raw)[:6 * n])
+        self.fifo_samples += n
+        self.fifo_drains += 1
+        if self.clock is not None:
+            self.clock.update(t, n, src & 0x40)
+        if src & 0x40:
+            self.fifo_overruns += 1
+            if self.fifo_mode == self.FIFO_MODE:
+                self.set_fifo_mode(self.FIFO_MODE, self.fifo_threshold)
+        return n
+
+    def scale_fifo(self, n, out=None):
+        """Converts the first n frames of fifo_raw to deg/sec and g. Writes into out
+        (array('f') of at least 6*n) or the internal fifo_scaled buffer and returns it.
+        With fixed=True: fixed point samples into out (array('i')) or fifo_fixed.
+        """
+        raw = self.fifo_raw
+        if self.fixed:
+            if out is None:
+                out = self.fifo_fixed
+            sg = self.fx_gyro
+            sa = self.fx_accel
+            for i in range(0, 6 * n, 6):
+                out[i] = scale(raw[i], sg)
+                out[i+1] = scale(raw[i+1], sg)
+                out[i+2] = scale(raw[i+2], sg)
+                out[i+3] = scale(raw[i+3], sa)
+                out[i+4] = scale(raw[i+4], sa)
+                out[i+5] = scale(raw[i+5], sa)
+            return out
+        if out is None:
+            out = self.fifo_scaled
+        fg = 1 / self.scale_gyro
+        fa = 1 / self.scale_accel
+        for i in range(0, 6 * n, 6):
+            out[i] = raw[i] * fg
+            out[i+1] = raw[i+1] * fg
+            out[i+2] = raw[i+2] * fg
+            out[i+3] = raw[i+3] * fa
+            out[i+4] = raw[i+4] * fa
+            out[i+5] = raw[i+5] * fa
+        return out
+
+    def start_irq(self, pin, threshold=16, frames=64, int_pin=1):
+        """Starts interrupt driven acquisition: the chip raises INT1 (or INT2 if int_pin is 2)
+        when the fifo holds threshold frames (1-31, 0: on every gyro data ready), the
+        handler schedules a drain of the fifo into the ring buffer self.ring (frames of
+        gx,gy,gz,ax,ay,az raw counts). pin is the pyboard pin wired to the interrupt line.
+        """
+        import pyb
+        assert 0 <= threshold < FIFO_DEPTH, "invalid fifo threshold: %d" % threshold
+        if self.ring is None or self.ring.frames != frames:
+            self.ring = RingBuffer(frames, 6)
+            self.ring_ts = RingBuffer(frames, 1, 'i')
+        self.reset_fifo_stats()
+        self.irq_count = 0
+        self._irq_pending = False
+        self.set_fifo_mode(self.FIFO_CONTINUOUS, threshold)
+        # INT_FTH (bit 3) or INT_DRDY_G (bit 1) on the selected interrupt line
+        self.regs['INT1_CTRL' if int_pin == 1 else 'INT2_CTRL'] = 0x08 if threshold else 0x02
+        self.regs.flush()
+        self.extint = pyb.ExtInt(pin, pyb.ExtInt.IRQ_RISING, pyb.Pin.PULL_NONE, self._irq)
+
+    def stop_irq(self):
+        """Disables the interrupt, the ring buffer keeps its content."""
+        if self.extint is not None:
+            self.extint.disable()
+            self.extint = None
+        self.regs.update(INT1_CTRL=0, INT2_CTRL=0)
+
+    def _irq(self, line):
+        # hard interrupt: no I2C and no allocation here, the drain runs as soon as possible
+        # in thread context. One pending drain is enough, it empties the whole fifo.
+        self.irq_count += 1
+        if not self._irq_pending:
+            self._irq_pending = True
+            micropython.schedule(self._drain_cb, 0)
+
+    def _drain(self, arg):
+        self._irq_pending = False
+        n = self.read_fifo()
+        self.ring.put(self.fifo_raw, n)
+        self.ring_ts.put(self.clock.ts, n)
+
+    def iter_accel_gyro(self, timestamps=False):
+        """A generator that returns tuples of (gyro,accelerometer) data from the fifo,
+        or (gyro,accelerometer,ticks_us) if timestamps is True."""
+        while True:
+            n = self.read_fifo()
+            if not n:
                 break
+            raw = self.fifo_raw
+            ts = self.clock.ts
+            fg = self.scale_gyro
+            fa = self.scale_accel
+            sg = self.fx_gyro
+            sa = self.fx_accel
+            for i in range(0, 6 * n, 6):
+                if self.fixed:
+                    g = (scale(raw[i], sg), scale(raw[i+1], sg), scale(raw[i+2], sg))
+                    a = (scale(raw[i+3], sa), scale(raw[i+4], sa), scale(raw[i+5], sa))
+                else:
+                    g = (raw[i]/fg, raw[i+1]/fg, raw[i+2]/fg)
+                    a = (raw[i+3]/fa, raw[i+4]/fa, raw[i+5]/fa)
+                if timestamps:
+                    yield g, a, ts[i // 6]
+                else:
+                    yield g, a
@@ -0,0 +1,208 @@
+"""
+Streaming magnetometer calibration (hard and soft iron) for MicroPython
+
+Fits an ellipsoid to the magnetometer samples while the application keeps
+running. Instead of collecting samples (like Fusion.calibrate) the fit is
+updated with every sample by recursive least squares, so memory and work per
+sample are constant (9 parameters, 9x9 covariance).
+
+The ellipsoid is described by
+    A x^2 + B y^2 + C z^2 + 2D xy + 2E xz + 2F yz + 2G x + 2H y + 2I z = 1
+its center is the hard iron offset, its shape the soft iron distortion.
+The hard iron offset can be written to the offset registers of the LSM9DS1,
+the sensor then subtracts it in hardware and no host side correction is
+needed per sample. The soft iron matrix is available for applications that
+need it (correct method).
+
+Constant doesn't mean cheap: a fitted sample costs about 500 interpreted float
+operations (the 9x9 covariance update dominates), in the order of a few ms on
+a Pyboard (estimated, not measured). That is too expensive for every sample at
+IMU rate, so feed it from the magnetometer rate at most and use decimate to fit
+only every n-th sample; the skipped calls return after a counter increment. A
+field that changes slowly (the device is turned by hand) needs no more than
+some 10 fitted samples per second.
+
+The fit works on floats. With an LSM9DS1(fixed=True) create the calibration
+with fixed=True: update and correct then take fixed point samples (converted
+with fixedpoint.fixed_to_float) and push writes a fixed point offset.
+
+Example usage:
+>>> from magcal import MagCalibration
+>>> cal = MagCalibration(decimate=8)    # 80 Hz magnetometer: 10 fitted samples/s
+>>> pushed = False
+>>> while True:
+...     for g, a in s.lsm.iter_accel_gyro():
+...         fuse.update_nomag(a, g)
+...     cal.update(s.lsm.read_magnet())     # once per loop, not per IMU sample
+...     if cal.ready() and not pushed:
+...         cal.push(s.lsm, fuse)           # hard iron -> LSM9DS1 offset registers
+...         pushed = True
+"""
+from math import sqrt
+from fixedpoint import pack, fixed_to_float
+
+class MagCalibration:
+    def __init__(self, forget=0.999, decimate=1, min_samples=200, p0=1000.0, fixed=False):
+        """
+        forget: RLS forgetting factor (1: never forget, 0.999: ~1000 samples memory)
+        decimate: only every n-th sample passed to update is used
+        min_samples: samples needed before the fit is considered valid
+        fixed: samples are fixed point (see fixedpoint.py), as from LSM9DS1(fixed=True)
+        """
+        self.fixed = fixed
+        self.forget = forget
+        self.decimate = decimate
+        self.min_samples = min_samples
+        self.theta = [0.0] * 9                      # ellipsoid parameters A..I
+        self.P = [0.0] * 81                         # covariance, row major
+        for i in range(9):
+            self.P[i * 10] = p0
+        self.phi = [0.0] * 9                        # scratch: regressor
+        self.Pphi = [0.0] * 9                       # scratch: P * phi
+        self.applied = [0.0, 0.0, 0.0]              # offset currently subtracted by the sensor
+        self.count = 0
+        self.samples = 0
+        self.soft_iron = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+    def update(self, mag):
+        """ adds one magnetometer sample (x, y, z) as read from the sensor """
+        self.count += 1
+        if self.count < self.decimate:
+            return
+        self.count = 0
+        a = self.applied
+        if self.fixed:
+            x = fixed_to_float(mag[0]) + a[0]
+            y = fixed_to_float(mag[1]) + a[1]
+            z = fixed_to_float(mag[2]) + a[2]
+        else:
+            x = mag[0] + a[0]   # undo the sensor offset, the fit is done on the raw field
+            y = mag[1] + a[1]
+            z = mag[2] + a[2]
+        phi = self.phi
+        phi[0] = x * x
+        phi[1] = y * y
+        phi[2] = z * z
+        phi[3] = 2 * x * y
+        phi[4] = 2 * x * z
+        phi[5] = 2 * y * z
+        phi[6] = 2 * x
+        phi[7] = 2 * y
+        phi[8] = 2 * z
+        P = self.P
+        Pphi = self.Pphi
+        theta = self.theta
+        # P * phi and phi' * P * phi
+        denom = self.forget
+        err = 1.0
+        for i in range(9):
+            s = 0.0
+            row = i * 9
+            for j in range(9):
+                s += P[row + j] * phi[j]
+            Pphi[i] = s
+            denom += phi[i] * s
+            err -= phi[i] * theta[i]
+        # parameter update with gain k = P * phi / denom
+        k = err / denom
+        for i in range(9):
+            theta[i] += Pphi[i] * k
+        # covariance update P = (P - P phi phi' P / denom) / forget (P is symmetric)
+        f = 1 / self.forget
+        g = 1 / denom
+        for i in range(9):
+            row = i * 9
+            pi = Pphi[i] * g
+            for j in range(9):
+                P[row + j] = (P[row + j] - pi * Pphi[j]) * f
+        self.samples += 1
+
+    def _matrix(self):
+        A, B, C, D, E, F, G, H, I = self.theta
+        return (A, D, E), (D, B, F), (E, F, C), (G, H, I)
+
+    def ready(self):
+        """ True if enough samples were fitted and the result is an ellipsoid """
+        if self.samples < self.min_samples:
+            return False
+        M = self._matrix()
+        # positive definite (Sylvester's criterion)
+        a, b, c = M[0], M[1], M[2]
+        d2 = a[0] * b[1] - a[1] * b[0]
+        d3 = a[0] * (b[1] * c[2] - b[2] * c[1]) - a[1] * (b[0] * c[2] - b[2] * c[0]) + a[2] * (b[0] * c[1] - b[1] * c[0])
+        return a[0] > 0 and d2 > 0 and d3 > 0
+
+    def center(self):
+        """ hard iron offset (x, y, z) in sensor units: solves M c = -v """
+        a, b, c, v = self._matrix()
+        det = a[0] * (b[1] * c[2] - b[2] * c[1]) - a[1] * (b[0] * c[2] - b[2] * c[0]) + a[2] * (b[0] * c[1] - b[1] * c[0])
+        if det == 0:
+            return tuple(self.applied)
+        # inverse of the symmetric matrix by cofactors
+        i00 = b[1] * c[2] - b[2] * c[1]
+        i01 = a[2] * c[1] - a[1] * c[2]
+        i02 = a[1] * b[2] - a[2] * b[1]
+        i11 = a[0] * c[2] - a[2] * c[0]
+        i12 = a[2] * b[0] - a[0] * b[2]
+        i22 = a[0] * b[1] - a[1] * b[0]
+        return (-(i00 * v[0] + i01 * v[1] + i02 * v[2]) / det,
+                -(i01 * v[0] + i11 * v[1] + i12 * v[2]) / det,
+                -(i02 * v[0] + i12 * v[1] + i22 * v[2]) / det)
+
+    def solve(self):
+        """
+        computes the soft iron matrix W (upper triangular, Cholesky factor of the
+        ellipsoid matrix) scaled to keep the mean field strength, so that
+        W * (m - center) lies on a sphere. Returns (center, W).
+        """
+        c = self.center()
+        a, b, d, v = self._matrix()
+        # Cholesky M = L L', W = L'
+        l00 = sqrt(a[0])
+        l10 = b[0] / l00
+        l20 = d[0] / l00
+        l11 = sqrt(b[1] - l10 * l10)
+        l21 = (d[1] - l20 * l10) / l11
+        l22 = sqrt(d[2] - l20 * l20 - l21 * l21)
+        # scale: normalise W to determinant 1 (keeps the field magnitude on average)
+        s = 1 / (l00 * l11 * l22) ** (1 / 3)
+        self.soft_iron = ((l00 * s, l10 * s, l20 * s), (0.0, l11 * s, l21 * s), (0.0, 0.0, l22 * s))
+        return c, self.soft_iron
+
+    def push(self, lsm, fusion=None):
+        """
+        writes the hard iron offset into the LSM9DS1 offset registers (the sensor
+        then returns corrected values) and clears the host side bias of a Fusion
+        instance. The fit continues on the raw field, so push can be called again.
+        Returns the offset in gauss.
+        """
+        if lsm.fixed != self.fixed:
+            raise ValueError("LSM9DS1 fixed={} but MagCalibration fixed={}".format(lsm.fixed, self.fixed))
+        c = self.center()
+        if self.fixed:
+            exp = lsm.fx_magnet[1]
+            lsm.calibrate_magnet([pack(int(round(v * 10 ** -exp)), exp) for v in c])
+        else:
+            lsm.calibrate_magnet(c)
+        self.applied[0], self.applied[1], self.applied[2] = c
+        if fusion is not None:
+            fusion.magbias = (0, 0, 0)
+        return c
+
+    def correct(self, mag):
+        """
+        soft iron correction of a sample that has the hard iron offset already
+        removed (by the sensor after push). Call solve first. Returns floats
+        (gauss) also for fixed point samples.
+        """
+        c = self.center()
+        a = self.applied
+        if self.fixed:
+            mag = (fixed_to_float(mag[0]), fixed_to_float(mag[1]), fixed_to_float(mag[2]))
+        x = mag[0] + a[0] - c[0]
+        y = mag[1] + a[1] - c[1]
+        z = mag[2] + a[2] - c[2]
+        w = self.soft_iron
+        return (w[0][0] * x + w[0][1] * y + w[0][2] * z,
+                w[1][1] * y + w[1][2] * z,
+                w[2][2] * z)
@@ -23,9 +23,9 @@ test(s)
 #s = uSenseHAT(I2C(1))
 #fuse = Fusion()
 #balance = Balance(s.matrix)
+#fuse.set_multirate(s.lsm.odr, s.lsm.odr_magnet)
 #
 #while (1):
-#    for g,a in s.lsm.iter_accel_gyro():
-#        fuse.update(a, g, s.lsm.read_magnet())
-#        balance.update(fuse.heading, fuse.pitch, fuse.roll)
+#    fuse.update_batch(s.lsm.iter_accel_gyro(), s.lsm.odr, readmag=s.lsm.read_magnet_new)
+#    balance.update(fuse.heading, fuse.pitch, fuse.roll)
 #    pyb.delay(5)
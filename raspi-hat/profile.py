@@ -1,11 +1,14 @@
 import pyb
 
+last_us = 0     # duration of the last timed call in us
+
 def timed_function(f, *args, **kwargs):
     myname = str(f)
     def new_func(*args, **kwargs):
+        global last_us
         t = pyb.micros()
         result = f(*args, **kwargs)
-        delta = pyb.elapsed_micros(t)
+        delta = last_us = pyb.elapsed_micros(t)
         print('{} Time = {:6.3f}mS'.format(myname, delta/1000))
         return result
     return new_func
@@ -0,0 +1,181 @@
+"""
+Declarative register maps with shadow registers for I2C devices
+
+A device is described by a layout dict that maps field names to a register
+address, bit position and bit length, written like the uctypes bitfield
+layouts (see pico/dma.py):
+
+    LAYOUT = {
+        'ODR_G':   0x10 | 5 << BF_POS | 3 << BF_LEN,    # bits 7-5 of 0x10
+        'H_OUT':   0x28 | 0 << BF_POS | 16 << BF_LEN | SIGNED,   # 2 bytes, little endian
+    }
+
+and a list of register blocks (start address, number of registers) that
+are kept in a local shadow copy. Fields are read from and written to the
+shadow; flush sends all changed bytes of a block in one write and skips
+blocks without changes. So reconfiguring a single field touches only its
+register, and setting a field to the value it already has costs no bus
+transaction at all. Data (read only) registers are described the same way
+and brought into the shadow with load.
+
+Self-clearing bits (one-shot triggers, resets) can't be shadowed: strobe
+writes the register with the bit set but leaves it cleared in the shadow,
+read reads a field directly from the device.
+
+Example usage:
+>>> from regmap import RegMap, BF_POS, BF_LEN
+>>> regs = RegMap(i2c, 0x5f, HTS221_LAYOUT, ((0x10, 1), (0x20, 3), (0x27, 5)))
+>>> regs.load()                   # shadow <- device
+>>> regs.update(PD=1, BDU=1)      # one write of CTRL_REG1
+>>> regs.update(PD=1)             # no change: no write
+>>> regs.strobe('ONE_SHOT')       # start a conversion
+>>> regs.load(0x27); regs['T_OUT']
+>>> regs.writes, regs.skipped
+(2, 1)
+"""
+try:
+    from micropython import const
+except ImportError:
+    const = lambda x: x
+
+BF_POS = const(17)
+BF_LEN = const(22)
+SIGNED = const(1 << 27)
+
+def _decode(f):
+    return f & 0xffff, (f >> BF_POS) & 0x1f, (f >> BF_LEN) & 0x1f, f & SIGNED
+
+class RegMap:
+    def __init__(self, i2c, addr, layout, blocks, autoinc=0x80):
+        """
+        layout: dict of fields, blocks: ((start register, count), ...)
+        autoinc: flag ORed to the register address for multi byte transfers
+        (0x80 for the ST sensors, 0 for devices that always auto increment)
+        """
+        self.i2c = i2c
+        self.addr = addr
+        self.layout = layout
+        self.autoinc = autoinc
+        self.blocks = [(start, bytearray(n)) for start, n in blocks]
+        self.dirty = [None] * len(self.blocks)     # (first, last) changed offset per block
+        self.scratch = bytearray(4)
+        self.writes = 0                     # flushes that went to the bus
+        self.skipped = 0                    # flushes without changes
+
+    def _locate(self, reg):
+        for i, (start, buf) in enumerate(self.blocks):
+            if start <= reg < start + len(buf):
+                return i, reg - start
+        raise KeyError("register 0x%02x not in register map" % reg)
+
+    def buffer(self, reg):
+        """ shadow bytearray of the block that contains reg and the offset of reg in it """
+        i, ofs = self._locate(reg)
+        return self.blocks[i][1], ofs
+
+    def load(self, reg=None):
+        """ reads the block containing reg (all blocks if None) from the device into the shadow """
+        for i, (start, buf) in enumerate(self.blocks):
+            if reg is None or start <= reg < start + len(buf):
+                self.i2c.readfrom_mem_into(self.addr, start | (self.autoinc if len(buf) > 1 else 0), buf)
+                self.dirty[i] = None
+
+    def touch(self, reg, n=1):
+        """ marks n registers starting at reg as changed (after writing to buffer() directly) """
+        i, ofs = self._locate(reg)
+        d = self.dirty[i]
+        last = ofs + n - 1
+        self.dirty[i] = (ofs, last) if d is None else (min(d[0], ofs), max(d[1], last))
+
+    @staticmethod
+    def _get(buf, ofs, pos, length, signed):
+        nbytes = (pos + length + 7) >> 3
+        v = 0
+        for k in range(nbytes - 1, -1, -1):
+            v = (v << 8) | buf[ofs + k]
+        v = (v >> pos) & ((1 << length) - 1)
+        if signed and v & (1 << (length - 1)):
+            v -= 1 << length
+        return v
+
+    def __getitem__(self, name):
+        """ field value from the shadow """
+        reg, pos, length, signed = _decode(self.layout[name])
+        i, ofs = self._locate(reg)
+        return self._get(self.blocks[i][1], ofs, pos, length, signed)
+
+    def __setitem__(self, name, value):
+        """ sets a field in the shadow, marks its bytes as changed if the value differs """
+        reg, pos, length, signed = _decode(self.layout[name])
+        i, ofs = self._locate(reg)
+        buf = self.blocks[i][1]
+        mask = ((1 << length) - 1) << pos
+        value = (value << pos) & mask
+        for k in range((pos + length + 7) >> 3):
+            m = mask & 0xff
+            b = (buf[ofs + k] & ~m) | (value & 0xff)
+            if b != buf[ofs + k]:
+                buf[ofs + k] = b
+                self.touch(reg + k)
+            mask >>= 8
+            value >>= 8
+
+    def flush(self, limit=0):
+        """
+        writes the changed bytes of every block (one transfer per block)
+        limit: at most limit bytes per transfer (0: no limit), the rest stays marked
+        as changed. Returns True if changes are left for another flush.
+        """
+        changed = False
+        left = False
+        for i, (start, buf) in enumerate(self.blocks):
+            d = self.dirty[i]
+            if d is not None:
+                first, last = d
+                if limit and last - first >= limit:
+                    self.dirty[i] = (first + limit, last)
+                    last = first + limit - 1
+                    left = True
+                else:
+                    self.dirty[i] = None
+                reg = start + first
+                self.i2c.writeto_mem(self.addr, reg | (self.autoinc if last > first else 0),
+                                     memoryview(buf)[first:last + 1])
+                self.writes += 1
+                changed = True
+        if not changed:
+            self.skipped += 1
+        return left
+
+    def pending(self):
+        """ True if the shadow has changes that weren't flushed """
+        for d in self.dirty:
+            if d is not None:
+                return True
+        return False
+
+    def update(self, **fields):
+        """ sets several fields and flushes """
+        for name in fields:
+            self[name] = fields[name]
+        self.flush()
+
+    def strobe(self, name, value=1):
+        """
+        writes the register of a self-clearing field with the field set to value
+        (together with the shadowed other bits), the shadow keeps the field cleared
+        """
+        reg, pos, length, signed = _decode(self.layout[name])
+        i, ofs = self._locate(reg)
+        s = self.scratch
+        s[0] = (self.blocks[i][1][ofs] & ~(((1 << length) - 1) << pos)) | ((value << pos) & 0xff)
+        self.i2c.writeto_mem(self.addr, reg, memoryview(s)[:1])
+        self.writes += 1
+
+    def read(self, name):
+        """ reads a field directly from the device, the shadow is not changed """
+        reg, pos, length, signed = _decode(self.layout[name])
+        n = (pos + length + 7) >> 3
+        s = memoryview(self.scratch)[:n]
+        self.i2c.readfrom_mem_into(self.addr, reg | (self.autoinc if n > 1 else 0), s)
+        return self._get(s, 0, pos, length, signed)
@@ -0,0 +1,95 @@
+"""
+Preallocated ring buffer of fixed size sample frames for MicroPython
+
+A frame is a group of `width` values (e.g. gx,gy,gz,ax,ay,az raw counts of
+the LSM9DS1). The storage is a single array allocated once, put and get copy
+values without allocating, so the buffer can be filled from an interrupt
+handler (scheduled with micropython.schedule) while the main loop reads it.
+
+There's one writer (the interrupt side, moves only head) and one reader (the
+main loop, moves only tail), so no locking is needed. When the buffer is full
+new frames are dropped and counted in `dropped`, the frames already in the
+buffer are never overwritten while the reader may be copying them.
+
+Example usage:
+>>> from ringbuf import RingBuffer
+>>> rb = RingBuffer(64, 6)                  # 64 frames of 6 int16
+>>> rb.put(lsm.fifo_raw, lsm.read_fifo())   # writer
+>>> buf = array.array('h', bytes(2 * 6 * 16))
+>>> n = rb.get_into(buf)                    # reader: frames copied (0 if empty)
+>>> len(rb), rb.dropped, rb.high_water
+(0, 0, 12)
+"""
+import array
+
+class RingBuffer:
+    def __init__(self, frames, width=1, typecode='h'):
+        self.frames = frames
+        self.width = width
+        self.data = array.array(typecode, [0] * (frames * width))
+        self.head = 0                       # next frame to write (writer only)
+        self.tail = 0                       # next frame to read (reader only)
+        self.dropped = 0                    # frames lost because the buffer was full
+        self.high_water = 0                 # maximum occupancy seen
+
+    def __len__(self):
+        """ number of frames that can be read """
+        return self._count()
+
+    def _count(self):
+        n = self.head - self.tail           # indices run modulo 2 * frames: full and empty differ
+        if n < 0:
+            n += 2 * self.frames
+        return n
+
+    def free(self):
+        return self.frames - self._count()
+
+    def put(self, src, n=1):
+        """ appends the first n frames of src (array of n * width values), returns the number stored """
+        room = self.frames - self._count()
+        if n > room:
+            self.dropped += n - room
+            n = room
+        data = self.data
+        width = self.width
+        size = self.frames * width
+        head = self.head
+        i = (head % self.frames) * width
+        for k in range(n * width):
+            data[i] = src[k]
+            i += 1
+            if i == size:
+                i = 0
+        self.head = (head + n) % (2 * self.frames)
+        count = self._count()
+        if count > self.high_water:
+            self.high_water = count
+        return n
+
+    def get_into(self, dst, n=None):
+        """
+        copies up to n frames (default: as many as fit into dst) into dst and
+        removes them from the buffer, returns the number of frames copied
+        """
+        width = self.width
+        if n is None:
+            n = len(dst) // width
+        count = self._count()
+        if n > count:
+            n = count
+        data = self.data
+        size = self.frames * width
+        tail = self.tail
+        i = (tail % self.frames) * width
+        for k in range(n * width):
+            dst[k] = data[i]
+            i += 1
+            if i == size:
+                i = 0
+        self.tail = (tail + n) % (2 * self.frames)
+        return n
+
+    def clear(self):
+        """ drops all frames (reader side) """
+        self.tail = self.head
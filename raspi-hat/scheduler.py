@@ -0,0 +1,220 @@
+"""
+uasyncio acquisition scheduler for the SenseHAT
+
+The scheduler owns the I2C bus of a uSenseHAT: all bus traffic runs in its
+tasks, one task per job, and consumers get the results as they come in by
+subscribing to topics instead of calling the blocking get_xxx methods.
+
+    task     job
+    imu      drains the LSM9DS1 fifo every imu_ms, reads new magnetometer samples
+    matrix   refreshes changed LED pixels in chunks, polls the joystick
+    env      one-shot conversions of HTS221 and LPS25 every env_ms
+
+All tasks run in one event loop and none of them awaits in the middle of a
+sequence of transfers, so the bus needs no lock: the transfers of different
+tasks never interleave and the task that wakes up first uses the bus first.
+Slow jobs are split into steps: the environment sensors convert while the
+task sleeps (for the drivers' expected conversion time, then their poll() is
+asked), the 192 byte LED refresh is written in chunks of chunk bytes. The imu
+drain has precedence: before every step the matrix and env tasks check when
+the next drain is due, and if that is within guard_ms they wait until the
+imu task has run. imu_late is the longest delay of a drain after its due
+time in ms.
+
+A bus error (OSError: no acknowledge, sensor timeout) doesn't end a task: it
+is counted in errors[task], published on the 'error' topic and the task
+tries again after backoff_ms.
+
+Topics and values passed to the subscribers (called in the scheduler task,
+the values are only valid during the call):
+
+    'imu'    n: frames in lsm.fifo_raw (gx,gy,gz,ax,ay,az raw counts), timestamps in lsm.clock.ts
+    'mag'    (x, y, z) gauss, when a new magnetometer sample was read
+    'env'    (temperature, humidity, pressure): average of both temperature sensors, %rH, hPa
+    'keys'   joystick state (SenseAtmel.KEY_xxx bits), when it changes
+    'error'  (task name, OSError), when a bus error interrupted a task
+
+Example usage:
+>>> import uasyncio as asyncio
+>>> from sensehat import uSenseHAT
+>>> sense = uSenseHAT(I2C(1))
+>>> sched = sense.scheduler(imu_ms=20, env_ms=2000)
+>>> sched.subscribe('env', lambda v: print("{:.1f}deg {:.1f}%rH {:.0f}hPa".format(*v)))
+>>> sched.subscribe('imu', lambda n: fuse.update_batch(iter_frames(sense.lsm.fifo_raw, n,
+...                 (sense.lsm.scale_gyro, sense.lsm.scale_accel)), sense.lsm.odr))
+>>> sched.subscribe('error', print)
+>>> sense.matrix.set_pixel(4, 4, (20, 20, 0))   # no refresh: the matrix task sends it
+>>> sched.run()             # or sched.start() in an application that runs its own loop
+>>> sched.errors, sched.imu_late
+({'imu': 0, 'env': 0, 'matrix': 0}, 1)
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import time
+from atmel import RPISENSE_FB
+
+if hasattr(asyncio, 'sleep_ms'):
+    sleep_ms = asyncio.sleep_ms
+else:
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+class Scheduler:
+    TOPICS = ('imu', 'mag', 'env', 'keys', 'error')
+
+    def __init__(self, sense, imu_ms=20, env_ms=1000, matrix_ms=20, chunk=48, poll_ms=2,
+                 guard_ms=2, backoff_ms=100):
+        """
+        sense: uSenseHAT, imu_ms: fifo drain period (the fifo holds 32 frames, at most
+        33 ms at 952 Hz), env_ms: environment measurement period, matrix_ms: LED and
+        joystick poll period, chunk: bytes per LED refresh transfer,
+        poll_ms: status poll interval once the expected conversion time has passed,
+        guard_ms: the other tasks wait for the imu drain if it is due within guard_ms,
+        backoff_ms: pause of a task after a bus error
+        """
+        self.sense = sense
+        self.imu_ms = imu_ms
+        self.env_ms = env_ms
+        self.matrix_ms = matrix_ms
+        self.chunk = chunk
+        self.poll_ms = poll_ms
+        self.guard_ms = guard_ms
+        self.backoff_ms = backoff_ms
+        self.subscribers = {}
+        for topic in self.TOPICS:
+            self.subscribers[topic] = []
+        self.tasks = []
+        self.keys = 0
+        self.imu_due = None                 # ticks_ms of the next drain while the imu task runs
+        self.imu_late = 0
+        self.runs = {'imu': 0, 'env': 0, 'matrix': 0}
+        self.errors = {'imu': 0, 'env': 0, 'matrix': 0}
+
+    def subscribe(self, topic, callback):
+        """ calls callback(value) for every result published on topic """
+        self.subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic, callback):
+        self.subscribers[topic].remove(callback)
+
+    def publish(self, topic, value):
+        for cb in self.subscribers[topic]:
+            cb(value)
+
+    def _error(self, task, e):
+        self.errors[task] += 1
+        self.publish('error', (task, e))
+
+    async def _yield_to_imu(self):
+        """ waits until the imu task has run if its drain is due within guard_ms """
+        due = self.imu_due
+        while due is not None and self.imu_due == due:
+            wait = time.ticks_diff(due, time.ticks_ms())
+            if wait >= self.guard_ms:
+                return
+            await sleep_ms(wait if wait > 0 else 0)
+
+    async def imu_task(self):
+        lsm = self.sense.lsm
+        self.imu_due = time.ticks_ms()
+        try:
+            while True:
+                late = time.ticks_diff(time.ticks_ms(), self.imu_due)
+                if late > self.imu_late:
+                    self.imu_late = late
+                try:
+                    n = lsm.read_fifo()
+                    mag = lsm.read_magnet_new()
+                except OSError as e:
+                    self.imu_due = time.ticks_add(time.ticks_ms(), self.backoff_ms)
+                    self._error('imu', e)
+                    await sleep_ms(self.backoff_ms)
+                    continue
+                self.runs['imu'] += 1
+                if n:
+                    self.publish('imu', n)
+                if mag is not None:
+                    self.publish('mag', mag)
+                self.imu_due = time.ticks_add(time.ticks_ms(), self.imu_ms)
+                await sleep_ms(self.imu_ms)
+        finally:
+            self.imu_due = None
+
+    async def _measure_env(self):
+        sense = self.sense
+        await self._yield_to_imu()
+        sense.measure()
+        # the sensors convert while the bus is free for the other tasks (continuous
+        # mode: measure has read the latest results already)
+        if not (sense.hts.measure_done and sense.lps.measure_done):
+            await sleep_ms(max(sense.hts.conversion_ms, sense.lps.conversion_ms))
+        tries = 0
+        while True:
+            await self._yield_to_imu()
+            if sense.hts.poll() and sense.lps.poll():
+                break
+            tries += 1
+            if tries > 100:
+                raise OSError("Timeout Sensor")
+            await sleep_ms(self.poll_ms)
+        return sense.get_temperature(), sense.get_humidity(), sense.get_pressure()
+
+    async def env_task(self):
+        while True:
+            t0 = time.ticks_ms()
+            try:
+                value = await self._measure_env()
+            except OSError as e:
+                self._error('env', e)
+                await sleep_ms(self.backoff_ms)
+                continue
+            self.runs['env'] += 1
+            self.publish('env', value)
+            wait = self.env_ms - time.ticks_diff(time.ticks_ms(), t0)
+            await sleep_ms(wait if wait > 0 else 0)
+
+    async def matrix_task(self):
+        matrix = self.sense.matrix
+        while True:
+            try:
+                await self._yield_to_imu()
+                keys = matrix.read_key()
+                if keys != self.keys:
+                    self.keys = keys
+                    self.publish('keys', keys)
+                # one chunk per step: the imu task can drain the fifo in between
+                while matrix.regs.pending():
+                    await self._yield_to_imu()
+                    matrix.regs.flush(self.chunk)
+                    await sleep_ms(0)
+            except OSError as e:
+                # the failed chunk isn't marked as changed anymore: send all pixels again
+                matrix.regs.touch(RPISENSE_FB, 192)
+                self._error('matrix', e)
+                await sleep_ms(self.backoff_ms)
+                continue
+            self.runs['matrix'] += 1
+            await sleep_ms(self.matrix_ms)
+
+    def start(self):
+        """ creates the tasks in the running event loop, returns them """
+        self.tasks = [asyncio.create_task(self.imu_task()),
+                      asyncio.create_task(self.matrix_task()),
+                      asyncio.create_task(self.env_task())]
+        return self.tasks
+
+    def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks = []
+
+    async def main(self):
+        self.start()
+        while self.tasks:
+            await sleep_ms(1000)
+
+    def run(self):
+        """ runs the scheduler as the application's event loop (doesn't return) """
+        asyncio.run(self.main())
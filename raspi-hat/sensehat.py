@@ -35,6 +35,16 @@ Example usage:
 ((-0.4037476, 0.8224488, -0.05233765), (-0.009338379, 0.07415771, 0.9942017), 
 (0.5358887, -0.001586914, -0.1228027))
 
+>>> g, a, m = (array.array('f', [0,0,0]) for i in range(3))
+>>> sense.get_imu_into(g, a, m)     # same values as get_imu, written into g, a, m
+
+>>> sense = uSenseHAT(I2C(1), trace=True)   # count bus transfers and time per device/register
+>>> sense.trace.dump()              # host/i2creport.py turns the dump into a report
+
+>>> sense = uSenseHAT(I2C(1), fixed=True)  # integer samples from all sensors, see fixedpoint.py
+>>> sense.scheduler().subscribe('env', print)   # non blocking acquisition, see scheduler.py
+>>> sense.scheduler().run()
+
 The values from gyro/accel/magnetometer can be used to calculate yaw/roll/pitch,
 by using an appopiate fusion algo (e.g. Madgwick algorithm)
 """
@@ -43,20 +53,42 @@ from hts221 import HTS221
 from lps25 import LPS25
 from lsm9ds1 import LSM9DS1
 from atmel import SenseAtmel
+from fixedpoint import mean
 
 class uSenseHAT:    
     I2C_ADDR_MATRIX = const(0x46)
     I2C_ADDR_TEMP_PRESSURE = const(0x5c)
     I2C_ADDR_HUMID_TEMP = const(0x5f)
     
-    def __init__(self, i2c):
-        """ a wrapper class for sensors of a SenseHAT board """
+    def __init__(self, i2c, trace=False, fixed=False):
+        """
+        a wrapper class for sensors of a SenseHAT board
+        trace: True (or the number of table entries) to profile the bus, see i2ctrace.py
+        fixed: all values as fixed point samples instead of floats, see fixedpoint.py
+        """
+        self.fixed = fixed
+        self.trace = None
+        if trace:
+            from i2ctrace import I2CTrace
+            self.trace = I2CTrace(i2c) if trace is True else I2CTrace(i2c, trace)
+            i2c = self.trace
         self.i2c = i2c
         # init drivers
-        self.hts = HTS221(i2c, I2C_ADDR_HUMID_TEMP)
-        self.lps = LPS25(i2c, I2C_ADDR_TEMP_PRESSURE)
-        self.lsm = LSM9DS1(i2c)
-        self.matrix = SenseAtmel(i2c ,I2C_ADDR_MATRIX)
+        self.hts = HTS221(i2c, self.I2C_ADDR_HUMID_TEMP, fixed)
+        self.lps = LPS25(i2c, self.I2C_ADDR_TEMP_PRESSURE, fixed)
+        self.lsm = LSM9DS1(i2c, fixed=fixed)
+        self.matrix = SenseAtmel(i2c, self.I2C_ADDR_MATRIX)
+        self.sched = None
+
+    def scheduler(self, **kw):
+        """
+        returns the uasyncio scheduler that owns the bus of this board (created on the
+        first call with the keyword arguments of scheduler.Scheduler)
+        """
+        if self.sched is None:
+            from scheduler import Scheduler
+            self.sched = Scheduler(self, **kw)
+        return self.sched
 
     def measure(self):
         self.hts.measure()
@@ -70,7 +102,12 @@ class uSenseHAT:
         
     def get_temperature(self):
         """ returns average temperature of hts21 and lps25 chip """
-        return (self.hts.get_temperature() + self.lps.get_temperature()) / 2
+        t1 = self.hts.get_temperature()
+        t2 = self.lps.get_temperature()
+        if self.fixed:
+            # fixed point samples of both chips have different exponents
+            return mean(t1, t2)
+        return (t1 + t2) / 2
         
     def get_humidity(self):
         return self.hts.get_humidity()
@@ -82,3 +119,19 @@ class uSenseHAT:
         """
         return self.lsm.read_gyro(), self.lsm.read_accel(), self.lsm.read_magnet()
                 
+
+    def get_imu_into(self, gyro, accel, magnet, raw=False):
+        """
+        allocation free variant of get_imu: writes the 9DOF data into the
+        caller's arrays (array('f') of 3 each, array('i') with fixed=True, or
+        array('h') if raw is True)
+        """
+        if self.fixed and not raw:
+            # a float array would silently round the packed samples
+            assert isinstance(gyro[0], int) and isinstance(accel[0], int) and isinstance(magnet[0], int), \
+                "fixed=True needs array('i') buffers"
+
+        lsm = self.lsm
+        lsm.read_gyro_into(gyro, raw)
+        lsm.read_accel_into(accel, raw)
+        lsm.read_magnet_into(magnet, raw)